@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Compares SpMM on CSR and on compressed column indices (matrix.CompressedMatrix).
+
+    python benchmark_compression.py --vocab vocab.txt --cooccurrence cooccurrence.shuf.bin
+    python benchmark_compression.py --zipf 100000 10000000
+
+For each matrix, prints the compression ratio of the column indices and the
+time of one product with an n x dim block for scipy, for the CSR kernel
+with the same loops as the compressed one, and for the compressed kernel.
+"""
+
+from __future__ import print_function, absolute_import
+
+import argparse
+import time
+import numpy as np
+import scipy.sparse
+
+import embedding.util as util
+import embedding.matrix as matrix
+import embedding.kernels as kernels
+import embedding.blockcsr as blockcsr
+
+
+def zipf(n, nnz, s=1., seed=0):
+    """Symmetric matrix with about nnz entries whose words are drawn with
+    probability proportional to 1 / rank ** s."""
+    rng = np.random.RandomState(seed)
+    p = 1. / np.arange(1, n + 1) ** s
+    p /= p.sum()
+    row = rng.choice(n, nnz // 2, p=p)
+    col = rng.choice(n, nnz // 2, p=p)
+    val = rng.pareto(1.5, nnz // 2) + 1
+    A = scipy.sparse.csr_matrix((val, (row, col)), shape=(n, n))
+    return (A + A.T).tocsr()
+
+
+def timeit(f, repeats):
+    f()  # warm up
+    begin = time.time()
+    for i in range(repeats):
+        f()
+    return (time.time() - begin) / repeats
+
+
+def benchmark(name, A, dim=50, block=64, repeats=3):
+    A = scipy.sparse.csr_matrix(A, dtype=np.float32)
+    A.sort_indices()
+    C = matrix.CompressedMatrix(A, block)
+    x = np.random.rand(A.shape[1], dim).astype(np.float32)
+
+    scipy_time = timeit(lambda: A * x, repeats)
+    csr_time = timeit(lambda: kernels.csr_mm(A.indptr, A.indices, A.data, x), repeats)
+    comp_time = timeit(lambda: C.dot(x), repeats)
+    print("{:<24} {:>10} {:>12} {:>8.2f}x {:>9.1f} MB {:>9.1f} MB {:>9.4f} s {:>9.4f} s {:>9.4f} s {:>8.2f}x".format(
+          name, A.shape[0], A.nnz, C.ratio, matrix.nbytes(A) / 2. ** 20, C.nbytes / 2. ** 20,
+          scipy_time, csr_time, comp_time, csr_time / comp_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vocab", type=str, default="vocab.txt")
+    parser.add_argument("--cooccurrence", type=str, default=None,
+                        help="GloVe or blocked CSR cooccurrence file (skipped if not given)")
+    parser.add_argument("--zipf", type=int, nargs=2, action="append", default=[], metavar=("N", "NNZ"),
+                        help="Synthetic Zipf matrix with N words and about NNZ non-zeros (can be repeated)")
+    parser.add_argument("--dim", type=int, default=50)
+    parser.add_argument("--block", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    if args.cooccurrence is None and not args.zipf:
+        args.zipf = [(10000, 1000000), (100000, 10000000)]
+
+    print("{:<24} {:>10} {:>12} {:>9} {:>12} {:>12} {:>11} {:>11} {:>11} {:>9}".format(
+          "matrix", "words", "non-zeros", "indices", "CSR", "compressed", "scipy", "kernel", "compressed", "speedup"))
+    if args.cooccurrence is not None:
+        words, _ = util.load_vocab(args.vocab)
+        n = len(words)
+        A = blockcsr.submatrix(args.cooccurrence, n, np.arange(n))
+        benchmark(args.cooccurrence, A, args.dim, args.block, args.repeats)
+    for (n, nnz) in args.zipf:
+        benchmark("zipf " + str(n) + " " + str(nnz), zipf(n, nnz), args.dim, args.block, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import os
+import mmap
+import struct
+import time
+import logging
+import scipy.sparse
+
+import embedding.kernels as kernels
+
+# On-disk layout (all little-endian):
+#
+#   header (64 bytes): magic, version, flags, rows, cols, nnz, block size, number of blocks
+#   block table:       (first row, last row + 1, nnz, byte offset) as int64 per block
+#   blocks:            each 64-byte aligned, containing
+#                          indptr  int64[rows + 1]  (starting at 0 within the block)
+#                          indices int32[nnz]
+#                          values  float32[nnz]
+
+MAGIC = b"EMBCSR\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIqqqqq")
+HEADER_SIZE = 64
+ALIGN = 64
+
+# Records of the GloVe cooccurrence format (1-based indices)
+GLOVE_DTYPE = np.dtype([("ind", "2<i4"), ("val", "<d")])
+
+
+def is_blockcsr(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BlockCSR(object):
+    """Memory-mapped view of a blocked CSR file.
+
+    Opening only reads the header and block table; the blocks are paged in
+    when they are accessed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, rows, cols, nnz, block_size, blocks = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("\"" + filename + "\" is not a blocked CSR file.")
+        if version != VERSION:
+            raise ValueError("\"" + filename + "\" has version " + str(version) +
+                             " (only version " + str(VERSION) + " is supported).")
+        self.shape = (rows, cols)
+        self.nnz = nnz
+        self.block_size = block_size
+        self.blocks = blocks
+        self.table = np.frombuffer(self.mmap, dtype="<i8", count=4 * blocks, offset=HEADER_SIZE).reshape(blocks, 4)
+
+    def block(self, b):
+        """Returns the rows of block b as a (rows x cols) CSR matrix.
+
+        The arrays are read-only views of the file.
+        """
+        start, end, nnz, offset = [int(v) for v in self.table[b]]
+        indptr = np.frombuffer(self.mmap, dtype="<i8", count=end - start + 1, offset=offset)
+        offset += indptr.nbytes
+        indices = np.frombuffer(self.mmap, dtype="<i4", count=nnz, offset=offset)
+        offset += indices.nbytes
+        data = np.frombuffer(self.mmap, dtype="<f4", count=nnz, offset=offset)
+        return scipy.sparse.csr_matrix((data, indices, indptr), shape=(end - start, self.shape[1]), copy=False)
+
+    def row_blocks(self, start, end):
+        """Returns the blocks overlapping rows [start, end)."""
+        return list(range(start // self.block_size, min((end + self.block_size - 1) // self.block_size, self.blocks)))
+
+    def tocsr(self, blocks=None):
+        """Loads the given blocks (all by default) as a full-size CSR matrix.
+
+        Rows outside of the loaded blocks are empty.
+        """
+        if blocks is None:
+            blocks = range(self.blocks)
+        blocks = sorted(blocks)
+
+        rows, cols = self.shape
+        indptr = np.zeros(rows + 1, dtype=np.int64)
+        indices = []
+        data = []
+        nnz = 0
+        for b in blocks:
+            m = self.block(b)
+            start, end = int(self.table[b, 0]), int(self.table[b, 1])
+            indptr[start + 1:end + 1] = np.diff(m.indptr)
+            indices.append(m.indices)
+            data.append(m.data)
+            nnz += m.nnz
+        indptr = np.cumsum(indptr)
+
+        if nnz == 0:
+            return scipy.sparse.csr_matrix(self.shape, dtype=np.float32)
+        return scipy.sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=self.shape)
+
+    def close(self):
+        self.table = None
+        self.mmap.close()
+
+
+def submatrix(filename, n, keep, chunk_size=2 ** 20):
+    """Loads the rows and columns keep (increasing ids) of an n x n
+    cooccurrence file (GloVe or blocked CSR format) as a COO matrix with
+    compacted ids.
+
+    The full matrix is never materialized: GloVe files are filtered one
+    chunk of records at a time, and only the blocks containing kept rows
+    are read from blocked CSR files.
+    """
+    remap = np.full(n, -1, dtype=np.int64)
+    remap[keep] = np.arange(keep.shape[0])
+
+    if is_blockcsr(filename):
+        mat = BlockCSR(filename)
+        blocks = np.unique(keep // mat.block_size)
+        rows, cols, vals = [], [], []
+        for b in blocks:
+            m = mat.block(b).tocoo()
+            row = m.row.astype(np.int64) + int(mat.table[b, 0])
+            col = m.col.astype(np.int64)
+            val = np.array(m.data)
+            k = kernels.remap(row, col, val, remap)
+            rows.append(row[:k])
+            cols.append(col[:k])
+            vals.append(val[:k])
+    else:
+        rows, cols, vals = [], [], []
+        with open(filename, "rb") as f:
+            while True:
+                data = np.fromfile(f, dtype=GLOVE_DTYPE, count=chunk_size)
+                if data.shape[0] == 0:
+                    break
+                row = data["ind"][:, 0].astype(np.int64) - 1
+                col = data["ind"][:, 1].astype(np.int64) - 1
+                val = np.array(data["val"])
+                k = kernels.remap(row, col, val, remap)
+                rows.append(row[:k])
+                cols.append(col[:k])
+                vals.append(val[:k])
+
+    k = keep.shape[0]
+    if not vals:
+        return scipy.sparse.coo_matrix((k, k))
+    return scipy.sparse.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(k, k))
+
+
+def convert(cooccurrence_file, output, n=None, block_size=2 ** 16, chunk_size=2 ** 20):
+    """Streams a GloVe cooccurrence file into the blocked CSR format.
+
+    Only a chunk of records and one block are held in memory at a time; the
+    entries are bucketed by row through two temporary memory-mapped files.
+    """
+
+    logger = logging.getLogger(__name__)
+    begin = time.time()
+
+    filesize = os.stat(cooccurrence_file).st_size
+    assert(filesize % GLOVE_DTYPE.itemsize == 0)
+    nnz = filesize // GLOVE_DTYPE.itemsize
+    logger.info("Number of non-zeros: " + str(nnz))
+
+    def chunks():
+        with open(cooccurrence_file, "rb") as f:
+            while True:
+                data = np.fromfile(f, dtype=GLOVE_DTYPE, count=chunk_size)
+                if data.shape[0] == 0:
+                    break
+                yield data["ind"][:, 0] - 1, data["ind"][:, 1] - 1, data["val"]
+
+    # First pass: count entries per row
+    if n is None:
+        n = 0
+        for (row, col, val) in chunks():
+            n = max(n, int(row.max()) + 1, int(col.max()) + 1)
+    count = np.zeros(n, dtype=np.int64)
+    for (row, col, val) in chunks():
+        count += np.bincount(row, minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(count, out=indptr[1:])
+    logger.info("Counting rows took " + str(time.time() - begin))
+
+    # Second pass: scatter entries into row order
+    s = time.time()
+    tmp_indices = output + ".indices.tmp"
+    tmp_data = output + ".data.tmp"
+    indices = np.memmap(tmp_indices, dtype=np.int32, mode="w+", shape=(max(nnz, 1),))
+    data = np.memmap(tmp_data, dtype=np.float32, mode="w+", shape=(max(nnz, 1),))
+    try:
+        cursor = indptr[:-1].copy()
+        for (row, col, val) in chunks():
+            order = np.argsort(row, kind="mergesort")
+            row = row[order]
+            rank = np.arange(row.shape[0]) - np.searchsorted(row, row)
+            pos = cursor[row] + rank
+            indices[pos] = col[order]
+            data[pos] = val[order]
+            cursor += np.bincount(row, minlength=n)
+        logger.info("Bucketing rows took " + str(time.time() - s))
+
+        # Third pass: write blocks with sorted columns
+        s = time.time()
+        blocks = (n + block_size - 1) // block_size
+        table = np.zeros((blocks, 4), dtype=np.int64)
+        offset = align(HEADER_SIZE + table.nbytes)
+        for b in range(blocks):
+            start = b * block_size
+            end = min(start + block_size, n)
+            block_nnz = indptr[end] - indptr[start]
+            table[b, :] = (start, end, block_nnz, offset)
+            offset = align(offset + 8 * (end - start + 1) + 8 * block_nnz)
+
+        with open(output, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, n, n, nnz, block_size, blocks))
+            pad(f, HEADER_SIZE)
+            f.write(table.astype("<i8").tobytes())
+            for b in range(blocks):
+                start, end, block_nnz, offset = table[b]
+                pad(f, offset)
+
+                ptr = indptr[start:end + 1] - indptr[start]
+                ind = np.array(indices[indptr[start]:indptr[end]])
+                val = np.array(data[indptr[start]:indptr[end]])
+                order = np.lexsort((ind, np.repeat(np.arange(end - start), np.diff(ptr))))
+
+                f.write(ptr.astype("<i8").tobytes())
+                f.write(ind[order].astype("<i4").tobytes())
+                f.write(val[order].astype("<f4").tobytes())
+        logger.info("Writing blocks took " + str(time.time() - s))
+    finally:
+        del indices, data
+        os.remove(tmp_indices)
+        os.remove(tmp_data)
+
+    logger.info("Converting cooccurrence matrix took " + str(time.time() - begin))
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def pad(f, offset):
+    f.write(b"\x00" * (offset - f.tell()))
@@ -0,0 +1,251 @@
+"""Power iteration over a row-partitioned cooccurrence matrix.
+
+Each rank (process) loads only its block of rows of the cooccurrence
+matrix and computes the matching rows of A x. The ranks communicate with
+torch.distributed (gloo backend), and the iterate x is replicated on every
+rank after each step.
+"""
+
+from __future__ import print_function, absolute_import
+
+import torch
+import torch.distributed as dist
+import numpy as np
+import time
+import math
+import socket
+import logging
+import multiprocessing
+import scipy.sparse
+
+import embedding.util as util
+import embedding.blockcsr as blockcsr
+
+
+def launch(world_size, fn, args=()):
+    """Runs fn(rank, world_size, init_method, *args) in world_size local
+    processes, and waits for all of them."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    init_method = "tcp://127.0.0.1:" + str(port)
+
+    processes = [multiprocessing.Process(target=fn, args=(rank, world_size, init_method) + tuple(args))
+                 for rank in range(world_size)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    failed = [rank for (rank, p) in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError("Ranks " + str(failed) + " failed.")
+
+
+def init(rank, world_size, init_method):
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+
+
+def row_range(n, rank, world_size):
+    return rank * n // world_size, (rank + 1) * n // world_size
+
+
+def load_rows(cooccurrence_file, n, start, end, dtype=np.float32, chunk_size=2 ** 20):
+    """Loads rows [start, end) of a cooccurrence file as a CSR matrix."""
+    if blockcsr.is_blockcsr(cooccurrence_file):
+        mat = blockcsr.BlockCSR(cooccurrence_file)
+        A = mat.tocsr(mat.row_blocks(start, end))[start:end, :]
+    else:
+        rows, cols, vals = [], [], []
+        with open(cooccurrence_file, "rb") as f:
+            while True:
+                data = np.fromfile(f, dtype=blockcsr.GLOVE_DTYPE, count=chunk_size)
+                if data.shape[0] == 0:
+                    break
+                row = data["ind"][:, 0] - 1
+                keep = (start <= row) & (row < end)
+                rows.append(row[keep] - start)
+                cols.append(data["ind"][keep, 1] - 1)
+                vals.append(data["val"][keep])
+        A = scipy.sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                    shape=(end - start, n))
+    A.data = A.data.astype(dtype)
+    return A
+
+
+def all_gather_rows(x, n, world_size):
+    """Concatenates the row blocks of all ranks (in order of rank)."""
+    ranges = [row_range(n, r, world_size) for r in range(world_size)]
+    rows = max(end - start for (start, end) in ranges)
+
+    padded = x.new(rows, *x.shape[1:]).zero_()
+    padded[:x.shape[0]] = x
+    parts = [x.new(rows, *x.shape[1:]) for r in range(world_size)]
+    dist.all_gather(parts, padded)
+    return torch.cat([p[:end - start] for (p, (start, end)) in zip(parts, ranges)], 0)
+
+
+def preprocessing(A, start, n, world_size, mode="ppmi", negative=1., alpha=1.):
+    """Row-partitioned version of Embedding.preprocessing."""
+    if mode == "log1p":
+        A.data = np.log1p(A.data)
+    elif mode == "ppmi":
+        wc = np.asarray(A.sum(1)).squeeze(1)
+        wc = all_gather_rows(torch.from_numpy(wc), n, world_size).numpy()
+        D = np.sum(wc ** alpha)
+
+        row = start + np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+        A.data = (np.log(A.data) + (math.log(D) - math.log(negative)) -
+                  np.log(wc[row]) - alpha * np.log(wc[A.indices])).astype(A.dtype)
+        A.data = A.data.clip(min=0)
+        A.eliminate_zeros()
+    return A
+
+
+def cholesky_qr(y, x0, world_size):
+    """Orthonormalizes the row-partitioned y through the reduced Gram matrix
+    (CholeskyQR2), applying the same transformation to x0.
+
+    Columns are sorted by norm first, as in util.normalize.
+    """
+    logger = logging.getLogger(__name__)
+
+    y = y.numpy()
+    x0 = x0.numpy() if x0 is not None else None
+    for step in range(2):
+        G = torch.from_numpy(np.dot(y.T, y))
+        dist.all_reduce(G)
+        G = G.numpy()
+
+        if step == 0:
+            norm = np.sqrt(np.diag(G))
+            logger.info(" ".join(["{:10.2f}".format(n) for n in norm]))
+            perm = np.argsort(-norm, kind="mergesort")
+            y = y[:, perm]
+            G = G[perm, :][:, perm]
+            if x0 is not None:
+                x0 = x0[:, perm]
+
+        try:
+            R = np.linalg.cholesky(G).T
+        except np.linalg.LinAlgError:
+            logger.warn("Gram matrix is singular\n"
+                        "Normalizing, but not orthogonalizing")
+            R = np.diag(np.maximum(np.sqrt(np.diag(G)), 1e-30))
+        Rinv = np.linalg.inv(R).astype(y.dtype)
+        y = np.dot(y, Rinv)
+        if x0 is not None:
+            x0 = np.dot(x0, Rinv)
+
+    return torch.from_numpy(y), (torch.from_numpy(x0) if x0 is not None else None)
+
+
+def power_iteration(A, x, start, world_size, iterations=50, beta=0., norm_freq=1, ortho="gram", checkpoint=lambda x, i: None):
+    """Power iteration where A holds rows [start, start + A.shape[0]) of the
+    matrix and x is replicated on all ranks.
+
+    With ortho == "gram", the local rows are orthonormalized through the
+    all-reduced dim x dim Gram matrix. With ortho == "gather", the full
+    iterate is gathered and every rank runs the same QR.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    n, dim = x.shape
+    end = start + A.shape[0]
+    x0 = None
+    if beta != 0.:
+        x0 = x.new(end - start, dim).zero_()
+
+    for i in range(iterations):
+        begin = time.time()
+        y = torch.from_numpy(A * x.numpy())
+        if beta != 0.:
+            y, x0 = y - beta * x0, x[start:end]
+
+        if ((i + 1) % norm_freq == 0 or
+            (i + 1) == iterations):
+            if ortho == "gather":
+                y = all_gather_rows(y, n, world_size)
+                if x0 is not None:
+                    x0 = all_gather_rows(x0, n, world_size)
+                x, x0 = util.normalize(y, x0)
+                if x0 is not None:
+                    x0 = x0[start:end]
+            else:
+                y, x0 = cholesky_qr(y, x0, world_size)
+                x = all_gather_rows(y, n, world_size)
+        else:
+            x = all_gather_rows(y, n, world_size)
+        logger.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin))
+
+        checkpoint(x, i)
+
+    return x
+
+
+def scale(A, x, world_size, p=1.):
+    """Row-partitioned version of Embedding.scale."""
+    if p == 0:
+        return x
+    y = A * x.numpy()
+    norm = torch.from_numpy(np.sum(y * y, 0))
+    dist.all_reduce(norm)
+    norm = norm.sqrt()
+    logging.getLogger(__name__).info(" ".join(["{:10.2f}".format(n) for n in norm]))
+    return x.mul(norm.pow(p).expand_as(x))
+
+
+def compute(rank, world_size, init_method, args):
+    """Entry point of a rank for `embedding compute --ranks N`."""
+    init(rank, world_size, init_method)
+    logger = logging.getLogger(__name__)
+
+    CpuTensor = torch.DoubleTensor if args.precision == "double" else torch.FloatTensor
+    dtype = CpuTensor().numpy().dtype
+
+    with open(args.vocab) as f:
+        words = [l.split()[0] for l in f]
+    n = len(words)
+    start, end = row_range(n, rank, world_size)
+
+    begin = time.time()
+    A = load_rows(args.cooccurrence, n, start, end, dtype)
+    logger.info("Rank " + str(rank) + " loaded rows " + str(start) + " to " + str(end) +
+                " (" + str(A.nnz) + " non-zeros) in " + str(time.time() - begin))
+
+    begin = time.time()
+    A = preprocessing(A, start, n, world_size, args.preprocessing, args.negative, args.alpha)
+    logger.info("Preprocessing took " + str(time.time() - begin))
+
+    # Every rank starts from the initial vectors of rank 0. Their dimension
+    # is broadcast first, so that a mismatch fails on every rank instead of
+    # leaving the others waiting in the broadcast of x.
+    shape = torch.LongTensor([args.dim])
+    if rank == 0:
+        if args.initial is None:
+            x = CpuTensor(n, args.dim)
+            x.random_(2)
+            x, _ = util.normalize(x)
+        else:
+            vec_words, vectors = util.load_vectors(args.initial, dtype)
+            x, found = util.align_rows(words, vec_words, vectors)
+            logger.info("Initial vectors cover {} / {} words".format(np.count_nonzero(found), n))
+            x = torch.from_numpy(x)
+            shape[0] = x.shape[1]
+    dist.broadcast(shape, 0)
+    if shape[0] != args.dim:
+        raise ValueError("Initial vectors have dimension " + str(int(shape[0])) + ", but --dim is " +
+                         str(args.dim) + " (changing the dimension is not supported with --ranks).")
+    if rank != 0:
+        x = CpuTensor(n, args.dim)
+    dist.broadcast(x, 0)
+
+    x = power_iteration(A, x, start, world_size, iterations=args.iterations, beta=args.momentum,
+                        norm_freq=args.normfreq, ortho=args.ortho)
+    x = scale(A, x, world_size, args.scale)
+    if args.normalize:
+        x = x.div(torch.norm(x, 2, 1, True).expand_as(x))
+
+    if rank == 0:
+        util.save_to_text(args.vectors, x, words)
@@ -6,6 +6,11 @@ import numpy as np
 import scipy.stats
 import logging
 
+import embedding.pq as pq
+
+# Number of analogy questions scored at once (set by the memory planner)
+SPLIT_SIZE = 100
+
 
 def evaluate(words, vectors):
     # TODO: give option to just pass in vocab and vectors (not filename)
@@ -23,17 +28,27 @@ def evaluate(words, vectors):
     vocab = {w: idx for idx, w in enumerate(words)}
     ivocab = {idx: w for idx, w in enumerate(words)}
 
-    vector_dim = len(vectors[ivocab[0]])
-    W = np.zeros((vocab_size, vector_dim))
-    for word, v in vectors.items():
-        if word == '<unk>':
-            continue
-        W[vocab[word], :] = v
+    if isinstance(vectors, pq.ProductQuantizer):
+        # Scored directly on the codes
+        W = vectors
+    elif isinstance(vectors, np.ndarray):
+        # Rows are already in the order of words
+        W = vectors
+    else:
+        vector_dim = len(vectors[ivocab[0]])
+        W = np.zeros((vocab_size, vector_dim))
+        for word, v in vectors.items():
+            if word == '<unk>' or word not in vocab:
+                continue
+            W[vocab[word], :] = v
 
     # normalize each word vector to unit variance
-    W_norm = np.zeros(W.shape)
-    d = (np.sum(W ** 2, 1) ** (0.5))
-    W_norm = (W.T / d).T
+    if isinstance(W, pq.ProductQuantizer):
+        W_norm = W.normalized()
+    else:
+        W_norm = np.zeros(W.shape)
+        d = (np.sum(W ** 2, 1) ** (0.5))
+        W_norm = (W.T / d).T
 
     score = {}
     # evaluate_human_sim()
@@ -61,8 +76,8 @@ def evaluate_vectors_analogy(W, vocab, ivocab, method="add"):
     prefix = os.path.join(os.path.dirname(__file__), "data", "eval", "question-data")
 
     # to avoid memory overflow, could be increased/decreased
-    # depending on system and vocab size
-    split_size = 100
+    # depending on system and vocab size (see memory.split_size)
+    split_size = SPLIT_SIZE
 
     correct_sem = 0  # count correct semantic questions
     correct_syn = 0  # count correct syntactic questions
@@ -77,6 +92,8 @@ def evaluate_vectors_analogy(W, vocab, ivocab, method="add"):
             full_data = [line.rstrip().split(' ') for line in f]
             full_count += len(full_data)
             data = [x for x in full_data if all(word in vocab for word in x)]
+        if not data:
+            continue
 
         indices = np.array([[vocab[word] for word in row] for row in data])
         ind1, ind2, ind3, ind4 = indices.T
@@ -87,9 +104,9 @@ def evaluate_vectors_analogy(W, vocab, ivocab, method="add"):
             subset = np.arange(j * split_size, min((j + 1) * split_size, len(ind1)))
 
             if method == "add":
-                pred_vec = (W[ind2[subset], :] - W[ind1[subset], :] + W[ind3[subset], :])
+                pred_vec = (rows(W, ind2[subset]) - rows(W, ind1[subset]) + rows(W, ind3[subset]))
                 # cosine similarity if input W has been normalized
-                dist = np.dot(W, pred_vec.T)
+                dist = dot(W, pred_vec)
             elif method == "mul":
                 # This is 3CosMul from
                 # Linguistic Regularities in Sparse and Explicit Word Representations
@@ -97,9 +114,9 @@ def evaluate_vectors_analogy(W, vocab, ivocab, method="add"):
                 epsilon = 0.001
 
                 # cosine similarity if input W has been normalized
-                cos_a  = (np.dot(W, W[ind1[subset], :].T) + 1) / 2
-                cos_as = (np.dot(W, W[ind2[subset], :].T) + 1) / 2
-                cos_b  = (np.dot(W, W[ind3[subset], :].T) + 1) / 2
+                cos_a  = (dot(W, rows(W, ind1[subset])) + 1) / 2
+                cos_as = (dot(W, rows(W, ind2[subset])) + 1) / 2
+                cos_b  = (dot(W, rows(W, ind3[subset])) + 1) / 2
 
                 dist = cos_as * cos_b / (cos_a + epsilon)
             else:
@@ -130,12 +147,12 @@ def evaluate_vectors_analogy(W, vocab, ivocab, method="add"):
     logger.info('    Questions seen/total: %.2f%% (%d/%d)' %
           (100 * count_tot / float(full_count), count_tot, full_count))
     logger.info('    Semantic accuracy: %.2f%%  (%i/%i)' %
-          (100 * correct_sem / float(count_sem), correct_sem, count_sem))
+          (100 * correct_sem / float(max(count_sem, 1)), correct_sem, count_sem))
     logger.info('    Syntactic accuracy: %.2f%%  (%i/%i)' %
-          (100 * correct_syn / float(count_syn), correct_syn, count_syn))
-    logger.info('Total accuracy: %.2f%%  (%i/%i)\n' % (100 * correct_tot / float(count_tot), correct_tot, count_tot))
+          (100 * correct_syn / float(max(count_syn, 1)), correct_syn, count_syn))
+    logger.info('Total accuracy: %.2f%%  (%i/%i)\n' % (100 * correct_tot / float(max(count_tot, 1)), correct_tot, count_tot))
 
-    return correct_tot / float(count_tot)
+    return correct_tot / float(max(count_tot, 1))
 
 
 def evaluate_vectors_sim(W, vocab, ivocab):
@@ -153,12 +170,15 @@ def evaluate_vectors_sim(W, vocab, ivocab):
     words = np.array([[vocab[row[0]], vocab[row[1]]] for row in data])
     score = np.array([float(row[2]) for row in data])
 
-    pred = np.sum(np.multiply(W[words[:, 0], :], W[words[:, 1], :]), 1)
+    W0 = rows(W, words[:, 0])
+    W1 = rows(W, words[:, 1])
+
+    pred = np.sum(np.multiply(W0, W1), 1)
     rho_dot, p = scipy.stats.spearmanr(score, pred)
     logger = logging.getLogger(__name__)
     logger.info("WordSimilarity-353 Spearman Correlation (dot): %.3f\n" % rho_dot)
 
-    pred = np.sum(np.multiply(W[words[:, 0], :], W[words[:, 1], :]), 1) / np.sum(np.multiply(W[words[:, 0], :], W[words[:, 0], :]), 1) / np.sum(np.multiply(W[words[:, 1], :], W[words[:, 1], :]), 1)
+    pred = np.sum(np.multiply(W0, W1), 1) / np.sum(np.multiply(W0, W0), 1) / np.sum(np.multiply(W1, W1), 1)
     rho_cos, p = scipy.stats.spearmanr(score, pred)
     logger = logging.getLogger(__name__)
     logger.info("WordSimilarity-353 Spearman Correlation (cos): %.3f\n" % rho_cos)
@@ -166,6 +186,20 @@ def evaluate_vectors_sim(W, vocab, ivocab):
     return rho_dot, rho_cos
 
 
+def rows(W, ind):
+    """Rows of a matrix or of a product-quantized embedding."""
+    if isinstance(W, pq.ProductQuantizer):
+        return W.rows(ind)
+    return W[ind, :]
+
+
+def dot(W, Q):
+    """Inner products of all rows of W with the rows of Q."""
+    if isinstance(W, pq.ProductQuantizer):
+        return W.dot(Q)
+    return np.dot(W, Q.T)
+
+
 def evaluate_human_sim():
     """Evaluate the trained word vectors on the WordSimilarity-353 task."""
 
@@ -0,0 +1,225 @@
+"""Compiled kernels for the hot loops over the non-zeros.
+
+The kernels are defined at module level with cache=True, so numba writes
+the compiled code next to this file (or to NUMBA_CACHE_DIR) and later
+processes load it instead of compiling. `embedding warmup` compiles all of
+them for the index and value types used by the package.
+"""
+
+from __future__ import print_function, absolute_import
+
+import numba
+import numpy as np
+import time
+import logging
+
+
+@numba.jit(nopython=True, cache=True)
+def sum_rows(n, row, val):
+    ans = np.zeros(n, dtype=val.dtype)
+    for i in range(val.shape[0]):
+        ans[row[i]] += val[i]
+    return ans
+
+
+@numba.jit(nopython=True, cache=True)
+def symmetric_mm(indptr, indices, data, x):
+    # Each stored entry (i, j) of the upper triangle is used for both (i, j)
+    # and (j, i), so the matrix is only read once.
+    n = indptr.shape[0] - 1
+    dim = x.shape[1]
+    y = np.zeros((n, dim), dtype=x.dtype)
+    for i in range(n):
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            v = data[k]
+            for c in range(dim):
+                y[i, c] += v * x[j, c]
+            if i != j:
+                for c in range(dim):
+                    y[j, c] += v * x[i, c]
+    return y
+
+
+@numba.jit(nopython=True, cache=True)
+def ppmi(row, col, val, wc, shift, alpha):
+    """Replaces the entries by their PPMI in place,
+        max(0, log(val) + shift - log(wc[row]) - alpha * log(wc[col])),
+    and moves the non-zeros to the front. Returns their number."""
+    nnz = 0
+    for i in range(val.shape[0]):
+        v = np.log(val[i]) + shift - np.log(wc[row[i]]) - alpha * np.log(wc[col[i]])
+        if v > 0:
+            row[nnz] = row[i]
+            col[nnz] = col[i]
+            val[nnz] = v
+            nnz += 1
+    return nnz
+
+
+@numba.jit(nopython=True, cache=True)
+def remap(row, col, val, index):
+    """Relabels the entries through index (-1 drops the id) in place and
+    moves the kept entries to the front. Returns their number."""
+    nnz = 0
+    for i in range(val.shape[0]):
+        r = index[row[i]]
+        c = index[col[i]]
+        if r >= 0 and c >= 0:
+            row[nnz] = r
+            col[nnz] = c
+            val[nnz] = val[i]
+            nnz += 1
+    return nnz
+
+
+@numba.jit(nopython=True, cache=True)
+def csr_rows(indptr, indices, data, rows):
+    """Gathers the given rows of a CSR matrix (rows may repeat) as
+    coordinates: (row, column, value)."""
+    nnz = 0
+    for r in rows:
+        nnz += indptr[r + 1] - indptr[r]
+    row = np.empty(nnz, dtype=np.int64)
+    col = np.empty(nnz, dtype=np.int64)
+    val = np.empty(nnz, dtype=data.dtype)
+    k = 0
+    for r in rows:
+        for j in range(indptr[r], indptr[r + 1]):
+            row[k] = r
+            col[k] = indices[j]
+            val[k] = data[j]
+            k += 1
+    return row, col, val
+
+
+@numba.jit(nopython=True, cache=True)
+def varint_encode(indptr, indices, block):
+    """Encodes the (sorted) column indices of each row as the gaps between
+    consecutive columns (the first one from 0), in variable-byte format: 7
+    bits per byte, low bits first, with the high bit set on all but the last
+    byte. Returns the bytes and the byte offset of each block of rows."""
+    n = indptr.shape[0] - 1
+    size = 0
+    for i in range(n):
+        prev = 0
+        for k in range(indptr[i], indptr[i + 1]):
+            d = indices[k] - prev
+            prev = indices[k]
+            size += 1
+            while d >= 128:
+                d >>= 7
+                size += 1
+
+    code = np.empty(size, dtype=np.uint8)
+    offsets = np.empty((n + block - 1) // block + 1, dtype=np.int64)
+    pos = 0
+    for i in range(n):
+        if i % block == 0:
+            offsets[i // block] = pos
+        prev = 0
+        for k in range(indptr[i], indptr[i + 1]):
+            d = indices[k] - prev
+            prev = indices[k]
+            while d >= 128:
+                code[pos] = (d & 127) | 128
+                d >>= 7
+                pos += 1
+            code[pos] = d
+            pos += 1
+    offsets[-1] = pos
+    return code, offsets
+
+
+@numba.jit(nopython=True, cache=True)
+def varint_decode(indptr, code):
+    """Inverse of varint_encode: the column indices of all rows."""
+    n = indptr.shape[0] - 1
+    indices = np.empty(indptr[n], dtype=np.int32)
+    pos = 0
+    for i in range(n):
+        prev = 0
+        for k in range(indptr[i], indptr[i + 1]):
+            d = 0
+            shift = 0
+            b = code[pos]
+            while b >= 128:
+                d |= np.int64(b & 127) << shift
+                shift += 7
+                pos += 1
+                b = code[pos]
+            d |= np.int64(b) << shift
+            pos += 1
+            prev += d
+            indices[k] = prev
+    return indices
+
+
+@numba.jit(nopython=True, cache=True)
+def compressed_mm(indptr, offsets, block, code, data, x):
+    """Product of a matrix with varint_encode'd column indices and a dense
+    x, decoding the columns as they are used. Each block of rows starts at
+    its own byte offset."""
+    n = indptr.shape[0] - 1
+    dim = x.shape[1]
+    y = np.zeros((n, dim), dtype=x.dtype)
+    for r in range(offsets.shape[0] - 1):
+        pos = offsets[r]
+        for i in range(r * block, min(n, (r + 1) * block)):
+            j = 0
+            for k in range(indptr[i], indptr[i + 1]):
+                d = 0
+                shift = 0
+                b = code[pos]
+                while b >= 128:
+                    d |= np.int64(b & 127) << shift
+                    shift += 7
+                    pos += 1
+                    b = code[pos]
+                d |= np.int64(b) << shift
+                pos += 1
+                j += d
+                v = data[k]
+                for c in range(dim):
+                    y[i, c] += v * x[j, c]
+    return y
+
+
+@numba.jit(nopython=True, cache=True)
+def csr_mm(indptr, indices, data, x):
+    """Product of a CSR matrix and a dense x, with the same loops as
+    compressed_mm (for comparison)."""
+    n = indptr.shape[0] - 1
+    dim = x.shape[1]
+    y = np.zeros((n, dim), dtype=x.dtype)
+    for i in range(n):
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            v = data[k]
+            for c in range(dim):
+                y[i, c] += v * x[j, c]
+    return y
+
+
+def warmup():
+    """Compiles (or loads from the cache) every kernel for the index and
+    value types used by the package."""
+    logger = logging.getLogger(__name__)
+    begin = time.time()
+    for itype in [np.int32, np.int64]:
+        for vtype in [np.float32, np.float64]:
+            row = np.array([0, 1], dtype=itype)
+            col = np.array([1, 0], dtype=itype)
+            val = np.array([1, 2], dtype=vtype)
+            indptr = np.array([0, 1, 2], dtype=itype)
+
+            sum_rows(2, row, val)
+            symmetric_mm(indptr, col, val, np.ones((2, 1), dtype=vtype))
+            ppmi(row.copy(), col.copy(), val.copy(), np.ones(2, dtype=vtype), 1., 1.)
+            remap(row.copy(), col.copy(), val.copy(), np.array([0, -1], dtype=np.int64))
+            csr_rows(indptr, col, val, np.array([1], dtype=np.int64))
+            code, offsets = varint_encode(indptr, col, 64)
+            varint_decode(indptr, code)
+            compressed_mm(indptr, offsets, 64, code, val, np.ones((2, 1), dtype=vtype))
+            csr_mm(indptr, col, val, np.ones((2, 1), dtype=vtype))
+    logger.info("Compiling kernels took " + str(time.time() - begin))
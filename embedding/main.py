@@ -10,13 +10,21 @@ import sys
 import subprocess
 import math
 import logging
-import pandas
-import collections
 import scipy
 
 import embedding.solver as solver
+import embedding.sweep as sweep
 import embedding.util as util
+import embedding.matrix as matrix
+import embedding.blockcsr as blockcsr
 import embedding.evaluate as evaluate
+import embedding.metrics as metrics
+import embedding.kernels as kernels
+import embedding.sparsify as sparsify
+import embedding.memory as memory
+import embedding.neighbors as neighbors
+import embedding.pq as pq
+import embedding.distributed as distributed
 import embedding.tensor_type as tensor_type
 import embedding.parser as parser
 import embedding.logging_config as logging_config
@@ -33,8 +41,31 @@ def main(argv=None):
 
     logger.debug(args)
 
-    if args.task == "cooccurrence":
+    if args.task == "warmup":
+        kernels.warmup()
+    elif args.task == "cooccurrence":
         subprocess.call([os.path.join(os.path.dirname(__file__), "..", "cooccurrence.sh"), args.text])
+    elif args.task == "convert":
+        n = None
+        if args.vocab is not None:
+            with open(args.vocab) as f:
+                n = sum(1 for l in f)
+        blockcsr.convert(args.cooccurrence, args.output, n, args.blocksize)
+    elif args.task == "compute" and args.ranks > 0:
+        if args.solver != "pi":
+            logger.warn("Only power iteration is implemented for multiple ranks. "
+                        "Switching to power iteration.")
+        ignored = [flag for (flag, value, default) in [("--max-vocab", args.max_vocab, 0),
+                                                       ("--min-count", args.min_count, 0),
+                                                       ("--reorder", args.reorder, "none"),
+                                                       ("--hybrid", args.hybrid, False),
+                                                       ("--compress", args.compress, False),
+                                                       ("--sparsify", args.sparsify, 0.),
+                                                       ("--sparsify-error", args.sparsify_error, 0.)]
+                   if value != default]
+        if ignored:
+            logger.warn(", ".join(ignored) + " not supported with --ranks. Ignoring.")
+        distributed.launch(args.ranks, distributed.compute, (args,))
     elif args.task == "compute":
         if args.gpu and not torch.cuda.is_available():
             logger.warn("GPU use requested, but GPU not available. "
@@ -64,13 +95,56 @@ def main(argv=None):
             logger.warn("Precision \"" + args.precision + "\" is not recognized. "
                         "Defaulting to \"float\".")
 
+        plan = memory.plan_files(args.vocab, args.cooccurrence, args.dim, CpuTensor().element_size(), args.memory, args.gpu_memory,
+                                 args.gpu, args.solver, args.symmetric, args.matgpu, args.max_vocab, args.min_count)
+        if args.dry_run:
+            print(plan.report())
+            return
+        logger.info(plan.report())
+        plan.apply()
+        if args.gpu and args.matgpu is None:
+            args.matgpu = plan.matgpu
+
         embedding = Embedding(args.dim, args.gpu, args.matgpu, args.embedgpu, CpuTensor)
-        embedding.load_cooccurrence(args.vocab, args.cooccurrence, args.preprocessing, args.negative, args.alpha)
+        embedding.load_cooccurrence(args.vocab, args.cooccurrence, args.preprocessing, args.negative, args.alpha, plan.symmetric, args.reorder, args.max_vocab, args.min_count, plan.load_chunk, args.hybrid, args.sparsify, args.sparsify_error, args.seed, args.compress)
         embedding.load_vectors(args.initial, args.initialbias)
-        embedding.solve(mode=args.solver, gpu=args.gpu, scale=args.scale, normalize=args.normalize, iterations=args.iterations, eta=args.eta, momentum=args.momentum, normfreq=args.normfreq, innerloop=args.innerloop, batch=args.batch, scheme=args.scheme, sequential=args.sequential, checkpoint_every=args.checkpoint, checkpoint_root=args.vectors)
+        embedding.solve(mode=args.solver, gpu=args.gpu, scale=args.scale, normalize=args.normalize, iterations=args.iterations, eta=args.eta, momentum=args.momentum, normfreq=args.normfreq, innerloop=args.innerloop, batch=args.batch, scheme=args.scheme, sequential=args.sequential, checkpoint_every=args.checkpoint, checkpoint_root=args.vectors, eval_every=args.eval_every, metrics_file=args.metrics, tol=args.tol, lock_tol=args.lock_tol, accelerate=args.accelerate, warmup=args.warmup, ritz=args.ritz, shuffle=args.shuffle, seed=args.seed, prefetch=args.prefetch, reference=args.reference, trace_file=args.trace, landmarks=args.landmarks, landmark_sampling=args.landmark_sampling)
         embedding.save_to_text(args.vectors)
+        if args.sparsify > 0 or args.sparsify_error > 0:
+            score = embedding.evaluate()
+            logger.info("Analogy accuracy with sparsified matrix: {:.4f} (add), {:.4f} (mul)".format(score["analogy-add"], score["analogy-mul"]))
+        if args.pq is not None:
+            embedding.save_to_pq(args.pq, args.pq_subvectors, args.pq_centroids)
+    elif args.task == "sweep":
+        CpuTensor = torch.FloatTensor
+        if args.precision == "double":
+            CpuTensor = torch.DoubleTensor
+
+        grid = sweep.get_grid(dim=args.dim, scale=args.scale, solver=args.solver, momentum=args.momentum,
+                              iterations=args.iterations, eta=args.eta, normfreq=args.normfreq,
+                              innerloop=args.innerloop, batch=args.batch, normalize=args.normalize)
+        sweep.sweep(grid, args.vocab, args.cooccurrence, args.preprocessing, args.negative, args.alpha,
+                    CpuTensor, processes=args.processes, results=args.results)
+    elif args.task == "neighbors":
+        neighbors.neighbors(args.vectors, args.output, args.k, args.memory, args.threads)
+    elif args.task == "serve":
+        # Imported here, since the server requires Python 3
+        import embedding.serve as serve
+        serve.serve(args.vectors, args.host, args.port, args.socket, args.cache, args.batch)
     elif args.task == "evaluate":
-        evaluate.evaluate(args.vocab, args.vectors)
+        if args.pq is not None:
+            quantizer = pq.load(args.pq)
+            evaluate.SPLIT_SIZE = memory.split_size(quantizer.shape[0], quantizer.shape[1], args.memory)
+            evaluate.evaluate(quantizer.words, quantizer)
+        else:
+            words, counts = util.load_vocab(args.vocab)
+            keep = util.truncate_vocab(counts, args.max_vocab, args.min_count)
+            if keep is not None:
+                words = [words[i] for i in keep]
+            with open(args.vectors) as f:
+                dim = len(f.readline().split()) - 1
+            evaluate.SPLIT_SIZE = memory.split_size(len(words), dim, args.memory)
+            evaluate.evaluate(words, args.vectors)
 
 
 class Embedding(object):
@@ -89,36 +163,70 @@ class Embedding(object):
 
         self.CpuTensor = CpuTensor
 
+        # Permutation of words applied at load time (see reorder)
+        self.perm = None
+
         self.logger = logging.getLogger(__name__)
 
-    def load_cooccurrence(self, vocab_file="vocab.txt", cooccurrence_file="cooccurrence.bin", preprocessing="none", negative=1., alpha=1.):
+    def load_cooccurrence(self, vocab_file="vocab.txt", cooccurrence_file="cooccurrence.bin", preprocessing="none", negative=1., alpha=1., symmetric=False, reorder="none", max_vocab=0, min_count=0, chunk_size=None, hybrid=False, sparsify_nnz=0., sparsify_error=0., seed=0, compress=False):
         begin = time.time()
 
         if True: # TODO
 
             # Load vocab (words and counts)
-            def parse_line(l):
-                l = l.split()
-                assert(len(l) == 2)
-                return l[0], int(l[1])
-
-            with open(vocab_file) as f:
-                lines = [parse_line(l) for l in f]
-                self.words = [l[0] for l in lines]
-                self.vocab = self.CpuTensor([l[1] for l in lines])
+            words, counts = util.load_vocab(vocab_file)
+            total = len(words)
+            keep = util.truncate_vocab(counts, max_vocab, min_count)
+            if keep is not None:
+                words = [words[i] for i in keep]
+                counts = counts[keep]
+            self.words = words
+            self.vocab = self.CpuTensor(counts.astype(self.CpuTensor().numpy().dtype))
             self.n = self.vocab.size()[0]
             self.logger.info("Distinct Words: " + str(self.n))
 
             # Load cooccurrence matrix
-            filesize = os.stat(cooccurrence_file).st_size
-            assert(filesize % 16 == 0)
-            nnz = filesize // 16
-            self.logger.info("Number of non-zeros: " + str(nnz))
-
-            dt = np.dtype([("ind", "2<i4"), ("val", "<d")])
-            data = np.fromfile(cooccurrence_file, dtype=dt)
-            ind = torch.IntTensor(data["ind"].transpose()).type(torch.LongTensor) - 1
-            val = self.CpuTensor(data["val"])
+            if keep is not None:
+                self.logger.info("Keeping " + str(self.n) + " / " + str(total) + " words")
+                mat = blockcsr.submatrix(cooccurrence_file, total, keep, chunk_size or 2 ** 20)
+                self.logger.info("Number of non-zeros: " + str(mat.nnz))
+
+                ind = torch.from_numpy(np.array([mat.row, mat.col])).type(torch.LongTensor)
+                val = self.CpuTensor(mat.data.astype(self.CpuTensor().numpy().dtype))
+            elif blockcsr.is_blockcsr(cooccurrence_file):
+                mat = blockcsr.BlockCSR(cooccurrence_file)
+                assert(mat.shape == (self.n, self.n))
+                self.logger.info("Number of non-zeros: " + str(mat.nnz))
+
+                mat = mat.tocsr().tocoo()
+                ind = torch.from_numpy(np.array([mat.row, mat.col])).type(torch.LongTensor)
+                val = self.CpuTensor(mat.data.astype(self.CpuTensor().numpy().dtype))
+            else:
+                filesize = os.stat(cooccurrence_file).st_size
+                assert(filesize % 16 == 0)
+                nnz = filesize // 16
+                self.logger.info("Number of non-zeros: " + str(nnz))
+
+                dt = np.dtype([("ind", "2<i4"), ("val", "<d")])
+                if chunk_size is None or chunk_size >= nnz:
+                    data = np.fromfile(cooccurrence_file, dtype=dt)
+                    ind = torch.IntTensor(data["ind"].transpose()).type(torch.LongTensor) - 1
+                    val = self.CpuTensor(data["val"])
+                else:
+                    # Fill the indices and values in place, one chunk at a time
+                    ind = np.empty((2, nnz), dtype=np.int64)
+                    val = np.empty(nnz, dtype=self.CpuTensor().numpy().dtype)
+                    with open(cooccurrence_file, "rb") as f:
+                        for start in range(0, nnz, chunk_size):
+                            data = np.fromfile(f, dtype=dt, count=chunk_size)
+                            end = start + data.shape[0]
+                            ind[:, start:end] = data["ind"].transpose() - 1
+                            val[start:end] = data["val"]
+                    ind = torch.from_numpy(ind)
+                    val = torch.from_numpy(val)
+
+            if reorder != "none":
+                ind = self.reorder(ind, val, reorder)
             self.mat = tensor_type.to_sparse(self.CpuTensor)(ind, val, torch.Size([self.n, self.n]))
             # TODO: coalescing is very slow, and the cooccurrence matrix is
             # almost always coalesced, but this might not be safe
@@ -127,16 +235,153 @@ class Embedding(object):
 
             # Preprocess cooccurrence matrix
             self.preprocessing(preprocessing, negative, alpha)
+            if sparsify_nnz > 0 or sparsify_error > 0:
+                self.sparsify(sparsify_nnz, sparsify_error, seed)
 
             if not self.gpu:
                 begin = time.time()
                 self.mat = scipy.sparse.csr_matrix((self.mat._values().numpy(), (self.mat._indices()[0, :].numpy(), self.mat._indices()[1, :].numpy())), shape=(self.n, self.n))
                 self.logger.info("CSR conversion took " + str(time.time() - begin))
 
+                if symmetric:
+                    self.symmetric()
+                if hybrid:
+                    if isinstance(self.mat, matrix.SymmetricMatrix):
+                        self.logger.warn("Hybrid storage cannot be combined with symmetric storage. "
+                                         "Keeping symmetric storage.")
+                    else:
+                        self.hybrid()
+                if compress:
+                    if not isinstance(self.mat, scipy.sparse.csr_matrix):
+                        self.logger.warn("Compressed storage cannot be combined with symmetric or hybrid storage. "
+                                         "Keeping " + ("symmetric" if isinstance(self.mat, matrix.SymmetricMatrix) else "hybrid") + " storage.")
+                    else:
+                        self.compress()
+            elif symmetric or hybrid or compress:
+                self.logger.warn("Symmetric, hybrid and compressed storage are not implemented for GPU. "
+                                 "Storing full matrix.")
+
             # TODO: dump to file
         else:
             pass # TODO: load from file
 
+    def reorder(self, ind, val, mode="rcm"):
+        """Relabels the words to make the gathers in SpMM more local.
+
+        Returns the relabeled indices of the cooccurrence matrix. The words,
+        counts and later the initial vectors are permuted to match, and
+        everything written out is returned to the original order.
+        """
+        begin = time.time()
+        row = ind[0, :].numpy()
+        col = ind[1, :].numpy()
+        A = scipy.sparse.csr_matrix((val.numpy(), (row, col)), shape=(self.n, self.n))
+
+        perm = util.reordering(A, self.vocab.numpy(), mode)
+        inv = np.argsort(perm)
+        ind = torch.from_numpy(inv[ind.numpy()])
+        self.perm = perm
+        self.words = [self.words[i] for i in perm]
+        self.vocab = self.vocab[torch.from_numpy(perm)]
+        self.logger.info("Reordering (" + mode + ") took " + str(time.time() - begin))
+        self.logger.info("Bandwidth: " + str(util.bandwidth(row, col)) + " -> " + str(util.bandwidth(inv[row], inv[col])))
+
+        if not self.gpu:
+            B = scipy.sparse.csr_matrix((val.numpy(), (inv[row], inv[col])), shape=(self.n, self.n))
+            before = util.benchmark_mm(A, self.dim, self.CpuTensor)
+            after = util.benchmark_mm(B, self.dim, self.CpuTensor)
+            self.logger.info("SpMM {:.4f} s -> {:.4f} s with reordering".format(before, after))
+
+        return ind
+
+    def unpermute(self, x):
+        """Returns the rows of x and the words in the original vocab order."""
+        if self.perm is None:
+            return x, self.words
+        inv = np.argsort(self.perm)
+        index = torch.from_numpy(inv)
+        if x.is_cuda:
+            index = index.cuda()
+        return x.index_select(0, index), [self.words[i] for i in inv]
+
+    def symmetric(self, tol=1e-6):
+        """Switches the (CSR) cooccurrence matrix to upper triangle storage if
+        it is symmetric, and keeps the full matrix otherwise."""
+        begin = time.time()
+        full = self.mat
+        sym = matrix.to_symmetric(full, tol)
+        if sym is None:
+            self.logger.warn("Cooccurrence matrix is not symmetric. "
+                             "Storing full matrix.")
+            return
+        self.logger.info("Symmetric conversion took " + str(time.time() - begin))
+
+        full_time = util.benchmark_mm(full, self.dim, self.CpuTensor)
+        sym_time = util.benchmark_mm(sym, self.dim, self.CpuTensor)
+        self.logger.info("Symmetric storage: {:.1f} MB -> {:.1f} MB, SpMM {:.4f} s -> {:.4f} s".format(
+                         matrix.nbytes(full) / 2. ** 20, sym.nbytes / 2. ** 20, full_time, sym_time))
+        self.mat = sym
+
+    def sparsify(self, fraction=0.1, error=0., seed=0):
+        """Replaces the (sparse tensor) cooccurrence matrix by an unbiased
+        random sparsification keeping about fraction of its non-zeros, or
+        with a relative spectral-norm error of about error if positive (see
+        embedding.sparsify)."""
+        begin = time.time()
+        ind = self.mat._indices().cpu().numpy()
+        val = self.mat._values().cpu().numpy()
+        row, col, val = sparsify.sparsify_matrix(ind[0, :], ind[1, :], val, self.n, fraction, error, seed)
+
+        ind = torch.from_numpy(np.array([row, col])).type(torch.LongTensor)
+        val = torch.from_numpy(val)
+        if self.mat.is_cuda:
+            ind = ind.cuda()
+            val = val.cuda()
+        elif self.gpu:
+            ind = ind.t().pin_memory().t()
+            val = val.pin_memory()
+        self.mat = type(self.mat)(ind, val, torch.Size([self.n, self.n]))
+        self.logger.info("Sparsification took " + str(time.time() - begin))
+
+    def hybrid(self, density=0.25):
+        """Switches the (CSR) cooccurrence matrix to a dense leading block and
+        a sparse tail (see matrix.HybridMatrix), if the leading block is dense
+        enough and the products get faster."""
+        begin = time.time()
+        full = self.mat
+        hyb = matrix.to_hybrid(full, density)
+        if hyb is None:
+            self.logger.warn("No leading block of the cooccurrence matrix is dense enough. "
+                             "Storing full matrix.")
+            return
+        self.logger.info("Hybrid conversion took " + str(time.time() - begin))
+
+        full_time = util.benchmark_mm(full, self.dim, self.CpuTensor)
+        hyb_time = util.benchmark_mm(hyb, self.dim, self.CpuTensor)
+        self.logger.info("Hybrid storage (dense head of {} words, {:.1%} of non-zeros): {:.1f} MB -> {:.1f} MB, SpMM {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+                         hyb.head, 1 - hyb.tail.nnz / float(max(full.nnz, 1)), matrix.nbytes(full) / 2. ** 20, hyb.nbytes / 2. ** 20,
+                         full_time, hyb_time, full_time / max(hyb_time, 1e-12)))
+        if hyb_time >= full_time:
+            self.logger.warn("Hybrid storage is not faster. "
+                             "Storing full matrix.")
+            return
+        self.mat = hyb
+
+    def compress(self, block=64):
+        """Switches the (CSR) cooccurrence matrix to compressed column
+        indices (see matrix.CompressedMatrix)."""
+        begin = time.time()
+        full = self.mat
+        comp = matrix.CompressedMatrix(full, block)
+        self.logger.info("Compression took " + str(time.time() - begin))
+
+        full_time = util.benchmark_mm(full, self.dim, self.CpuTensor)
+        comp_time = util.benchmark_mm(comp, self.dim, self.CpuTensor)
+        self.logger.info("Compressed storage (indices {:.1f}x smaller): {:.1f} MB -> {:.1f} MB, SpMM {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+                         comp.ratio, matrix.nbytes(full) / 2. ** 20, comp.nbytes / 2. ** 20,
+                         full_time, comp_time, full_time / max(comp_time, 1e-12)))
+        self.mat = comp
+
     def load_vectors(self, initial_vectors=None, initial_bias=None):
         # TODO: move into load
         if initial_vectors is None:
@@ -156,17 +401,17 @@ class Embedding(object):
             self.logger.info("Random initialization took " + str(time.time() - begin))
             self.embedding, _ = util.normalize(self.embedding)
         else:
-            # TODO: verify that the vectors have the right set of words
-            # verify that the vectors have a matching dim
             begin = time.time()
-            # TODO: select proper precision
-            dtype = collections.defaultdict(lambda: self.CpuTensor().numpy().dtype)
-            dtype[0] = str
-            self.embedding = pandas.read_csv(initial_vectors, sep=" ", header=None, dtype=dtype).iloc[:, 1:].as_matrix()
-            if self.embedgpu:
-                self.embedding = tensor_type.to_gpu(self.CpuTensor)(self.embedding)
+            words, vectors = util.load_vectors(initial_vectors, self.CpuTensor().numpy().dtype)
+            x, found = util.align_rows(self.words, words, vectors)
+            self.logger.info("Initial vectors cover {} / {} words, dimension {} -> {}".format(
+                             np.count_nonzero(found), self.n, vectors.shape[1], self.dim))
+            if found.all() and vectors.shape[1] == self.dim:
+                self.embedding = self.CpuTensor(x)
             else:
-                self.embedding = self.CpuTensor(self.embedding)
+                self.embedding = self.warm_start(self.CpuTensor(x), found)
+            if self.embedgpu:
+                self.embedding = self.embedding.cuda()
             self.logger.info("Loading initial vectors took " + str(time.time() - begin))
 
         if self.gpu and not self.embedgpu:
@@ -175,12 +420,14 @@ class Embedding(object):
         if initial_bias is not None:
             # TODO: merge this with init bias in glove
 
-            # TODO: verify that the biases have the right set of words
             begin = time.time()
-            # TODO: select proper precision
-            dtype = collections.defaultdict(lambda: self.CpuTensor().numpy().dtype)
-            dtype[0] = str
-            self.bias = pandas.read_csv(initial_bias, sep=" ", header=None, dtype=dtype).iloc[:, 1].as_matrix()
+            words, bias = util.load_vectors(initial_bias, self.CpuTensor().numpy().dtype)
+            bias, found = util.align_rows(self.words, words, bias[:, :1])
+            self.bias = bias[:, 0]
+            if not found.all():
+                # Words without a bias get the mean bias
+                self.bias[~found] = self.bias[found].mean() if found.any() else 0
+                self.logger.info("Initial biases cover {} / {} words".format(np.count_nonzero(found), self.n))
             if self.embedgpu: # TODO: own flag?
                 self.bias = tensor_type.to_gpu(self.CpuTensor)(self.bias)
             else:
@@ -189,6 +436,52 @@ class Embedding(object):
         else:
             self.bias = None
 
+    def warm_start(self, x, found):
+        """Initial embedding from vectors of a previous vocabulary or dimension.
+
+        x holds the previous vectors of the words in found (zero elsewhere).
+        The span of the columns is rotated to its Ritz vectors for the
+        current matrix, keeping the leading ones up to the dimension. The
+        rows of new words are filled by one step of the eigenvector
+        equation, x_i = (A x)_i / theta, and missing dimensions are padded
+        with random directions orthogonal to the rest.
+        """
+        begin = time.time()
+        if not found.any():
+            self.logger.warn("Initial vectors have no word in common with the vocabulary. "
+                             "Using random initialization.")
+            x = self.CpuTensor(self.n, self.dim)
+            x.random_(2)
+            x, _ = util.normalize(x)
+            return x
+
+        x, _ = util.normalize(x)
+        ax = util.mm(self.mat, x, self.gpu).cpu().type_as(x)
+        x, ax, _, theta = util.rayleigh_ritz(x, ax)
+        k = min(self.dim, x.shape[1])
+        x = x[:, :k].numpy().copy()
+        ax = ax[:, :k].numpy()
+        theta = theta[:k]
+
+        new = ~found
+        if new.any():
+            scale = np.where(theta != 0, 1. / np.where(theta != 0, theta, 1), 0.)
+            x[new, :] = ax[new, :] * scale
+            self.logger.info("Projected " + str(np.count_nonzero(new)) + " new words onto the previous basis")
+
+        if k < self.dim:
+            # Random directions with a smaller norm than the warm columns, so
+            # that normalize keeps the warm columns first
+            pad = np.random.randint(2, size=(self.n, self.dim - k)).astype(x.dtype)
+            q, _ = np.linalg.qr(x)
+            pad -= np.dot(q, np.dot(q.T, pad))
+            pad *= 0.5 / np.maximum(np.linalg.norm(pad, axis=0, keepdims=True), 1e-30)
+            x = np.concatenate([x, pad], 1)
+
+        x, _ = util.normalize(self.CpuTensor(x))
+        self.logger.info("Warm start took " + str(time.time() - begin))
+        return x
+
     def preprocessing(self, mode="ppmi", negative=1., alpha=1.):
         begin = time.time()
 
@@ -213,24 +506,33 @@ class Embedding(object):
             D = torch.sum(wc.pow(alpha))  # total dictionary size
             logging.debug("Computing D took " + str(time.time() - s)); s = time.time()
 
-            # TODO: pytorch doesn't seem to only allow indexing by 2D tensor
-            wc0 = wc[self.mat._indices()[0, :]].squeeze()
-            wc1 = wc[self.mat._indices()[1, :]].squeeze()
-            logging.debug("Getting word counts took " + str(time.time() - s)); s = time.time()
+            if not self.mat.is_cuda:
+                # Fused PMI, clamping and filtering of non-zeros (in place)
+                ind = self.mat._indices().numpy()
+                v = self.mat._values().numpy()
+                nnz = kernels.ppmi(ind[0, :], ind[1, :], v, wc.numpy(), math.log(D) - math.log(negative), alpha)
+                logging.debug("Computing PPMI took " + str(time.time() - s)); s = time.time()
+                if nnz != v.shape[0]:
+                    self.logger.info("nnz after ppmi processing: " + str(nnz))
+                    ind = torch.from_numpy(np.ascontiguousarray(ind[:, :nnz]))
+                    v = torch.from_numpy(v[:nnz].copy())
+                    self.mat = type(self.mat)(ind, v, torch.Size([self.n, self.n]))
+                logging.debug("Filtering non-zeros took " + str(time.time() - s)); s = time.time()
+            else:
+                # TODO: pytorch doesn't seem to only allow indexing by 2D tensor
+                wc0 = wc[self.mat._indices()[0, :]].squeeze()
+                wc1 = wc[self.mat._indices()[1, :]].squeeze()
+                logging.debug("Getting word counts took " + str(time.time() - s)); s = time.time()
 
-            ind = self.mat._indices()
-            v = self.mat._values()
-            nnz = v.shape[0]
-            v = torch.log(v) + (math.log(D) - math.log(negative)) - torch.log(wc0) - alpha * torch.log(wc1)
-            logging.debug("Computing PMI took " + str(time.time() - s)); s = time.time()
+                ind = self.mat._indices()
+                v = self.mat._values()
+                nnz = v.shape[0]
+                v = torch.log(v) + (math.log(D) - math.log(negative)) - torch.log(wc0) - alpha * torch.log(wc1)
+                logging.debug("Computing PMI took " + str(time.time() - s)); s = time.time()
 
-            v = v.clamp(min=0)
-            logging.debug("Clamping took " + str(time.time() - s)); s = time.time()
+                v = v.clamp(min=0)
+                logging.debug("Clamping took " + str(time.time() - s)); s = time.time()
 
-            if self.mat.is_cuda:
-                # This code is able to run on CPU, but is very slow
-                # Currently is not worth the processing time
-                # TODO: speed this up on CPU
                 keep = v.nonzero().squeeze(1)
                 logging.debug("Finding non-zeros took " + str(time.time() - s)); s = time.time()
                 if keep.shape[0] != v.shape[0]:
@@ -251,7 +553,7 @@ class Embedding(object):
 
         self.logger.info("Preprocessing took " + str(time.time() - begin))
 
-    def solve(self, mode="pi", gpu=True, scale=0.5, normalize=True, iterations=50, eta=1e-3, momentum=0., normfreq=1, innerloop=10, batch=100000, scheme="element", sequential=True, checkpoint_every=0, checkpoint_root=""):
+    def solve(self, mode="pi", gpu=True, scale=0.5, normalize=True, iterations=50, eta=1e-3, momentum=0., normfreq=1, innerloop=10, batch=100000, scheme="element", sequential=True, checkpoint_every=0, checkpoint_root="", eval_every=0, metrics_file="metrics.csv", tol=1e-5, lock_tol=0., accelerate="none", warmup=5, ritz=0, shuffle=True, seed=0, prefetch=2, reference=None, trace_file="trace.csv", landmarks=0, landmark_sampling="frequency"):
         if momentum == 0.:
             prev = None
         else:
@@ -264,37 +566,66 @@ class Embedding(object):
         if checkpoint_root[-4:] == ".txt":
             checkpoint_root = checkpoint_root[:-4]
 
+        evaluator = None
+        if eval_every > 0:
+            evaluator = metrics.BackgroundEvaluator(self.words, metrics.MetricsWriter(metrics_file))
+
+        tracker = None
+        if reference is not None:
+            tracker = metrics.ConvergenceTracker(reference, self.words, metrics.MetricsWriter(trace_file))
+
         def checkpoint(x, i):
             if checkpoint_every > 0 and (i + 1) % checkpoint_every == 0:
-                util.save_to_text(checkpoint_root + "." + str(i + 1) + ".txt", x, self.words)
+                util.save_to_text(checkpoint_root + "." + str(i + 1) + ".txt", *self.unpermute(x))
+            if evaluator is not None and (i + 1) % eval_every == 0:
+                evaluator.submit(x, i + 1)
+            if tracker is not None:
+                tracker.update(x, i + 1)
 
         if (mode == "alecton" or
             mode == "vr" or
             mode == "sgd"):
             if (type(self.mat) == scipy.sparse.csr.csr_matrix or
                 type(self.mat) == scipy.sparse.coo.coo_matrix or
-                type(self.mat) == scipy.sparse.csc.csc_matrix):
+                type(self.mat) == scipy.sparse.csc.csc_matrix or
+                isinstance(self.mat, (matrix.SymmetricMatrix, matrix.HybridMatrix, matrix.CompressedMatrix))):
                 self.mat = self.mat.tocoo()
                 ind = torch.from_numpy(np.array([self.mat.row, self.mat.col])).type(torch.LongTensor)
                 val = self.CpuTensor(self.mat.data)
                 self.mat = tensor_type.to_sparse(self.CpuTensor)(ind, val, torch.Size(self.mat.shape))
 
-            sample = util.get_sampler(self.mat, batch, scheme, sequential)
+            sample = util.get_sampler(self.mat, batch, scheme, sequential, seed)
+
+        # Order of the entries in each epoch of sgd and glove
+        rng = np.random.RandomState(seed) if shuffle else None
 
         if mode == "pi":
-            self.embedding, _ = solver.power_iteration(self.mat, self.embedding, x0=prev, iterations=iterations, beta=momentum, norm_freq=normfreq, gpu=gpu, checkpoint=checkpoint)
+            self.embedding, _ = solver.power_iteration(self.mat, self.embedding, x0=prev, iterations=iterations, beta=momentum, norm_freq=normfreq, gpu=gpu, checkpoint=checkpoint, lock_tol=lock_tol, accelerate=accelerate, warmup=warmup, ritz=ritz)
         elif mode == "alecton":
-            self.embedding = solver.alecton(self.mat, self.embedding, iterations=iterations, eta=eta, norm_freq=normfreq, sample=sample, gpu=gpu, checkpoint=checkpoint)
+            self.embedding = solver.alecton(self.mat, self.embedding, iterations=iterations, eta=eta, norm_freq=normfreq, sample=sample, gpu=gpu, checkpoint=checkpoint, ritz=ritz, prefetch=prefetch)
         elif mode == "vr":
             self.embedding, _ = solver.vr(self.mat, self.embedding, x0=prev, iterations=iterations, beta=momentum, norm_freq=normfreq, batch=batch, innerloop=innerloop)
         elif mode == "sgd":
-            self.embedding = solver.sgd(self.mat, self.embedding, iterations=iterations, eta=eta, batch=batch)
+            self.embedding = solver.sgd(self.mat, self.embedding, iterations=iterations, eta=eta, batch=batch, rng=rng)
         elif mode == "glove":
             # TODO: fix defaults
             # scale = 0
-            self.embedding, bias = solver.glove(self.mat, self.embedding, bias=self.bias, iterations=iterations, eta=eta, batch=batch)
+            self.embedding, bias = solver.glove(self.mat, self.embedding, bias=self.bias, iterations=iterations, eta=eta, batch=batch, rng=rng)
         elif mode == "sparsesvd":
             self.embedding = solver.sparseSVD(self.mat, self.dim)
+        elif mode == "nystrom":
+            # Without word counts, landmarks are chosen by row sums
+            counts = self.vocab.numpy() if hasattr(self, "vocab") else None
+            self.embedding = solver.nystrom(self.mat, self.dim, landmarks, landmark_sampling, counts, seed, self.CpuTensor().numpy().dtype)
+        elif mode == "lobpcg":
+            self.embedding = solver.lobpcg(self.mat, self.embedding, iterations=iterations, tol=tol, gpu=gpu)
+        elif mode == "arpack":
+            self.embedding = solver.arpack(self.mat, self.embedding, iterations=iterations, tol=tol, gpu=gpu)
+
+        if evaluator is not None:
+            evaluator.close()
+        if tracker is not None:
+            tracker.close()
 
         self.scale(scale)
         if normalize:
@@ -327,11 +658,27 @@ class Embedding(object):
         embedding = self.embedding
         if embedding.is_cuda:
             embedding = embedding.cpu()
-        embedding = embedding.numpy()
-        return evaluate.evaluate(self.words, {self.words[i]: embedding[i, :] for i in range(len(self.words))})
+        return evaluate.evaluate(self.words, embedding.numpy())
 
     def save_to_text(self, filename):
-        util.save_to_text(filename, self.embedding, self.words)
+        util.save_to_text(filename, *self.unpermute(self.embedding))
+
+    def save_to_pq(self, filename, subvectors=10, centroids=256):
+        """Saves a product-quantized copy of the embedding, and reports the
+        accuracy lost against the memory saved."""
+        embedding, words = self.unpermute(self.embedding.cpu())
+        W = embedding.numpy()
+        quantizer = pq.train(W, subvectors, centroids, words=words)
+        quantizer.save(filename)
+
+        full = evaluate.evaluate(words, W)
+        compressed = evaluate.evaluate(words, quantizer)
+        self.logger.info("Product quantization: {:.1f} MB -> {:.1f} MB ({:.1f}x smaller)".format(
+                         W.size * 4 / 2. ** 20, quantizer.nbytes / 2. ** 20, W.size * 4. / quantizer.nbytes))
+        for task in ["analogy-add", "analogy-mul"]:
+            self.logger.info("    {}: {:.4f} -> {:.4f}".format(task, full[task], compressed[task]))
+        self.logger.info("    similarity (cos): {:.4f} -> {:.4f}".format(full["similarity"][1], compressed["similarity"][1]))
+        return quantizer
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,191 @@
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import scipy.sparse
+
+import embedding.kernels as kernels
+
+
+class SymmetricMatrix(object):
+    """Symmetric sparse matrix storing only the upper triangle (with the
+    diagonal) in CSR format."""
+
+    def __init__(self, upper):
+        self.upper = scipy.sparse.csr_matrix(upper)
+        self.shape = self.upper.shape
+        self.dtype = self.upper.dtype
+
+    def dot(self, x):
+        return kernels.symmetric_mm(self.upper.indptr, self.upper.indices, self.upper.data, np.ascontiguousarray(x))
+
+    def sum_rows(self):
+        upper = self.upper
+        return (np.asarray(upper.sum(1)).squeeze(1) +
+                np.asarray(upper.sum(0)).squeeze(0) -
+                upper.diagonal())
+
+    @property
+    def nnz(self):
+        return self.upper.nnz
+
+    @property
+    def nbytes(self):
+        return nbytes(self.upper)
+
+    def tocsr(self):
+        strict = scipy.sparse.triu(self.upper, 1)
+        return (self.upper + strict.T).tocsr()
+
+    def tocoo(self):
+        return self.tocsr().tocoo()
+
+    def tocsc(self):
+        return self.tocsr().tocsc()
+
+
+class HybridMatrix(object):
+    """Sparse matrix with its leading head x head block stored densely.
+
+    With the words sorted by frequency (as in GloVe vocab files), the
+    leading block holds the most frequent words and is nearly dense; its
+    product is a BLAS GEMM, and the remaining entries are kept in CSR
+    format.
+    """
+
+    def __init__(self, A, head):
+        A = A.tocoo()
+        self.head = head
+        self.shape = A.shape
+        self.dtype = A.dtype
+
+        inside = (A.row < head) & (A.col < head)
+        self.dense = scipy.sparse.coo_matrix((A.data[inside], (A.row[inside], A.col[inside])), shape=(head, head)).toarray()
+        self.tail = scipy.sparse.csr_matrix((A.data[~inside], (A.row[~inside], A.col[~inside])), shape=A.shape)
+
+    def dot(self, x):
+        y = self.tail * x
+        y[:self.head] += np.dot(self.dense, x[:self.head])
+        return y
+
+    def sum_rows(self):
+        s = np.asarray(self.tail.sum(1)).squeeze(1)
+        s[:self.head] += self.dense.sum(1)
+        return s
+
+    @property
+    def nnz(self):
+        return self.tail.nnz + np.count_nonzero(self.dense)
+
+    @property
+    def nbytes(self):
+        return self.dense.nbytes + nbytes(self.tail)
+
+    def tocsr(self):
+        head = scipy.sparse.coo_matrix(self.dense)
+        head = scipy.sparse.csr_matrix((head.data, (head.row, head.col)), shape=self.shape)
+        return (self.tail + head).tocsr()
+
+    def tocoo(self):
+        return self.tocsr().tocoo()
+
+    def tocsc(self):
+        return self.tocsr().tocsc()
+
+
+class CompressedMatrix(object):
+    """Sparse matrix in CSR format with compressed column indices.
+
+    The columns of each row are stored as the gaps between consecutive
+    columns in variable-byte format (kernels.varint_encode), which takes one
+    byte for most gaps once the words are sorted by frequency. Rows are
+    grouped in blocks of block rows, each starting at a recorded byte
+    offset. The product decodes the columns as it goes
+    (kernels.compressed_mm).
+    """
+
+    def __init__(self, A, block=64):
+        A = scipy.sparse.csr_matrix(A)
+        A.sort_indices()
+        self.shape = A.shape
+        self.dtype = A.dtype
+        self.block = block
+        self.indptr = A.indptr
+        self.data = A.data
+        self.code, self.offsets = kernels.varint_encode(A.indptr, A.indices, block)
+        self.index_bytes = A.indices.nbytes
+
+    def dot(self, x):
+        return kernels.compressed_mm(self.indptr, self.offsets, self.block, self.code, self.data, np.ascontiguousarray(x))
+
+    def sum_rows(self):
+        row = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return kernels.sum_rows(self.shape[0], row, self.data)
+
+    @property
+    def nnz(self):
+        return self.data.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.indptr.nbytes + self.code.nbytes + self.offsets.nbytes
+
+    @property
+    def ratio(self):
+        """Compression ratio of the column indices."""
+        return self.index_bytes / float(max(self.code.nbytes + self.offsets.nbytes, 1))
+
+    def tocsr(self):
+        indices = kernels.varint_decode(self.indptr, self.code)
+        return scipy.sparse.csr_matrix((self.data, indices, self.indptr), shape=self.shape)
+
+    def tocoo(self):
+        return self.tocsr().tocoo()
+
+    def tocsc(self):
+        return self.tocsr().tocsc()
+
+
+def hybrid_head(A, density=0.25, max_bytes=2 ** 28):
+    """Largest H such that the leading H x H block of A has at least the
+    given density (and fits in max_bytes when dense), or 0."""
+    A = A.tocoo()
+    if A.nnz == 0:
+        return 0
+    # The entry (i, j) is in the leading H x H block iff max(i, j) < H
+    inner = np.cumsum(np.bincount(np.maximum(A.row, A.col), minlength=A.shape[0]))
+    H = np.arange(1, A.shape[0] + 1)
+    dense = (inner >= density * H * H) & (H * H * A.dtype.itemsize <= max_bytes)
+    if not dense.any():
+        return 0
+    return int(H[np.flatnonzero(dense)[-1]])
+
+
+def to_hybrid(A, density=0.25, max_bytes=2 ** 28):
+    """Returns the hybrid form of A, or None if no leading block is dense
+    enough."""
+    head = hybrid_head(A, density, max_bytes)
+    if head == 0:
+        return None
+    return HybridMatrix(A, head)
+
+
+def is_symmetric(A, tol=1e-6):
+    """Checks if a scipy sparse matrix is symmetric (up to relative tol)."""
+    if A.shape[0] != A.shape[1]:
+        return False
+    diff = abs(A - A.T)
+    if diff.nnz == 0:
+        return True
+    return diff.max() <= tol * abs(A).max()
+
+
+def to_symmetric(A, tol=1e-6):
+    """Returns the half-storage form of A, or None if A is not symmetric."""
+    if not is_symmetric(A, tol):
+        return None
+    return SymmetricMatrix(scipy.sparse.triu(A, format="csr"))
+
+
+def nbytes(A):
+    """Number of bytes used by the arrays of a scipy CSR/CSC matrix."""
+    return A.data.nbytes + A.indices.nbytes + A.indptr.nbytes
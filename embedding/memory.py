@@ -0,0 +1,142 @@
+"""Peak memory estimates, and the chunk sizes and strategies that fit a budget.
+
+The estimates only count the large arrays (proportional to nnz or n x dim),
+so they are lower bounds on the resident size of the process.
+"""
+
+from __future__ import print_function, absolute_import
+
+import os
+import logging
+
+import embedding.util as util
+import embedding.blockcsr as blockcsr
+import embedding.evaluate as evaluate
+
+# Number of n x dim blocks held by each solver (iterate, product, momentum,
+# QR workspace, ...)
+BLOCKS = {"pi": 4, "alecton": 3, "vr": 5, "sgd": 2, "glove": 2, "sparsesvd": 4, "lobpcg": 8, "arpack": 6, "nystrom": 6}
+
+# Bytes per non-zero of a GloVe record, of a torch sparse tensor (two int64
+# indices) without its value, and of a scipy CSR matrix (int32 index)
+# without its value
+GLOVE_RECORD = 16
+SPARSE_INDEX = 16
+CSR_INDEX = 4
+
+
+class Plan(object):
+    def __init__(self, n, nnz, dim, itemsize, memory, gpu_memory, gpu):
+        self.n = n
+        self.nnz = nnz
+        self.dim = dim
+        self.itemsize = itemsize
+        self.memory = memory
+        self.gpu_memory = gpu_memory
+        self.gpu = gpu
+        self.peak = {}
+        self.notes = []
+
+    def report(self):
+        mb = lambda b: "{:10.1f} MB".format(b / 2. ** 20)
+        lines = ["Memory plan for " + str(self.n) + " words, " + str(self.nnz) + " non-zeros, dimension " + str(self.dim),
+                 "    budget            " + mb(self.memory) + ("  (GPU " + mb(self.gpu_memory).strip() + ")" if self.gpu else "")]
+        for stage in ["load", "preprocess", "solve", "evaluate"]:
+            lines.append("    {:<18}".format(stage) + mb(self.peak[stage]) +
+                         ("  over budget" if self.peak[stage] > self.memory else ""))
+        lines.append("    load chunk        {:>10} records ({})".format(self.load_chunk, "in-core" if self.load_chunk >= self.nnz else "streaming"))
+        lines.append("    matrix storage    " + ("symmetric" if self.symmetric else "full"))
+        if self.gpu:
+            lines.append("    matrix on GPU     " + ("yes" if self.matgpu else "no (" + str(self.mm_batches[0]) + " batches per product)"))
+            lines.append("    embedding batches " + str(self.mm_batches[1]))
+        lines.append("    analogy batch     " + str(self.split_size) + " questions")
+        lines.extend(["    " + n for n in self.notes])
+        return "\n".join(lines)
+
+    def apply(self):
+        """Sets the module-level sizes used by util.mm and the evaluation."""
+        util.GPU_MEMORY = self.gpu_memory
+        evaluate.SPLIT_SIZE = self.split_size
+
+
+def split_size(n, dim, memory):
+    """Number of analogy questions scored at once within memory.
+
+    The normalized embedding is held twice (float64), and 3CosMul keeps
+    three n-long float64 scores per question.
+    """
+    free = memory - 2 * 8 * n * dim
+    return int(max(1, min(10000, free // (3 * 8 * max(n, 1)))))
+
+
+def plan(n, nnz, dim, itemsize=4, memory=2 ** 32, gpu_memory=2 ** 30, gpu=False, solver="pi", symmetric=False, matgpu=None):
+    p = Plan(n, nnz, dim, itemsize, memory, gpu_memory, gpu)
+    dense = n * dim * itemsize
+    sparse = nnz * (SPARSE_INDEX + itemsize)
+    csr = nnz * (CSR_INDEX + itemsize) + 8 * (n + 1)
+
+    # Load: the indices and values are filled in place, one chunk of
+    # records at a time (a single chunk is an in-core read of the file)
+    incore = sparse + nnz * (GLOVE_RECORD + 8 + SPARSE_INDEX)
+    if incore <= memory:
+        p.load_chunk = max(nnz, 1)
+        p.peak["load"] = incore
+    else:
+        p.load_chunk = int(max(2 ** 16, (memory - sparse) // (2 * (GLOVE_RECORD + SPARSE_INDEX + itemsize))))
+        p.load_chunk = min(p.load_chunk, max(nnz, 1))
+        p.peak["load"] = sparse + p.load_chunk * (GLOVE_RECORD + SPARSE_INDEX + itemsize)
+
+    # Preprocess: two temporary copies of the values, then the CSR
+    # conversion on CPU (with a sorted copy of the entries)
+    p.peak["preprocess"] = sparse + 2 * nnz * itemsize
+    if not gpu:
+        p.peak["preprocess"] = max(p.peak["preprocess"], sparse + csr + nnz * (SPARSE_INDEX + itemsize))
+
+    # Solve: the stored matrix and the dense blocks of the solver
+    blocks = BLOCKS.get(solver, 4) * dense
+    p.symmetric = symmetric
+    if gpu:
+        p.matgpu = matgpu if matgpu is not None else sparse + blocks <= gpu_memory
+        p.peak["solve"] = (0 if p.matgpu else sparse) + blocks
+        p.mm_batches = util.mm_batches(nnz, dim, SPARSE_INDEX + itemsize, n * itemsize, gpu_memory)
+        if p.matgpu:
+            p.mm_batches = (1, 1)
+        elif matgpu is None:
+            p.notes.append("Matrix does not fit in GPU memory, so products are streamed from the host.")
+    else:
+        p.matgpu = False
+        full = csr + blocks
+        half = (nnz + n) // 2 * (CSR_INDEX + itemsize) + 8 * (n + 1) + blocks
+        if not symmetric and full > memory and half <= memory:
+            p.symmetric = True
+            p.notes.append("Full matrix does not fit, so symmetric (upper triangle) storage is used.")
+        p.peak["solve"] = half if p.symmetric else full
+
+    # Evaluate
+    p.split_size = split_size(n, dim, memory)
+    p.peak["evaluate"] = 2 * 8 * n * dim + 3 * 8 * n * p.split_size
+
+    if max(p.peak.values()) > memory:
+        p.notes.append("Estimated peak exceeds the budget; consider --max-vocab or --ranks.")
+    return p
+
+
+def plan_files(vocab_file, cooccurrence_file, dim, itemsize=4, memory=2 ** 32, gpu_memory=2 ** 30, gpu=False, solver="pi", symmetric=False, matgpu=None, max_vocab=0, min_count=0):
+    """Plans from the sizes of the input files, without loading the matrix.
+
+    With a truncated vocabulary, the number of non-zeros of the full
+    matrix is used as an upper bound.
+    """
+    words, counts = util.load_vocab(vocab_file)
+    keep = util.truncate_vocab(counts, max_vocab, min_count)
+    n = len(words) if keep is None else keep.shape[0]
+
+    if blockcsr.is_blockcsr(cooccurrence_file):
+        nnz = blockcsr.BlockCSR(cooccurrence_file).nnz
+    else:
+        nnz = os.stat(cooccurrence_file).st_size // blockcsr.GLOVE_DTYPE.itemsize
+
+    p = plan(n, nnz, dim, itemsize, memory, gpu_memory, gpu, solver, symmetric, matgpu)
+    if keep is not None:
+        p.notes.append("Non-zeros are those of the full vocabulary (upper bound).")
+    return p
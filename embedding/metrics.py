@@ -0,0 +1,160 @@
+from __future__ import print_function, absolute_import
+
+import csv
+import time
+import logging
+import threading
+import collections
+import numpy as np
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import embedding.evaluate as evaluate
+import embedding.util as util
+
+
+class MetricsWriter(object):
+    """Appends rows of metrics to a CSV file.
+
+    The columns are fixed by the first row written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def write(self, row):
+        with self.lock:
+            if self.writer is None:
+                self.file = open(self.filename, "w")
+                self.writer = csv.DictWriter(self.file, fieldnames=list(row.keys()))
+                self.writer.writeheader()
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class BackgroundEvaluator(object):
+    """Evaluates snapshots of an embedding on a worker thread, so that the
+    solver does not wait for the evaluation."""
+
+    def __init__(self, words, writer, maxsize=2):
+        self.words = words
+        self.writer = writer
+        self.begin = time.time()
+        self.logger = logging.getLogger(__name__)
+
+        # Bounded, so that a slow evaluation eventually throttles the solver
+        # instead of accumulating snapshots
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, x, iteration):
+        snapshot = x.cpu().numpy().copy()
+        self.queue.put((iteration, time.time() - self.begin, snapshot))
+
+    def close(self, timeout=600):
+        """Waits up to `timeout` seconds for the pending evaluations."""
+        try:
+            self.queue.put(None, timeout=timeout)
+            self.thread.join(timeout)
+        except queue.Full:
+            pass
+        if self.thread.is_alive():
+            self.logger.warn("Evaluations still running after " + str(timeout) + " seconds; not waiting for them")
+        self.writer.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            iteration, elapsed, W = item
+
+            # A failed evaluation is only logged; if it stopped the thread,
+            # submit would block forever on the full queue
+            try:
+                begin = time.time()
+                score = evaluate.evaluate(self.words, W)
+                row = {"iteration": iteration,
+                       "time": elapsed,
+                       "similarity-dot": score["similarity"][0],
+                       "similarity-cos": score["similarity"][1],
+                       "analogy-add": score["analogy-add"],
+                       "analogy-mul": score["analogy-mul"]}
+                self.writer.write(row)
+                self.logger.info("Evaluation of iteration " + str(iteration) + " took " + str(time.time() - begin))
+            except Exception:
+                self.logger.exception("Evaluation of iteration " + str(iteration) + " failed")
+
+
+class ConvergenceTracker(object):
+    """Measures the alignment of the iterates with a reference embedding.
+
+    The reference is read from a text vectors file and its rows are
+    matched to the words of the iterates, so it can come from a run with a
+    different word order. Its columns should be eigenvectors (for example,
+    a checkpoint, or vectors saved without --normalize); the column scaling
+    does not matter.
+
+    Each row of the trace holds, for one iteration, 1 - |cos| between
+    matching columns, its worst value over the columns, and the principal
+    angles (in radians) between the two subspaces.
+    """
+
+    def __init__(self, reference, words, writer):
+        self.writer = writer
+        self.begin = time.time()
+        self.logger = logging.getLogger(__name__)
+
+        ref_words, R = util.load_vectors(reference, np.float64)
+        index = {w: i for (i, w) in enumerate(ref_words)}
+        rows = np.array([index.get(w, -1) for w in words])
+        found = rows != -1
+        if not found.all():
+            self.logger.warn(str(np.sum(~found)) + " words are missing from the reference embedding")
+
+        self.ref = np.zeros((len(words), R.shape[1]))
+        self.ref[found, :] = R[rows[found], :]
+        self.ref /= np.maximum(np.sqrt(np.sum(self.ref * self.ref, 0)), 1e-30)
+        self.basis, _ = np.linalg.qr(self.ref)
+
+    def update(self, x, iteration):
+        X = x.cpu().numpy().astype(np.float64)
+        d = min(X.shape[1], self.ref.shape[1])
+
+        norm = np.maximum(np.sqrt(np.sum(X * X, 0)), 1e-30)
+        loss = 1 - np.abs(np.sum(X[:, :d] * self.ref[:, :d], 0)) / norm[:d]
+
+        # Cosines of the principal angles are the singular values of
+        # Q_x^T Q_ref; Q_x^T is obtained from the (small) Gram matrix of X
+        try:
+            L = np.linalg.cholesky(np.dot(X.T, X))
+            M = np.linalg.solve(L, np.dot(X.T, self.basis))
+        except np.linalg.LinAlgError:
+            M = np.dot(np.linalg.qr(X)[0].T, self.basis)
+        angles = np.arccos(np.clip(np.linalg.svd(M, compute_uv=False), 0, 1))
+
+        row = collections.OrderedDict([("iteration", iteration),
+                                       ("time", time.time() - self.begin),
+                                       ("worst", loss.max())])
+        for (i, l) in enumerate(loss):
+            row["column" + str(i)] = l
+        for (i, a) in enumerate(angles):
+            row["angle" + str(i)] = a
+        self.writer.write(row)
+        self.logger.info("Iteration " + str(iteration) + ": worst 1 - |cos| = {:.3e}, largest principal angle = {:.3e}".format(loss.max(), angles.max()))
+
+    def close(self):
+        self.writer.close()
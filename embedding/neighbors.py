@@ -0,0 +1,102 @@
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import time
+import struct
+import logging
+import multiprocessing
+import multiprocessing.pool
+
+import embedding.util as util
+
+# On-disk layout: header (magic, version, words, k), then the ids as
+# int32[words, k] and the scores as float16[words, k], both sorted by
+# decreasing similarity within each row.
+MAGIC = b"EMBKNN\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIqq")
+
+
+def top_k(W, k=100, memory=2 ** 30, threads=None):
+    """Exact cosine top-k neighbors (excluding the word itself) of every row.
+
+    The similarities are computed in tiles of rows against all words, with
+    the tile size chosen so that the tiles of all threads fit in memory.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    n, dim = W.shape
+    k = min(k, n - 1)
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+
+    norm = np.sqrt(np.sum(W * W, 1, keepdims=True))
+    norm[norm == 0] = 1
+    W = (W / norm).astype(np.float32)
+
+    # Per row of a tile: the similarities (float32), the negated copy made
+    # for argpartition (float32) and the partition (int64)
+    block = int(max(1, min(n, memory // (threads * n * (4 + 4 + 8)))))
+    logger.info("Computing neighbors in tiles of " + str(block) + " words with " + str(threads) + " threads")
+
+    ids = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float16)
+
+    def tile(start):
+        end = min(start + block, n)
+        rows = np.arange(end - start)
+
+        sim = np.dot(W[start:end, :], W.T)
+        sim[rows, rows + start] = -np.inf
+
+        part = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        best = sim[rows[:, np.newaxis], part]
+        order = np.argsort(-best, axis=1)
+        ids[start:end, :] = part[rows[:, np.newaxis], order]
+        scores[start:end, :] = best[rows[:, np.newaxis], order]
+
+    begin = time.time()
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        pool.map(tile, range(0, n, block))
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - begin
+    logger.info("Computing neighbors took " + str(elapsed) + " (" + str(int(n / max(elapsed, 1e-9))) + " words / s)")
+
+    return ids, scores
+
+
+def save(filename, ids, scores):
+    n, k = ids.shape
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, k))
+        f.write(ids.astype("<i4").tobytes())
+        f.write(scores.astype("<f2").tobytes())
+
+
+def load(filename):
+    """Returns memory-mapped (ids, scores) of a neighbor table."""
+    with open(filename, "rb") as f:
+        magic, version, n, k = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("\"" + filename + "\" is not a neighbor table.")
+    ids = np.memmap(filename, dtype="<i4", mode="r", offset=HEADER.size, shape=(n, k))
+    scores = np.memmap(filename, dtype="<f2", mode="r", offset=HEADER.size + 4 * n * k, shape=(n, k))
+    return ids, scores
+
+
+def neighbors(vectors, output, k=100, memory=2 ** 30, threads=None):
+    logger = logging.getLogger(__name__)
+
+    begin = time.time()
+    words, W = util.load_vectors(vectors)
+    logger.info("Loading vectors took " + str(time.time() - begin))
+
+    ids, scores = top_k(W, k, memory, threads)
+
+    begin = time.time()
+    save(output, ids, scores)
+    logger.info("Saving neighbors took " + str(time.time() - begin))
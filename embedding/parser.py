@@ -22,11 +22,26 @@ def get_parser():
 
     subparser = parser.add_subparsers(dest="task")
 
+    # Warmup parser
+    subparser.add_parser("warmup", help="Compile the numba kernels ahead of time (stored in the numba cache).")
+
     # Cooccurrence parser
     cooccurrence_parser = subparser.add_parser("cooccurrence", help="Preprocessing (compute vocab and cooccurrence from text).")
 
     cooccurrence_parser.add_argument("text", type=str, nargs="?", default="text", help="filename of text file")
 
+    # Convert parser
+    convert_parser = subparser.add_parser("convert", help="Convert a GloVe cooccurrence binary into the blocked CSR format.")
+
+    convert_parser.add_argument("-c", "--cooccurrence", type=str, default="cooccurrence.bin",
+                                help="filename of cooccurrence binary")
+    convert_parser.add_argument("-o", "--output", type=str, default="cooccurrence.csr",
+                                help="filename for blocked CSR output")
+    convert_parser.add_argument("--vocab", type=str, default=None,
+                                help="filename of vocabulary file (size is inferred from indices if omitted)")
+    convert_parser.add_argument("--blocksize", type=int, default=2 ** 16,
+                                help="Number of rows per block")
+
     # Compute parser
     compute_parser = subparser.add_parser("compute", help="Compute embedding from scratch via cooccurrence matrix.")
 
@@ -36,7 +51,7 @@ def get_parser():
     compute_parser.add_argument("--vocab", type=str, default="vocab.txt",
                                 help="filename of vocabulary file")
     compute_parser.add_argument("-c", "--cooccurrence", type=str, default="cooccurrence.bin",
-                                help="filename of cooccurrence binary")
+                                help="filename of cooccurrence binary (GloVe or blocked CSR format)")
     compute_parser.add_argument("--initial", type=str, default=None,
                                 help="filename of initial embedding vectors")
     compute_parser.add_argument("--initialbias", type=str, default=None,
@@ -45,8 +60,22 @@ def get_parser():
                                 help="filename for embedding vectors output")
     compute_parser.add_argument("--bias", type=str, default="bias.txt",
                                 help="filename for bias output")
+    compute_parser.add_argument("--pq", type=str, default=None,
+                                help="filename for product-quantized embedding output (off if not given)")
+    compute_parser.add_argument("--pq-subvectors", type=int, default=10,
+                                help="Number of sub-vectors for product quantization")
+    compute_parser.add_argument("--pq-centroids", type=int, default=256,
+                                help="Codebook size for product quantization")
     compute_parser.add_argument("--checkpoint", type=int, default=0,
                                 help="frequency of saving intermediate computations (0 to turn off)")
+    compute_parser.add_argument("--eval-every", type=int, default=0,
+                                help="frequency of evaluating intermediate computations in memory (0 to turn off)")
+    compute_parser.add_argument("--metrics", type=str, default="metrics.csv",
+                                help="filename for scores of intermediate evaluations")
+    compute_parser.add_argument("--reference", type=str, default=None,
+                                help="filename of reference vectors to track convergence against every iteration")
+    compute_parser.add_argument("--trace", type=str, default="trace.csv",
+                                help="filename for the convergence trace (see plot_convergence.py)")
 
     compute_parser.add_argument("-p", "--preprocessing", type=str.lower, default="ppmi",
                                 choices=["none", "log1p", "ppmi"],
@@ -55,18 +84,59 @@ def get_parser():
                                 help="Number of negative samples (for shifted PMI)")
     compute_parser.add_argument("--alpha", type=float, default=1.,
                                 help="Context distribution smoothing parameter")
+    compute_parser.add_argument("--sparsify", type=float, default=0.,
+                                help="Fraction of non-zeros to keep by unbiased random sparsification after preprocessing (0 to turn off)")
+    compute_parser.add_argument("--sparsify-error", type=float, default=0.,
+                                help="Relative spectral-norm error of the sparsification (overrides --sparsify when positive)")
+
+    compute_parser.add_argument("--symmetric", type=util.str2bool, default=False,
+                                help="Toggle to store only the upper triangle of a symmetric cooccurrence matrix")
+    compute_parser.add_argument("--hybrid", type=util.str2bool, default=False,
+                                help="Toggle to store the dense block of the most frequent words as a dense array")
+    compute_parser.add_argument("--compress", type=util.str2bool, default=False,
+                                help="Toggle to store the column indices delta and variable-byte encoded (decoded during SpMM)")
+
+    compute_parser.add_argument("--reorder", type=str.lower, default="none",
+                                choices=["none", "frequency", "rcm"],
+                                help="Relabeling of words to make SpMM more cache-friendly (rcm: reverse Cuthill-McKee)")
+    compute_parser.add_argument("--memory", type=util.str2bytes, default="4G",
+                                help="host memory budget used to choose chunk sizes and storage (such as 512M or 4G)")
+    compute_parser.add_argument("--gpu-memory", type=util.str2bytes, default="1G",
+                                help="GPU memory budget for streamed products")
+    compute_parser.add_argument("--dry-run", action="store_true",
+                                help="print the memory plan and exit")
+    compute_parser.add_argument("--max-vocab", type=int, default=0,
+                                help="Keep only the K most frequent words (0 for all)")
+    compute_parser.add_argument("--min-count", type=int, default=0,
+                                help="Keep only words occurring at least this many times")
 
     compute_parser.add_argument("-s", "--solver", type=str.lower, default="pi",
-                                choices=["pi", "alecton", "vr", "sgd", "glove", "sparsesvd", "gemsim"],
+                                choices=["pi", "alecton", "vr", "sgd", "glove", "sparsesvd", "lobpcg", "arpack", "nystrom", "gemsim"],
                                 help="Solver used to find top eigenvectors")
+    compute_parser.add_argument("--landmarks", type=int, default=0,
+                                help="Number of landmark words used by nystrom (0 for 20 times the dimension)")
+    compute_parser.add_argument("--landmark-sampling", type=str.lower, default="frequency",
+                                choices=["frequency", "leverage"],
+                                help="Choice of landmark words used by nystrom")
     compute_parser.add_argument("-i", "--iterations", type=int, default=50,
                                 help="Iterations used by solver")
+    compute_parser.add_argument("-t", "--tol", type=float, default=1e-5,
+                                help="Convergence tolerance used by solver (lobpcg, arpack)")
     compute_parser.add_argument("-e", "--eta", "--step", type=float, default=1e-3,
                                 help="Learning rate used by solver")
     compute_parser.add_argument("-m", "--momentum", "--beta", type=float, default=0.,
                                 help="Momentum used by solver")
+    compute_parser.add_argument("--accelerate", type=str.lower, default="none",
+                                choices=["none", "momentum", "chebyshev"],
+                                help="Accelerate power iteration with momentum or Chebyshev polynomials over the estimated unwanted spectrum")
+    compute_parser.add_argument("--warmup", type=int, default=5,
+                                help="Plain iterations used to estimate the spectral gap for --accelerate (at least 2)")
     compute_parser.add_argument("-f", "--normfreq", type=int, default=1,
                                 help="Normalization frequency used by solver")
+    compute_parser.add_argument("--lock-tol", type=float, default=0.,
+                                help="Residual below which leading eigenvectors are locked by power iteration (0 to turn off)")
+    compute_parser.add_argument("--ritz", type=int, default=0,
+                                help="Rayleigh-Ritz step every K iterations of power iteration and alecton (0 to turn off)")
     compute_parser.add_argument("-j", "--innerloop", type=int, default=10,
                                 help="Inner loop iterations used by solver")
     compute_parser.add_argument("-b", "--batch", type=int, default=100000,
@@ -76,6 +146,12 @@ def get_parser():
                                 help="Sampling scheme")
     compute_parser.add_argument("--sequential", type=bool, default=True,
                                 help="Whether or not to sample in order")
+    compute_parser.add_argument("--shuffle", type=util.str2bool, default=True,
+                                help="Visit the cooccurrence entries in a new (blockwise) random order every epoch of sgd and glove")
+    compute_parser.add_argument("--seed", type=int, default=0,
+                                help="Seed of the shuffling and of the random samplers")
+    compute_parser.add_argument("--prefetch", type=int, default=2,
+                                help="Number of samples alecton builds ahead on a background thread (0 to turn off)")
 
     compute_parser.add_argument("--scale", type=float, default=0.5,
                                 help="Scale on eigenvector is $\lambda_i ^ s$")
@@ -93,6 +169,89 @@ def get_parser():
                                 choices=["float", "double"],
                                 help="Precision of values")
 
+    compute_parser.add_argument("--ranks", type=int, default=0,
+                                help="Number of local processes for row-partitioned power iteration (0 to turn off)")
+    compute_parser.add_argument("--ortho", type=str.lower, default="gram",
+                                choices=["gram", "gather"],
+                                help="Orthonormalization with multiple ranks (reduced Gram matrix or gathered QR)")
+
+    # Sweep parser
+    sweep_parser = subparser.add_parser("sweep", help="Compute embeddings for a grid of solver configurations, sharing one loaded cooccurrence matrix.")
+
+    sweep_parser.add_argument("--vocab", type=str, default="vocab.txt",
+                              help="filename of vocabulary file")
+    sweep_parser.add_argument("-c", "--cooccurrence", type=str, default="cooccurrence.bin",
+                              help="filename of cooccurrence binary")
+    sweep_parser.add_argument("-o", "--results", type=str, default="sweep.csv",
+                              help="filename for table of results")
+
+    sweep_parser.add_argument("-p", "--preprocessing", type=str.lower, default="ppmi",
+                              choices=["none", "log1p", "ppmi"],
+                              help="Preprocessing of cooccurrence matrix before eigenvector computation")
+    sweep_parser.add_argument("--negative", type=float, default=1.,
+                              help="Number of negative samples (for shifted PMI)")
+    sweep_parser.add_argument("--alpha", type=float, default=1.,
+                              help="Context distribution smoothing parameter")
+
+    sweep_parser.add_argument("-d", "--dim", type=int, nargs="+", default=[50],
+                              help="dimensions of embedding to sweep over")
+    sweep_parser.add_argument("--scale", type=float, nargs="+", default=[0.5],
+                              help="Scales on eigenvectors to sweep over")
+    sweep_parser.add_argument("-s", "--solver", type=str.lower, nargs="+", default=["pi"],
+                              choices=["pi", "alecton", "vr", "sgd", "glove", "sparsesvd", "lobpcg", "arpack", "nystrom"],
+                              help="Solvers to sweep over")
+    sweep_parser.add_argument("-m", "--momentum", "--beta", type=float, nargs="+", default=[0.],
+                              help="Momentums to sweep over")
+
+    sweep_parser.add_argument("-i", "--iterations", type=int, default=50,
+                              help="Iterations used by solver")
+    sweep_parser.add_argument("-e", "--eta", "--step", type=float, default=1e-3,
+                              help="Learning rate used by solver")
+    sweep_parser.add_argument("-f", "--normfreq", type=int, default=1,
+                              help="Normalization frequency used by solver")
+    sweep_parser.add_argument("-j", "--innerloop", type=int, default=10,
+                              help="Inner loop iterations used by solver")
+    sweep_parser.add_argument("-b", "--batch", type=int, default=100000,
+                              help="Batch size used by solver")
+    sweep_parser.add_argument("-n", "--normalize", type=util.str2bool, default=False,
+                              help="Toggle to normalize embeddings")
+
+    sweep_parser.add_argument("--processes", type=int, default=None,
+                              help="Number of solver processes (defaults to number of cores)")
+    sweep_parser.add_argument("--precision", type=str.lower, default="float",
+                              choices=["float", "double"],
+                              help="Precision of values")
+
+    # Neighbors parser
+    neighbors_parser = subparser.add_parser("neighbors", help="Compute exact cosine top-k neighbors of every word.")
+
+    neighbors_parser.add_argument("--vectors", type=str, default="vectors.txt",
+                                  help="filename of embedding vectors file")
+    neighbors_parser.add_argument("-o", "--output", type=str, default="neighbors.bin",
+                                  help="filename for neighbor table (int32 ids and float16 scores)")
+    neighbors_parser.add_argument("-k", type=int, default=100,
+                                  help="number of neighbors per word")
+    neighbors_parser.add_argument("--memory", type=util.str2bytes, default="1G",
+                                  help="memory budget for similarity tiles (such as 512M or 4G)")
+    neighbors_parser.add_argument("--threads", type=int, default=None,
+                                  help="number of threads (defaults to number of cores)")
+
+    # Serve parser
+    serve_parser = subparser.add_parser("serve", help="Serve vector, similarity, neighbor and analogy lookups over HTTP (Python 3).")
+
+    serve_parser.add_argument("--vectors", type=str, default="vectors.txt",
+                              help="filename of embedding vectors file")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1",
+                              help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8000,
+                              help="port to listen on")
+    serve_parser.add_argument("--socket", type=str, default=None,
+                              help="path of Unix socket to listen on (instead of host and port)")
+    serve_parser.add_argument("--cache", type=int, default=10000,
+                              help="number of responses kept in the LRU cache")
+    serve_parser.add_argument("-b", "--batch", type=int, default=64,
+                              help="maximum number of queries scored in one batch")
+
     # Evaluate parser
     evaluate_parser = subparser.add_parser("evaluate", help="Evaluate performance of an embedding on standard tasks.")
 
@@ -100,5 +259,13 @@ def get_parser():
                                  help="filename of vocabulary file")
     evaluate_parser.add_argument('--vectors', type=str, default='vectors.txt',
                                  help="filename of embedding vectors file")
+    evaluate_parser.add_argument('--pq', type=str, default=None,
+                                 help="filename of product-quantized embedding (used instead of vectors)")
+    evaluate_parser.add_argument('--max-vocab', type=int, default=0,
+                                 help="evaluate only on the K most frequent words (0 for all)")
+    evaluate_parser.add_argument('--min-count', type=int, default=0,
+                                 help="evaluate only on words occurring at least this many times")
+    evaluate_parser.add_argument('--memory', type=util.str2bytes, default="4G",
+                                 help="memory budget used to choose the number of analogy questions scored at once")
 
     return parser
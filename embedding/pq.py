@@ -0,0 +1,132 @@
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import time
+import logging
+
+
+class ProductQuantizer(object):
+    """Product-quantized embedding.
+
+    The rows are normalized before quantization and the norms are stored
+    separately, so that cosine similarities only depend on the codes. Each
+    row is split into m sub-vectors, and each sub-vector is replaced by the
+    id of the closest of k centroids of its codebook.
+    """
+
+    def __init__(self, codebooks, codes, norm=None, dim=None, words=None):
+        self.codebooks = codebooks  # m x k x (padded dim / m)
+        self.codes = codes          # n x m
+        self.norm = norm            # n (None for unit rows)
+        self.dim = dim if dim is not None else codebooks.shape[0] * codebooks.shape[2]
+        self.words = words
+        self.shape = (codes.shape[0], self.dim)
+
+    def normalized(self):
+        """Returns the quantizer of the unit rows (shares the codes)."""
+        return ProductQuantizer(self.codebooks, self.codes, None, self.dim, self.words)
+
+    def rows(self, ind):
+        """Decodes the given rows."""
+        m, k, sub = self.codebooks.shape
+        codes = self.codes[ind, :]
+        x = np.concatenate([self.codebooks[j][codes[:, j]] for j in range(m)], 1)[:, :self.dim]
+        if self.norm is not None:
+            x *= self.norm[ind, np.newaxis]
+        return x
+
+    def dot(self, Q):
+        """Asymmetric inner products of all rows with the (uncompressed)
+        queries Q (q x dim), without decoding the rows."""
+        m, k, sub = self.codebooks.shape
+        Q = pad(np.atleast_2d(Q), m * sub)
+        scores = np.zeros((self.shape[0], Q.shape[0]), dtype=np.float32)
+        for j in range(m):
+            table = np.dot(self.codebooks[j], Q[:, j * sub:(j + 1) * sub].T)  # k x q
+            scores += table[self.codes[:, j], :]
+        if self.norm is not None:
+            scores *= self.norm[:, np.newaxis]
+        return scores
+
+    @property
+    def nbytes(self):
+        n = self.codes.nbytes + self.codebooks.nbytes
+        if self.norm is not None:
+            n += self.norm.nbytes
+        return n
+
+    def save(self, filename):
+        norm = self.norm if self.norm is not None else np.zeros(0, dtype=np.float32)
+        # Through a file object, so that np.savez does not append .npz
+        with open(filename, "wb") as f:
+            np.savez(f, codebooks=self.codebooks, codes=self.codes, norm=norm, dim=self.dim, words=np.array(self.words if self.words is not None else []))
+
+
+def load(filename):
+    data = np.load(filename)
+    words = [str(w) for w in data["words"]] if data["words"].shape[0] != 0 else None
+    norm = data["norm"] if data["norm"].shape[0] != 0 else None
+    return ProductQuantizer(data["codebooks"], data["codes"], norm, int(data["dim"]), words)
+
+
+def pad(x, dim):
+    if x.shape[1] == dim:
+        return x
+    return np.concatenate([x, np.zeros((x.shape[0], dim - x.shape[1]), dtype=x.dtype)], 1)
+
+
+def kmeans(x, k, iterations=20, rng=np.random):
+    """Lloyd's algorithm, initialized with random points."""
+    centroids = x[rng.choice(x.shape[0], k, replace=False), :].copy()
+    for i in range(iterations):
+        assign = nearest(x, centroids)
+        count = np.bincount(assign, minlength=k)
+        total = np.zeros_like(centroids)
+        np.add.at(total, assign, x)
+        nonempty = count > 0
+        centroids[nonempty] = total[nonempty] / count[nonempty, np.newaxis]
+        # Restart empty clusters at random points
+        empty = np.flatnonzero(~nonempty)
+        if empty.shape[0] != 0:
+            centroids[empty] = x[rng.choice(x.shape[0], empty.shape[0], replace=False), :]
+    return centroids
+
+
+def nearest(x, centroids, chunk=65536):
+    assign = np.empty(x.shape[0], dtype=np.int64)
+    c2 = np.sum(centroids * centroids, 1)
+    for start in range(0, x.shape[0], chunk):
+        end = min(start + chunk, x.shape[0])
+        assign[start:end] = np.argmin(c2 - 2 * np.dot(x[start:end], centroids.T), 1)
+    return assign
+
+
+def train(W, subvectors=10, centroids=256, iterations=20, sample=100000, seed=0, words=None):
+    """Product-quantizes the rows of W."""
+
+    logger = logging.getLogger(__name__)
+    begin = time.time()
+
+    rng = np.random.RandomState(seed)
+    n, dim = W.shape
+    W = np.asarray(W, dtype=np.float32)
+    norm = np.sqrt(np.sum(W * W, 1))
+    U = W / np.maximum(norm, 1e-12)[:, np.newaxis]
+
+    m = subvectors
+    sub = (dim + m - 1) // m
+    U = pad(U, m * sub)
+
+    samples = U
+    if n > sample:
+        samples = U[rng.choice(n, sample, replace=False), :]
+    k = min(centroids, samples.shape[0])
+
+    codebooks = np.zeros((m, k, sub), dtype=np.float32)
+    codes = np.zeros((n, m), dtype=np.uint8 if k <= 256 else np.uint16)
+    for j in range(m):
+        codebooks[j] = kmeans(samples[:, j * sub:(j + 1) * sub], k, iterations, rng)
+        codes[:, j] = nearest(U[:, j * sub:(j + 1) * sub], codebooks[j])
+    logger.info("Product quantization took " + str(time.time() - begin))
+
+    return ProductQuantizer(codebooks, codes, norm.astype(np.float32), dim, words)
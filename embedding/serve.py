@@ -0,0 +1,298 @@
+"""Local lookup server for embeddings (requires Python 3)."""
+
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import os
+import time
+import json
+import asyncio
+import logging
+import collections
+import urllib.parse
+
+import embedding.util as util
+
+
+class VectorStore(object):
+    """Memory-mapped embedding with a sorted word index.
+
+    The binary files are built next to the text vectors on first use (or
+    when the text file is newer); afterwards, opening only maps the files,
+    so it does not depend on the size of the vocabulary.
+    """
+
+    SUFFIXES = [".vec.npy", ".norm.npy", ".words.npy", ".offsets.npy", ".sorted.npy"]
+
+    def __init__(self, vectors):
+        self.logger = logging.getLogger(__name__)
+
+        if self.stale(vectors):
+            self.build(vectors)
+
+        begin = time.time()
+        self.W, self.norm, self.blob, self.offsets, self.sorted = \
+            [np.load(vectors + s, mmap_mode="r") for s in self.SUFFIXES]
+        self.n, self.dim = self.W.shape
+        self.logger.info("Mapping " + str(self.n) + " vectors took " + str(time.time() - begin))
+
+    def stale(self, vectors):
+        mtime = os.stat(vectors).st_mtime
+        for s in self.SUFFIXES:
+            if not os.path.isfile(vectors + s) or os.stat(vectors + s).st_mtime < mtime:
+                return True
+        return False
+
+    def build(self, vectors):
+        begin = time.time()
+        words, W = util.load_vectors(vectors)
+
+        norm = np.sqrt(np.sum(W * W, 1))
+        W = W / np.maximum(norm, 1e-12)[:, np.newaxis]
+
+        encoded = [w.encode("utf-8") for w in words]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(w) for w in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        order = np.array(sorted(range(len(encoded)), key=lambda i: encoded[i]), dtype=np.int32)
+
+        for (s, a) in zip(self.SUFFIXES, [W.astype(np.float32), norm.astype(np.float32), blob, offsets, order]):
+            np.save(vectors + s, a)
+        self.logger.info("Building vector store took " + str(time.time() - begin))
+
+    def word(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def index(self, word):
+        """Binary search for the id of word (None if missing)."""
+        key = word.encode("utf-8")
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = self.sorted[mid]
+            w = self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+            if w < key:
+                lo = mid + 1
+            elif w > key:
+                hi = mid
+            else:
+                return int(i)
+        return None
+
+    def vector(self, i):
+        return self.W[i, :] * self.norm[i]
+
+
+class LRUCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+
+class Server(object):
+    """Answers vector, similarity, neighbor and analogy requests.
+
+    Neighbor and analogy queries that arrive together are scored with a
+    single GEMM against the whole vocabulary.
+    """
+
+    def __init__(self, store, cache_size=10000, max_batch=64, batch_wait=0.001, loop=None):
+        self.store = store
+        self.cache = LRUCache(cache_size)
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.logger = logging.getLogger(__name__)
+
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.batches = 0
+        self.queries = 0
+        self.latency = collections.defaultdict(lambda: collections.deque(maxlen=10000))
+
+        self.handlers = {"/vector": self.vector,
+                         "/similarity": self.similarity,
+                         "/neighbors": self.neighbors,
+                         "/analogy": self.analogy,
+                         "/stats": self.stats}
+
+    def lookup(self, params, name):
+        if name not in params:
+            raise KeyError("Missing parameter \"" + name + "\".")
+        i = self.store.index(params[name])
+        if i is None:
+            raise KeyError("Word \"" + params[name] + "\" is not in the vocabulary.")
+        return i
+
+    async def vector(self, params):
+        i = self.lookup(params, "word")
+        return {"word": params["word"], "vector": self.store.vector(i).tolist()}
+
+    async def similarity(self, params):
+        a = self.lookup(params, "a")
+        b = self.lookup(params, "b")
+        return {"similarity": float(np.dot(self.store.W[a, :], self.store.W[b, :]))}
+
+    async def neighbors(self, params):
+        i = self.lookup(params, "word")
+        k = int(params.get("k", 10))
+        result = await self.query(np.array(self.store.W[i, :]), [i], k)
+        return {"word": params["word"], "neighbors": result}
+
+    async def analogy(self, params):
+        # 3CosAdd: a is to b as c is to ?
+        a = self.lookup(params, "a")
+        b = self.lookup(params, "b")
+        c = self.lookup(params, "c")
+        k = int(params.get("k", 1))
+        W = self.store.W
+        q = W[b, :] - W[a, :] + W[c, :]
+        result = await self.query(q, [a, b, c], k)
+        return {"analogy": result}
+
+    async def stats(self, params):
+        latency = {}
+        for (path, times) in self.latency.items():
+            t = 1000 * np.array(times)
+            latency[path] = {"count": len(t),
+                             "p50": float(np.percentile(t, 50)),
+                             "p90": float(np.percentile(t, 90)),
+                             "p99": float(np.percentile(t, 99))}
+        return {"words": self.store.n,
+                "dim": self.store.dim,
+                "latency_ms": latency,
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses,
+                "batches": self.batches,
+                "batched_queries": self.queries}
+
+    async def query(self, q, exclude, k):
+        future = self.loop.create_future()
+        self.pending.append((q, exclude, k, future))
+        self.wakeup.set()
+        return await future
+
+    async def batcher(self):
+        while True:
+            await self.wakeup.wait()
+            # Give concurrent requests a moment to join the batch
+            await asyncio.sleep(self.batch_wait)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+            if not self.pending:
+                self.wakeup.clear()
+
+            Q = np.array([b[0] for b in batch], dtype=np.float32)
+            try:
+                scores = await self.loop.run_in_executor(None, np.dot, self.store.W, Q.T)
+            except Exception as e:
+                for b in batch:
+                    if not b[3].done():
+                        b[3].set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+
+            for (j, (q, exclude, k, future)) in enumerate(batch):
+                # The request may have been cancelled (client disconnected)
+                # while the batch was scored
+                if future.done():
+                    continue
+                try:
+                    s = scores[:, j]
+                    s[exclude] = -np.inf
+                    k = max(1, min(k, s.shape[0] - len(exclude)))
+                    top = np.argpartition(-s, k - 1)[:k]
+                    top = top[np.argsort(-s[top])]
+                    future.set_result([[self.store.word(i), float(s[i])] for i in top])
+                except Exception as e:
+                    future.set_exception(e)
+
+    async def handle(self, reader, writer):
+        begin = time.time()
+        path = None
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if len(request) < 2 or request[0] != "GET":
+                status, body = "405 Method Not Allowed", {"error": "Only GET is supported."}
+            else:
+                url = urllib.parse.urlsplit(request[1])
+                path = url.path
+                params = dict(urllib.parse.parse_qsl(url.query))
+                key = (path, tuple(sorted(params.items())))
+                cached = self.cache.get(key) if path != "/stats" else None
+                if cached is not None:
+                    status, body = "200 OK", cached
+                elif path not in self.handlers:
+                    status, body = "404 Not Found", {"error": "Unknown path \"" + path + "\"."}
+                else:
+                    try:
+                        body = await self.handlers[path](params)
+                        status = "200 OK"
+                        if path != "/stats":
+                            self.cache.put(key, body)
+                    except (KeyError, ValueError) as e:
+                        status, body = "400 Bad Request", {"error": str(e).strip("\"'")}
+                    except Exception as e:
+                        self.logger.exception("Request " + request[1] + " failed")
+                        status, body = "500 Internal Server Error", {"error": str(e)}
+            payload = json.dumps(body).encode("utf-8")
+            writer.write(("HTTP/1.1 " + status + "\r\n"
+                          "Content-Type: application/json\r\n"
+                          "Content-Length: " + str(len(payload)) + "\r\n"
+                          "Connection: close\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            if path in self.handlers:
+                self.latency[path].append(time.time() - begin)
+
+
+def serve(vectors, host="127.0.0.1", port=8000, socket=None, cache_size=10000, max_batch=64):
+    logger = logging.getLogger(__name__)
+
+    begin = time.time()
+    store = VectorStore(vectors)
+    loop = asyncio.get_event_loop()
+    server = Server(store, cache_size, max_batch)
+
+    if socket is not None:
+        start = asyncio.start_unix_server(server.handle, path=socket)
+        address = socket
+    else:
+        start = asyncio.start_server(server.handle, host, port)
+        address = host + ":" + str(port)
+    listener = loop.run_until_complete(start)
+    batcher = loop.create_task(server.batcher())
+    logger.info("Serving " + vectors + " on " + address + " (startup took " + str(time.time() - begin) + ")")
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.cancel()
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
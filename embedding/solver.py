@@ -8,6 +8,7 @@ import struct
 import sys
 import sparsesvd
 import scipy.sparse
+import scipy.sparse.linalg
 import logging
 
 import embedding.util as util
@@ -15,28 +16,144 @@ import embedding.util as util
 # TODO: automatically match defaults from cmd line?
 
 
-def power_iteration(mat, x, x0=None, iterations=50, beta=0., norm_freq=1, gpu=False, checkpoint=lambda x, i: None):
+def power_iteration(mat, x, x0=None, iterations=50, beta=0., norm_freq=1, gpu=False, checkpoint=lambda x, i: None, lock_tol=0., accelerate="none", warmup=5, ritz=0):
 
     logger = logging.getLogger(__name__)
 
+    # Residuals are only meaningful for an orthonormal iterate
+    if (lock_tol > 0 or accelerate != "none" or ritz > 0) and norm_freq != 1:
+        logger.warn("Locking, acceleration and Rayleigh-Ritz require normalization every iteration. "
+                    "Turning them off.")
+        lock_tol = 0.
+        accelerate = "none"
+        ritz = 0
+
+    if accelerate != "none":
+        # The momentum (or Chebyshev interval) is chosen from the convergence
+        # rate observed during the first `warmup` (plain) iterations
+        beta = 0.
+        if x0 is None:
+            x0 = x.new(*x.shape).zero_()
+        if warmup < 2:
+            # The rate is the ratio of two consecutive residuals
+            logger.warn("Acceleration needs a warmup of at least 2 iterations. Using 2.")
+            warmup = 2
+        ratios = []
+        prev_res = None
+        rho = 0.
+        c = 0.
+        sigma = None
+
+    # The leading `locked` columns of x have converged and are frozen;
+    # only the remaining (active) columns are multiplied.
+    locked = 0
+    dim = x.shape[1]
+
     for i in range(iterations):
         begin = time.time()
-        if beta == 0.:
-            x = util.mm(mat, x, gpu)
-        else:
-            x, x0 = util.mm(mat, x, gpu) - beta * x0, x
-        logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin))
+        active = x[:, locked:]
+        y = util.mm(mat, active, gpu)
+
+        if lock_tol > 0:
+            # Relative residuals of the (orthonormal) active columns, in the
+            # complement of the locked columns (otherwise the error left in
+            # the locked columns keeps the next residual above lock_tol)
+            theta = torch.sum(active * y, 0)
+            res = y - active * theta.expand_as(active)
+            if locked != 0:
+                L = x[:, :locked]
+                res = res - torch.mm(L, torch.mm(L.t(), res))
+            res = torch.norm(res, 2, 0, True).view(-1) / theta.abs()
+            res = res.cpu().numpy()
+            k = 0
+            while k < res.shape[0] and res[k] < lock_tol:
+                k += 1
+            if k != 0:
+                locked += k
+                active = active[:, k:]
+                y = y[:, k:]
+                if x0 is not None:
+                    x0 = x0[:, k:]
+                logger.info("Locked " + str(locked) + " / " + str(dim) + " columns")
+
+        if locked == dim:
+            logger.info("All columns converged after " + str(i + 1) + " iterations")
+            checkpoint(x, i)
+            break
+
+        if ritz > 0 and ((i + 1) % ritz == 0 or (i + 1) == iterations):
+            # Rotate the active block to its Ritz vectors, reusing A x
+            active, y, x0, theta = util.rayleigh_ritz(active, y, x0)
+            logger.info("Ritz values: " + " ".join(["{:.4f}".format(t) for t in theta]))
+
+        if accelerate != "none":
+            # The residual of the subspace asymptotically shrinks at the
+            # rate |lambda_{d+1} / lambda_d|, and the Ritz values estimate
+            # the wanted eigenvalues
+            H = torch.mm(active.t(), y)
+            if i < warmup:
+                res = float(torch.norm(y - torch.mm(active, H)))
+                if prev_res is not None and prev_res > 0:
+                    rate = res / prev_res
+                    logger.info("Convergence rate: {:.4f}".format(rate))
+                    ratios.append(rate)
+                prev_res = res
+            if i + 1 == warmup:
+                if ratios:
+                    rho = min(float(np.median(ratios[len(ratios) // 2:])), 0.999)
+                logger.info("Estimated |lambda_(d+1) / lambda_d| = {:.4f}".format(rho))
+                if rho == 0:
+                    logger.warn("Could not estimate the convergence rate. Acceleration is off.")
+            if i + 1 >= warmup:
+                # The smallest Ritz value only grows towards |lambda_d|, so
+                # the bound on the unwanted spectrum is refined every iteration
+                H = H.cpu().numpy()
+                theta_min = np.abs(np.linalg.eigvalsh((H + H.T) / 2)).min()
+                if accelerate == "momentum" and rho * theta_min > c:
+                    c = rho * theta_min
+                    beta = c * c / 4
+                    logger.info("Using momentum {:.4f} (|lambda_(d+1)| <= {:.4f})".format(beta, c))
+                elif accelerate == "chebyshev" and rho * theta_min > 1.02 * c:
+                    # The recurrence is restarted when the interval grows by 2%
+                    c = rho * theta_min
+                    sigma = None
+                    logger.info("Using Chebyshev acceleration on [-{0:.4f}, {0:.4f}]".format(c))
+
+        if accelerate == "chebyshev" and i + 1 >= warmup and c > 0:
+            # Three-term recurrence of the Chebyshev polynomials on [-c, c],
+            # normalized at theta_min = c / rho; normalization applies the
+            # same transform to y and x0, so it is unaffected
+            if sigma is None:
+                y, x0 = (rho / c) * y, active
+                sigma = rho
+            else:
+                s = 1. / (2. / rho - sigma)
+                y, x0 = (2 * s / c) * y - (sigma * s) * x0, active
+                sigma = s
+        elif accelerate != "none" or beta != 0.:
+            y, x0 = y - beta * x0, active
+        logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin) +
+                     ("" if locked == 0 else " (" + str(dim - locked) + " active columns)"))
 
         if ((i + 1) % norm_freq == 0 or
             (i + 1) == iterations):
-            x, x0 = util.normalize(x, x0)
+            if locked != 0:
+                # Keep the active columns orthogonal to the locked ones
+                L = x[:, :locked]
+                y = y - torch.mm(L, torch.mm(L.t(), y))
+            y, x0 = util.normalize(y, x0)
+
+        if locked == 0:
+            x = y
+        else:
+            x = torch.cat([x[:, :locked], y], 1)
 
         checkpoint(x, i)
 
     return x, x0
 
 
-def alecton(mat, x, iterations=50, eta=1e-3, norm_freq=1, sample=None, gpu=False, checkpoint=lambda x, i: None):
+def alecton(mat, x, iterations=50, eta=1e-3, norm_freq=1, sample=None, gpu=False, checkpoint=lambda x, i: None, ritz=0, prefetch=0):
 
     logger = logging.getLogger(__name__)
 
@@ -48,21 +165,39 @@ def alecton(mat, x, iterations=50, eta=1e-3, norm_freq=1, sample=None, gpu=False
     n = mat.shape[0]
     nnz = mat._nnz()
 
+    # Build the next `prefetch` samples while the current product runs
+    if prefetch > 0:
+        sample = util.Prefetcher(sample, prefetch)
+
     for i in range(iterations):
         begin = time.time()
 
         m = next(sample)
+        wait = time.time() - begin
 
         x = (1 - eta) * x + eta * util.mm(m, x)
         end = time.time()
-        logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin))
+        logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin) +
+                     " ({:.4f} s waiting for sample)".format(wait))
 
         if ((i + 1) % norm_freq == 0 or
             (i + 1) == iterations):
             x, _ = util.normalize(x, None)
 
+            # The sampled products are too noisy for the projection, so the
+            # Rayleigh-Ritz step uses one full product
+            if ritz > 0 and ((i + 1) % ritz == 0 or (i + 1) == iterations):
+                begin = time.time()
+                x, _, _, theta = util.rayleigh_ritz(x, util.mm(mat, x, gpu))
+                logger.info("Ritz values: " + " ".join(["{:.4f}".format(t) for t in theta]))
+                logger.info("Rayleigh-Ritz took " + str(time.time() - begin))
+
         checkpoint(x, i)
 
+    if prefetch > 0:
+        sample.close()
+        logger.info("Sampling took {:.4f} s, {:.4f} s of it overlapped with products".format(sample.produce, sample.overlap))
+
     return x
 
 
@@ -112,9 +247,11 @@ def vr(mat, x, x0=None, iterations=50, beta=0., norm_freq=1, batch=100000, inner
     return x, x0
 
 
-def sgd(mat, x, iterations=50, eta=1e-3, batch=100000):
+def sgd(mat, x, iterations=50, eta=1e-3, batch=100000, rng=None):
     # TODO: this does not do any negative sampling
     # TODO: does this need norm_freq
+    # With an rng, the entries are visited in a new blockwise shuffled order
+    # every epoch (see util.epoch_batches)
 
     nnz = mat._nnz()
     n, dim = x.shape
@@ -122,23 +259,19 @@ def sgd(mat, x, iterations=50, eta=1e-3, batch=100000):
     for i in range(iterations):
         begin = time.time()
         total_cost = 0.
-        for start in range(0, nnz, batch):
-            end = min(start + batch, nnz)
-
-            X = mat._values()[start:end]
-
-            row = mat._indices()[0, start:end]
-            col = mat._indices()[1, start:end]
+        for (j, entries) in enumerate(util.epoch_batches(nnz, batch, rng)):
+            X, row, col = util.take(mat, entries)
+            size = X.shape[0]
 
             pred = (x[row, :] * x[col, :]).sum(1)
             error = pred - torch.log(X)
             step = -eta * error
 
-            dx = step.expand(dim, end - start).t().repeat(2, 1) * x[torch.cat([col, row]), :]
+            dx = step.expand(dim, size).t().repeat(2, 1) * x[torch.cat([col, row]), :]
             x.index_add_(0, torch.cat([row, col]), dx)
 
             total_cost += 0.5 * (error * error).sum()
-            logging.info("Iteration" + str(i + 1) + "\t" + str(start // batch + 1), " / " + str((nnz + batch - 1) // batch) + "\t" + str(time.time() - begin) + "\r")
+            logging.info("Iteration " + str(i + 1) + "\t" + str(j + 1) + " / " + str((nnz + batch - 1) // batch) + "\t" + str(time.time() - begin) + "\r")
 
         logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin))
         logging.info("Error: " + str(total_cost / nnz))
@@ -146,7 +279,7 @@ def sgd(mat, x, iterations=50, eta=1e-3, batch=100000):
     return x
 
 
-def glove(mat, x, bias=None, iterations=50, eta=1e-3, batch=100000):
+def glove(mat, x, bias=None, iterations=50, eta=1e-3, batch=100000, rng=None):
     # NOTE: this does not include the context vector/bias
     #       the word vector/bias is just used instead
 
@@ -158,69 +291,29 @@ def glove(mat, x, bias=None, iterations=50, eta=1e-3, batch=100000):
 
     # TODO: should bias be CPU or GPU
     if bias is None:
-        begin = time.time()
-        f_mat = mat.clone()
-        f_mat._values().div_(xmax).clamp_(max=1).pow_(alpha)
-
-        log_mat = mat.clone()
-        log_mat._values().log_()
-
-        log_mat._values().mul_(f_mat._values())
-        bias = util.sum_rows(log_mat) / util.sum_rows(f_mat) / 2
-        logging.info("Initial bias took" + str(time.time() - begin))
-
-        # bias = torch.cuda.FloatTensor(n)
-        # bias.zero_()
-        for i in range(100):
-            begin = time.time()
-            total_cost = 0.
-            for start in range(0, nnz, batch):
-                end = min(start + batch, nnz)
-
-                X = mat._values()[start:end]
-
-                f = X / xmax
-                f.clamp_(max=1)
-                f.pow_(alpha)
-
-                row = mat._indices()[0, start:end]
-                col = mat._indices()[1, start:end]
-
-                pred = bias[row] + bias[col]
-                error = pred - torch.log(X)
-                step = -0.001 * f * error
-
-                bias.index_add_(0, torch.cat([row, col]), torch.cat([step, step]))
-
-                total_cost += 0.5 * (f * error * error).sum()
-                logging.info("Tune bias " + str(i + 1) + "\t" + str(start // batch + 1) + " / " + str((nnz + batch - 1) // batch) + "\t" + str(time.time() - begin) + "\r")
-            logging.info("Error: " + str(total_cost / nnz))
+        bias = glove_bias(mat, xmax, alpha)
 
     for i in range(iterations):
         begin = time.time()
         total_cost = 0.
-        for start in range(0, nnz, batch):
-            end = min(start + batch, nnz)
-
-            X = mat._values()[start:end]
+        for (j, entries) in enumerate(util.epoch_batches(nnz, batch, rng)):
+            X, row, col = util.take(mat, entries)
+            size = X.shape[0]
 
             f = X / xmax
             f.clamp_(max=1)
             f.pow_(alpha)
 
-            row = mat._indices()[0, start:end]
-            col = mat._indices()[1, start:end]
-
             pred = (x[row, :] * x[col, :]).sum(1) + bias[row] + bias[col]
             error = pred - torch.log(X)
             step = -eta * f * error
 
-            dx = step.expand(dim, end - start).t().repeat(2, 1) * x[torch.cat([col, row]), :]
+            dx = step.expand(dim, size).t().repeat(2, 1) * x[torch.cat([col, row]), :]
             x.index_add_(0, torch.cat([row, col]), dx)
             # bias.index_add_(0, torch.cat([row, col]), torch.cat([step, step]))
 
             total_cost += 0.5 * (f * error * error).sum()
-            logging.info("Iteration " + str(i + 1) + "\t" + str(start // batch + 1) + " / " + str((nnz + batch - 1) // batch) + "\t" + str(time.time() - begin) + "\r")
+            logging.info("Iteration " + str(i + 1) + "\t" + str(j + 1) + " / " + str((nnz + batch - 1) // batch) + "\t" + str(time.time() - begin) + "\r")
 
         logging.info("Iteration " + str(i + 1) + " took " + str(time.time() - begin))
         logging.info("Error: " + str(total_cost / nnz))
@@ -228,6 +321,69 @@ def glove(mat, x, bias=None, iterations=50, eta=1e-3, batch=100000):
     return x, bias
 
 
+def glove_bias(mat, xmax=100, alpha=0.75, iterations=50, tol=1e-6):
+    """Biases minimizing the GloVe loss without the vectors,
+
+        0.5 sum_k f(X_k) (b[row_k] + b[col_k] - log X_k) ** 2,
+
+    a weighted least-squares problem. The normal equations H b = g, with
+    H b = (r + c) * b + F b + F^T b (F the weights, r and c its row and
+    column sums), are solved by conjugate gradient with a Jacobi
+    preconditioner, starting from the row-wise fit."""
+
+    logger = logging.getLogger(__name__)
+    begin = time.time()
+
+    n = mat.shape[0]
+    row = mat._indices()[0, :]
+    col = mat._indices()[1, :]
+    X = mat._values()
+    f = (X / xmax).clamp_(max=1).pow_(alpha)
+    l = torch.log(X)
+
+    def H(v):
+        out = d * v
+        out.index_add_(0, row, f * v[col])
+        out.index_add_(0, col, f * v[row])
+        return out
+
+    def loss(b):
+        error = b[row] + b[col] - l
+        return 0.5 * (f * error * error).sum() / f.shape[0]
+
+    d = X.new(n).zero_()
+    d.index_add_(0, row, f)
+    d.index_add_(0, col, f)
+    g = X.new(n).zero_()
+    g.index_add_(0, row, f * l)
+    g.index_add_(0, col, f * l)
+
+    diag = d.clone()
+    diag.index_add_(0, row, 2 * f * (row == col).type_as(f))
+    diag[diag == 0] = 1
+
+    b = g / diag
+    r = g - H(b)
+    z = r / diag
+    p = z.clone()
+    rz = torch.dot(r, z)
+    g_norm = torch.norm(g)
+    logger.info("Initial bias loss: " + str(loss(b)))
+    steps = 0
+    while steps < iterations and torch.norm(r) > tol * g_norm:
+        steps += 1
+        Hp = H(p)
+        a = rz / torch.dot(p, Hp)
+        b += a * p
+        r -= a * Hp
+        z = r / diag
+        rz, rz_prev = torch.dot(r, z), rz
+        p = z + (rz / rz_prev) * p
+    logger.info("Bias loss after " + str(steps) + " CG iterations: " + str(loss(b)))
+    logger.info("Initial bias took " + str(time.time() - begin))
+    return b
+
+
 def sparseSVD(mat, dim):
     begin = time.time()
     mat = mat.tocsc()
@@ -238,3 +394,120 @@ def sparseSVD(mat, dim):
     logging.info("Solving took " + str(time.time() - begin))
 
     return torch.from_numpy(u.transpose())
+
+
+def nystrom(mat, dim, landmarks=0, sampling="frequency", counts=None, seed=0, dtype=np.float32):
+    """Approximate top (in magnitude) eigenvectors from landmark columns.
+
+    m landmark words L are chosen, either the most frequent (by counts, or
+    by the row sums of the matrix) or sampled without replacement with
+    probability proportional to the squared column norms (approximate
+    leverage). With C = A[:, L] and the top dim eigenpairs U S U^T of
+    W = A[L, L], A is approximated by Y S Y^T with Y = C U S^-1, and the
+    eigenvectors of this approximation are Q V for Y = QR and
+    R S R^T = V T V^T. Only the m landmark columns are read from the
+    matrix.
+    """
+    begin = time.time()
+    n = mat.shape[0]
+    m = min(n, max(dim, landmarks if landmarks > 0 else 20 * dim))
+
+    if not torch.is_tensor(mat):
+        A = scipy.sparse.csr_matrix(mat if isinstance(mat, scipy.sparse.spmatrix) else mat.tocsr())
+    else:
+        ind = mat._indices().cpu().numpy()
+        A = scipy.sparse.csr_matrix((mat._values().cpu().numpy(), (ind[0, :], ind[1, :])), shape=mat.shape)
+
+    if sampling == "frequency":
+        if counts is None:
+            counts = np.asarray(A.sum(1)).squeeze(1)
+        L = np.sort(np.argsort(-np.asarray(counts), kind="mergesort")[:m])
+    elif sampling == "leverage":
+        norm = np.asarray(A.multiply(A).sum(0)).squeeze(0).astype(np.float64)
+        m = min(m, np.count_nonzero(norm))
+        L = np.sort(np.random.RandomState(seed).choice(n, m, replace=False, p=norm / norm.sum()))
+    else:
+        raise ValueError("Landmark sampling \"" + sampling + "\" is not recognized.")
+
+    C = A[:, L]
+    W = C[L, :].toarray().astype(np.float64)
+    logging.info("Extracting " + str(m) + " landmark columns took " + str(time.time() - begin))
+
+    w, U = np.linalg.eigh((W + W.T) / 2)
+    order = np.argsort(-np.abs(w), kind="mergesort")[:dim]
+    w, U = w[order], U[:, order]
+    w = np.where(w != 0, w, 1)
+
+    Q, R = np.linalg.qr(C.dot(U / w))
+    theta, V = np.linalg.eigh(np.dot(R * w, R.T))
+    order = np.argsort(-np.abs(theta), kind="mergesort")
+    x = np.dot(Q, V[:, order])
+    logging.info("Eigenvalues: " + " ".join(["{:10.2f}".format(e) for e in theta[order]]))
+    logging.info("Nystrom took " + str(time.time() - begin))
+
+    return torch.from_numpy(np.ascontiguousarray(x, dtype=dtype))
+
+
+def operator(mat, dtype, gpu=False):
+    """Wraps mat in a LinearOperator that multiplies with util.mm.
+
+    Also returns a list holding the number of matrix-vector products used.
+    """
+    count = [0]
+
+    def matmat(x):
+        x = np.ascontiguousarray(x, dtype=dtype)
+        if x.ndim == 1:
+            return matmat(x[:, np.newaxis])[:, 0]
+        count[0] += x.shape[1]
+        return util.mm(mat, torch.from_numpy(x), gpu).cpu().numpy()
+
+    op = scipy.sparse.linalg.LinearOperator(mat.shape, matvec=matmat, matmat=matmat, dtype=dtype)
+    return op, count
+
+
+def lobpcg(mat, x, iterations=50, tol=1e-5, gpu=False):
+    """Top eigenvectors by LOBPCG, warm started from the columns of x.
+
+    Note that LOBPCG finds the largest (algebraic) eigenvalues, whereas
+    power iteration finds the largest in magnitude.
+    """
+    begin = time.time()
+    x = x.cpu()
+    dtype = x.numpy().dtype
+    op, count = operator(mat, dtype, gpu)
+
+    w, v = scipy.sparse.linalg.lobpcg(op, x.numpy(), tol=tol, maxiter=iterations, largest=True)
+    order = np.argsort(-np.abs(w))
+    logging.info("Eigenvalues: " + " ".join(["{:10.2f}".format(e) for e in w[order]]))
+    logging.info("LOBPCG took " + str(time.time() - begin) + " (" + str(count[0]) + " matrix-vector products)")
+
+    return torch.from_numpy(np.ascontiguousarray(v[:, order], dtype=dtype))
+
+
+def arpack(mat, x, iterations=50, tol=1e-5, gpu=False):
+    """Top (in magnitude) eigenvectors by ARPACK (implicitly restarted
+    Lanczos), warm started from the sum of the columns of x."""
+    begin = time.time()
+    x = x.cpu()
+    dtype = x.numpy().dtype
+    dim = x.shape[1]
+    op, count = operator(mat, dtype, gpu)
+
+    v0 = x.numpy().sum(1)
+    try:
+        w, v = scipy.sparse.linalg.eigsh(op, k=dim, which="LM", v0=v0, maxiter=iterations, tol=tol)
+    except scipy.sparse.linalg.ArpackNoConvergence as e:
+        logging.warn("ARPACK did not converge (" + str(e.eigenvalues.shape[0]) + " of " + str(dim) + " eigenvectors converged)")
+        w, v = e.eigenvalues, e.eigenvectors
+        if w.shape[0] < dim:
+            # Fill in with the starting vectors (orthogonalized against the converged ones)
+            fill = x.numpy()[:, :dim - w.shape[0]]
+            fill = fill - np.dot(v, np.dot(v.T, fill))
+            v = np.concatenate([v, np.linalg.qr(fill)[0]], 1)
+            w = np.concatenate([w, np.zeros(dim - w.shape[0])])
+    order = np.argsort(-np.abs(w))
+    logging.info("Eigenvalues: " + " ".join(["{:10.2f}".format(e) for e in w[order]]))
+    logging.info("ARPACK took " + str(time.time() - begin) + " (" + str(count[0]) + " matrix-vector products)")
+
+    return torch.from_numpy(np.ascontiguousarray(v[:, order], dtype=dtype))
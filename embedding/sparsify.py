@@ -0,0 +1,127 @@
+"""Unbiased randomized sparsification of the cooccurrence matrix.
+
+Entries with |a| >= tau are kept as they are, and smaller entries are kept
+with probability |a| / tau and replaced by sign(a) tau, so that the
+expected value of every entry is unchanged. The error E = A - A~ is then a
+random matrix with independent (up to symmetry) zero-mean entries of
+variance |a| (tau - |a|), whose spectral norm is about twice the square
+root of the largest row sum of variances.
+"""
+
+from __future__ import print_function, absolute_import
+
+import numpy as np
+import scipy.sparse
+import time
+import logging
+
+
+def pair_uniform(row, col, seed=0):
+    """Uniform numbers in [0, 1) that only depend on the unordered pair
+    {row, col} (and the seed), so that the sampling stays symmetric."""
+    with np.errstate(over="ignore"):
+        lo = np.minimum(row, col).astype(np.uint64)
+        hi = np.maximum(row, col).astype(np.uint64)
+        # splitmix64 finalizer of the pair key
+        z = (lo << np.uint64(32)) ^ hi ^ (np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15))
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+
+def threshold_for_nnz(val, nnz):
+    """Threshold tau for which the expected number of kept entries,
+    sum(min(1, |a| / tau)), is nnz (at least 1)."""
+    s = np.sort(np.abs(val))[::-1]
+    if nnz >= np.count_nonzero(s):
+        return 0.
+    nnz = max(nnz, 1.)
+    tail = np.cumsum(s[::-1])[::-1]  # tail[m] = sum(s[m:])
+    # The m largest entries are kept for sure, for m < nnz
+    m = np.arange(int(np.ceil(nnz)))
+    tau = tail[m] / (nnz - m)
+    valid = (tau >= s[m]) & ((m == 0) | (tau < s[np.maximum(m - 1, 0)]))
+    return float(tau[np.flatnonzero(valid)[0]])
+
+
+def error_scale(n, row, val, tau):
+    """Predicted spectral norm of the error for threshold tau."""
+    a = np.abs(val)
+    var = np.where(a < tau, a * (tau - a), 0.)
+    return 2 * np.sqrt(np.max(np.bincount(row, var, minlength=n)))
+
+
+def threshold_for_error(n, row, val, error, iterations=50):
+    """Largest threshold tau (by bisection) whose predicted spectral error
+    is at most error."""
+    lo, hi = 0., float(np.abs(val).max())
+    if error_scale(n, row, val, hi) <= error:
+        return hi
+    for i in range(iterations):
+        mid = (lo + hi) / 2
+        if error_scale(n, row, val, mid) <= error:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def spectral_norm(A, iterations=20, seed=0):
+    """Estimate of the spectral norm of a symmetric scipy matrix by power
+    iteration."""
+    x = np.random.RandomState(seed).randn(A.shape[0])
+    norm = 0.
+    for i in range(iterations):
+        y = A.dot(x)
+        norm = np.linalg.norm(y)
+        if norm == 0:
+            return 0.
+        x = y / norm
+    return norm
+
+
+def sample(row, col, val, tau, seed=0):
+    """Returns the mask of kept entries and their new values for threshold
+    tau."""
+    a = np.abs(val)
+    small = a < tau
+    keep = ~small
+    keep[small] = pair_uniform(row[small], col[small], seed) * tau < a[small]
+    return keep, np.where(small, np.sign(val) * tau, val).astype(val.dtype)
+
+
+def sparsify(row, col, val, tau, seed=0):
+    """Returns the kept entries (row, col, val) for threshold tau."""
+    keep, val = sample(row, col, val, tau, seed)
+    return row[keep], col[keep], val[keep]
+
+
+def sparsify_matrix(row, col, val, n, fraction=0., error=0., seed=0):
+    """Sparsifies the entries of an n x n symmetric matrix to about
+    fraction of its non-zeros, or to a relative spectral error of about
+    error, and logs the nnz reduction and the spectral error."""
+
+    logger = logging.getLogger(__name__)
+    begin = time.time()
+
+    A = scipy.sparse.csr_matrix((val, (row, col)), shape=(n, n))
+    A_norm = spectral_norm(A)
+    if error > 0:
+        tau = threshold_for_error(n, row, val, error * A_norm)
+    else:
+        tau = threshold_for_nnz(val, fraction * val.shape[0])
+    keep, new = sample(row, col, val, tau, seed)
+    logger.info("Sparsification (threshold {:.4g}) took {:.4f} s".format(tau, time.time() - begin))
+
+    # The error is only non-zero on the sampled entries
+    small = np.abs(val) < tau
+    err = val[small] - np.where(keep[small], new[small], 0)
+    E = scipy.sparse.csr_matrix((err, (row[small], col[small])), shape=(n, n))
+    E_norm = spectral_norm(E)
+    A_norm = max(A_norm, 1e-30)
+    kept = np.count_nonzero(keep)
+    logger.info("Non-zeros: {} -> {} ({:.1%})".format(val.shape[0], kept, kept / float(max(val.shape[0], 1))))
+    logger.info("Spectral norm of error: {:.4g} (relative {:.4g}, predicted {:.4g})".format(
+                E_norm, E_norm / A_norm, error_scale(n, row, val, tau) / A_norm))
+    return row[keep], col[keep], new[keep]
@@ -0,0 +1,130 @@
+from __future__ import print_function, absolute_import
+
+import torch
+import numpy as np
+import time
+import ctypes
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.sharedctypes
+import pandas
+import scipy.sparse
+
+# Shared state of pool workers (set by _init_worker)
+_shared = {}
+
+
+def get_grid(dim=[50], scale=[0.5], solver=["pi"], momentum=[0.], **fixed):
+    """Returns the cartesian product of the options as a list of configs."""
+    grid = []
+    for (d, s, m, b) in itertools.product(dim, scale, solver, momentum):
+        config = dict(fixed)
+        config.update({"dim": d, "scale": s, "solver": m, "momentum": b})
+        grid.append(config)
+    return grid
+
+
+def sweep(grid, vocab_file="vocab.txt", cooccurrence_file="cooccurrence.bin", preprocessing="ppmi", negative=1., alpha=1., CpuTensor=torch.FloatTensor, processes=None, results=None):
+    """Loads and preprocesses the cooccurrence matrix once, then solves every
+    config of the grid in a process pool.
+
+    The CSR arrays of the matrix are placed in shared memory, so the workers
+    only map them (read-only) instead of receiving a copy.
+    """
+
+    # Imported here to avoid a circular import with main (the name
+    # embedding.main is the main function, not the module)
+    from embedding.main import Embedding
+
+    logger = logging.getLogger(__name__)
+
+    if preprocessing != "none":
+        skip = [c for c in grid if c["solver"] == "glove"]
+        if skip:
+            logger.warn("GloVe only behaves properly with no preprocessing. "
+                        "Skipping " + str(len(skip)) + " GloVe configurations.")
+            grid = [c for c in grid if c["solver"] != "glove"]
+
+    # The matrix is only loaded once, so the dimension is irrelevant here
+    e = Embedding(gpu=False, CpuTensor=CpuTensor)
+    e.load_cooccurrence(vocab_file, cooccurrence_file, preprocessing, negative, alpha)
+
+    begin = time.time()
+    shared = {"shape": e.mat.shape, "words": e.words, "vocab": e.vocab.numpy(), "CpuTensor": CpuTensor}
+    for name in ["data", "indices", "indptr"]:
+        shared[name] = to_shared(getattr(e.mat, name))
+    del e
+    logger.info("Copying cooccurrence matrix to shared memory took " + str(time.time() - begin))
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(grid)))
+    logger.info("Solving " + str(len(grid)) + " configurations with " + str(processes) + " processes")
+
+    begin = time.time()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(shared, processes))
+    try:
+        rows = pool.map(_solve, grid, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    logger.info("Sweep took " + str(time.time() - begin))
+
+    table = pandas.DataFrame(rows)
+    logger.info("\n" + table.to_string())
+    if results is not None:
+        table.to_csv(results, index=False)
+    return table
+
+
+def to_shared(array):
+    """Copies a numpy array into a shared ctypes buffer."""
+    buf = multiprocessing.sharedctypes.RawArray(ctypes.c_char, array.nbytes)
+    np.frombuffer(buf, dtype=array.dtype)[:] = array.ravel()
+    return buf, array.dtype.str, array.shape
+
+
+def from_shared(shared):
+    """Returns a read-only numpy view of a buffer created by to_shared."""
+    buf, dtype, shape = shared
+    array = np.frombuffer(buf, dtype=np.dtype(dtype)).reshape(shape)
+    array.flags.writeable = False
+    return array
+
+
+def _init_worker(shared, processes):
+    # Avoid oversubscription of cores by the workers
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // processes))
+
+    _shared["words"] = shared["words"]
+    _shared["vocab"] = shared["vocab"]
+    _shared["CpuTensor"] = shared["CpuTensor"]
+    _shared["mat"] = scipy.sparse.csr_matrix((from_shared(shared["data"]),
+                                              from_shared(shared["indices"]),
+                                              from_shared(shared["indptr"])),
+                                             shape=shared["shape"], copy=False)
+
+
+def _solve(config):
+    from embedding.main import Embedding
+
+    e = Embedding(config["dim"], False, False, False, _shared["CpuTensor"])
+    e.words = _shared["words"]
+    e.n = len(e.words)
+    e.vocab = _shared["CpuTensor"](_shared["vocab"])
+    e.mat = _shared["mat"]
+
+    begin = time.time()
+    e.load_vectors()
+    e.solve(mode=config["solver"], gpu=False, scale=config["scale"], momentum=config["momentum"],
+            **{k: v for (k, v) in config.items() if k not in ["dim", "solver", "scale", "momentum"]})
+    elapsed = time.time() - begin
+
+    score = e.evaluate()
+    row = dict(config)
+    row["time"] = elapsed
+    row["similarity-dot"], row["similarity-cos"] = score["similarity"]
+    row["analogy-add"] = score["analogy-add"]
+    row["analogy-mul"] = score["analogy-mul"]
+    return row
@@ -1,16 +1,28 @@
 from __future__ import print_function, absolute_import
 
 import torch
-import numba
 import numpy as np
 import time
 import sys
 import argparse
 import logging
+import threading
+import collections
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import pandas
 import scipy
 import scipy.sparse
+import scipy.sparse.csgraph
 
 import embedding.tensor_type as tensor_type
+import embedding.matrix as matrix
+import embedding.kernels as kernels
+
+# Amount of GPU memory used by mm when streaming (set by the memory planner)
+GPU_MEMORY = 2 ** 30
 
 
 def synthetic(n, nnz):
@@ -41,7 +53,7 @@ def normalize(x, x0=None):
     # TODO: is it necessary to reorder columns by magnitude
     # TODO: more numerically stable implementation?
     begin = time.time()
-    norm = torch.norm(x, 2, 0, True).squeeze()
+    norm = torch.norm(x, 2, 0, True).view(-1)
     logger.info(" ".join(["{:10.2f}".format(n) for n in norm]))
     a = time.time()
     _, perm = torch.sort(-norm)
@@ -79,6 +91,27 @@ def normalize(x, x0=None):
     return x, x0
 
 
+def rayleigh_ritz(x, ax, x0=None):
+    """Rotates the orthonormal basis x to the Ritz vectors of its span.
+
+    ax is the product of the matrix with x; the same rotation is applied to
+    ax (so that it stays the product with the rotated basis) and to x0.
+    The Ritz values are returned in order of decreasing magnitude, which is
+    the column order used by normalize.
+    """
+    H = torch.mm(x.t(), ax).cpu().numpy()
+    theta, V = np.linalg.eigh((H + H.T) / 2)
+    order = np.argsort(-np.abs(theta), kind="mergesort")
+    theta = theta[order]
+    V = torch.from_numpy(np.ascontiguousarray(V[:, order])).type_as(x)
+
+    x = torch.mm(x, V)
+    ax = torch.mm(ax, V)
+    if x0 is not None:
+        x0 = torch.mm(x0, V)
+    return x, ax, x0, theta
+
+
 def str2bool(v):
     if v.lower() in ('yes', 'true', 't', 'y', '1'):
         return True
@@ -88,6 +121,20 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
+def str2bytes(v):
+    """Parses a size such as "512M" or "4G" into a number of bytes."""
+    units = {"k": 2 ** 10, "m": 2 ** 20, "g": 2 ** 30, "t": 2 ** 40}
+    v = v.strip().lower()
+    if v.endswith("b"):
+        v = v[:-1]
+    try:
+        if v and v[-1] in units:
+            return int(float(v[:-1]) * units[v[-1]])
+        return int(float(v))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Size (such as 512M or 4G) expected.')
+
+
 def mm(A, x, gpu=False):
 
     logger = logging.getLogger(__name__)
@@ -96,6 +143,8 @@ def mm(A, x, gpu=False):
         type(A) == scipy.sparse.coo.coo_matrix or
         type(A) == scipy.sparse.csc.csc_matrix):
         return torch.from_numpy(A * x.numpy())
+    elif isinstance(A, (matrix.SymmetricMatrix, matrix.HybridMatrix, matrix.CompressedMatrix)):
+        return torch.from_numpy(A.dot(x.cpu().numpy()))
     elif not (A.is_cuda or x.is_cuda or gpu):
         # Data and computation on CPU
         return torch.mm(A, x)
@@ -124,23 +173,9 @@ def mm(A, x, gpu=False):
 
             # TODO: GPU memory usage is actually about double this
             #       what's causing the extra usage?
-            # TODO: automate batch choice
-            GPU_MEMORY = 2 ** 30 # Amount of GPU memory to use
-                                 # TODO: automatically detect or cmd line
-
-            # Allocate half of memory to each part
-            A_MEM = GPU_MEMORY // 2
-            X_MEM = GPU_MEMORY // 2
-
-            A_elem_size = 4 + 4 + 8 # TODO: 8 for double right now -- use actual value
-            x_elem_size = n * 8 # TODO 8 for double right now
-
-            # TODO: warning if batch size is 0
-            A_batch_size = A_MEM // A_elem_size
-            x_batch_size = X_MEM // x_elem_size
-
-            A_batches = (nnz + A_batch_size - 1) // A_batch_size
-            x_batches = (dim + x_batch_size - 1) // x_batch_size
+            A_elem_size = 2 * indices.element_size() + values.element_size()
+            x_elem_size = n * x.element_size()
+            A_batches, x_batches = mm_batches(nnz, dim, A_elem_size, x_elem_size)
 
             if A.is_cuda:
                 A_batches = 1
@@ -197,24 +232,111 @@ def mm(A, x, gpu=False):
             return newx
 
 
+def mm_batches(nnz, dim, A_elem_size, x_elem_size, memory=None):
+    """Numbers of batches of the matrix entries and of the columns of x for
+    a product streamed to the GPU within memory (GPU_MEMORY by default).
+
+    The columns of x get what they need, up to half of the memory, and the
+    entries of the matrix get the rest.
+    """
+    if memory is None:
+        memory = GPU_MEMORY
+    X_MEM = min(dim * x_elem_size, memory // 2)
+    A_MEM = memory - X_MEM
+
+    A_batch_size = max(1, A_MEM // A_elem_size)
+    x_batch_size = max(1, X_MEM // x_elem_size)
+    return (nnz + A_batch_size - 1) // A_batch_size, (dim + x_batch_size - 1) // x_batch_size
+
+
 def sum_rows(A):
     n = A.shape[0]
-    if A.is_cuda:
+    if isinstance(A, (matrix.SymmetricMatrix, matrix.HybridMatrix, matrix.CompressedMatrix)):
+        return torch.from_numpy(A.sum_rows())
+    elif isinstance(A, scipy.sparse.spmatrix):
+        return torch.from_numpy(np.asarray(A.sum(1)).squeeze(1))
+    elif A.is_cuda:
         ones = tensor_type.to_dense(A.type())(n, 1)
         ones.fill_(1)
         return torch.mm(A, ones).squeeze(1)
     else:
-        @numba.jit(nopython=True, cache=True)
-        def sr(n, ind, val):
-            nnz = val.shape[0]
-            ans = np.zeros(n, dtype=val.dtype)
-            for i in range(nnz):
-                ans[ind[0, i]] += val[i]
-            return ans
-        return tensor_type.to_dense(A.type())(sr(A.shape[0], A._indices().numpy(), A._values().numpy()))
+        return tensor_type.to_dense(A.type())(kernels.sum_rows(A.shape[0], A._indices()[0, :].numpy(), A._values().numpy()))
         # return torch.from_numpy(scipy.sparse.coo_matrix((A._values().numpy(), (A._indices()[0, :].numpy(), A._indices()[1, :].numpy())), shape=A.shape).sum(1)).squeeze()
 
 
+def reordering(A, counts, mode="rcm"):
+    """Returns a permutation of the words (new position -> old index)."""
+    if mode == "frequency":
+        return np.argsort(-counts, kind="mergesort")
+    elif mode == "rcm":
+        # Symmetrize the pattern, since the cooccurrence matrix might not be
+        pattern = (A + A.T).tocsr()
+        return scipy.sparse.csgraph.reverse_cuthill_mckee(pattern, symmetric_mode=True).astype(np.int64)
+    else:
+        raise NotImplementedError("Reordering \"" + mode + "\" is not recognized.")
+
+
+def bandwidth(row, col):
+    if row.shape[0] == 0:
+        return 0
+    return int(np.abs(row.astype(np.int64) - col).max())
+
+
+def benchmark_mm(A, dim, CpuTensor=torch.FloatTensor, gpu=False, repeats=3):
+    """Returns the average time (in seconds) of one multiply by A."""
+    x = CpuTensor(A.shape[1], dim)
+    x.uniform_()
+    mm(A, x, gpu)  # warm up (compilation of kernels, caches)
+    begin = time.time()
+    for i in range(repeats):
+        mm(A, x, gpu)
+    return (time.time() - begin) / repeats
+
+
+def load_vocab(vocab_file):
+    """Reads the words and counts of a vocab file."""
+    def parse_line(l):
+        l = l.split()
+        assert(len(l) == 2)
+        return l[0], int(l[1])
+
+    with open(vocab_file) as f:
+        lines = [parse_line(l) for l in f]
+    return [l[0] for l in lines], np.array([l[1] for l in lines], dtype=np.int64)
+
+
+def truncate_vocab(counts, max_vocab=0, min_count=0):
+    """Returns the (increasing) ids of the max_vocab most frequent words
+    (0 for no limit) that occur at least min_count times, or None if all
+    words are kept."""
+    keep = np.flatnonzero(counts >= min_count)
+    if max_vocab > 0 and keep.shape[0] > max_vocab:
+        keep = np.sort(keep[np.argsort(-counts[keep], kind="mergesort")[:max_vocab]])
+    if keep.shape[0] == counts.shape[0]:
+        return None
+    return keep
+
+
+def align_rows(words, vec_words, vectors):
+    """Reorders the rows of vectors (one per word of vec_words) to match
+    words. Returns the aligned rows (zero for words without a vector) and
+    the mask of words that have one."""
+    index = {w: i for (i, w) in enumerate(vec_words)}
+    src = np.array([index.get(w, -1) for w in words], dtype=np.int64)
+    found = src >= 0
+    aligned = np.zeros((len(words), vectors.shape[1]), dtype=vectors.dtype)
+    aligned[found, :] = vectors[src[found], :]
+    return aligned, found
+
+
+def load_vectors(filename, dtype=np.float32):
+    """Reads a text embedding file as a list of words and a matrix."""
+    dt = collections.defaultdict(lambda: dtype)
+    dt[0] = str
+    table = pandas.read_csv(filename, sep=" ", header=None, dtype=dt, quoting=3, keep_default_na=False)
+    return list(table.iloc[:, 0]), np.ascontiguousarray(table.iloc[:, 1:].values)
+
+
 def save_to_text(filename, embedding, words):
     begin = time.time()
     embedding = embedding.cpu()
@@ -225,7 +347,38 @@ def save_to_text(filename, embedding, words):
     logging.getLogger(__name__).info("Saving embeddings: " + str(time.time() - begin))
 
 
-def get_sampler(mat, batch, scheme="element", sequential=True):
+def epoch_batches(nnz, batch, rng=None, block=None):
+    """Yields the entries of each batch of one pass over the non-zeros.
+
+    Without an rng, the batches are contiguous slices in storage order.
+    Otherwise, the entries are split into blocks of `block` entries (ten
+    batches by default); the blocks are visited in random order and the
+    entries of a block are permuted before being split into batches. Only
+    a permutation of one block is held in memory.
+    """
+    if rng is None:
+        for start in range(0, nnz, batch):
+            yield slice(start, min(start + batch, nnz))
+        return
+
+    if block is None:
+        block = 10 * batch
+    for b in rng.permutation((nnz + block - 1) // block):
+        start = b * block
+        perm = start + rng.permutation(min(block, nnz - start))
+        for i in range(0, perm.shape[0], batch):
+            yield torch.from_numpy(perm[i:i + batch])
+
+
+def take(mat, entries):
+    """Returns the values, rows and columns of the given entries (a slice or
+    a LongTensor of positions) of a sparse tensor."""
+    if not isinstance(entries, slice) and mat.is_cuda:
+        entries = entries.cuda()
+    return mat._values()[entries], mat._indices()[0, entries], mat._indices()[1, entries]
+
+
+def get_sampler(mat, batch, scheme="element", sequential=True, seed=None):
     n = mat.shape[0]
     nnz = mat._nnz()
 
@@ -268,6 +421,7 @@ def get_sampler(mat, batch, scheme="element", sequential=True):
             v = mat._values()[elements]
             yield scale * type(mat)(ind, v, mat.shape)
     else:
+        rng = np.random.RandomState(seed)
         if scheme == "row" or scheme == "column":
             mat = mat.cpu()
             data = mat._values().numpy()
@@ -280,24 +434,79 @@ def get_sampler(mat, batch, scheme="element", sequential=True):
 
         while True:
             if scheme == "element":
-                # TODO: seems like theres no long random
-                elements = t.FloatTensor(n).uniform_(0, nnz).type(t.LongTensor)
+                elements = torch.from_numpy(rng.randint(0, nnz, batch))
+                if gpu:
+                    elements = elements.cuda()
                 ind = mat._indices()[:, elements]
                 v = mat._values()[elements]
                 yield scale * type(mat)(ind, v, mat.shape)
             elif scheme == "row" or scheme == "column":
-                rc = np.random.randint(0, n, batch)
+                rc = rng.randint(0, n, batch)
                 if scheme == "row":
-                    sample = m[rc, :].tocoo()
-                    row = rc[sample.row]
-                    col = sample.col
+                    row, col, v = kernels.csr_rows(m.indptr, m.indices, m.data, rc)
                 else:
-                    sample = m[:, rc].tocoo()
-                    row = sample.row
-                    col = rc[sample.col]
-                ind =  torch.from_numpy(np.array([row, col])).type(torch.LongTensor)
-                v = torch.from_numpy(m[rc].data)
+                    col, row, v = kernels.csr_rows(m.indptr, m.indices, m.data, rc)
+                ind = torch.from_numpy(np.array([row, col]))
+                v = torch.from_numpy(v)
                 sample = scale * type(mat)(ind, v, mat.shape)
                 if gpu:
                     sample = sample.cuda()
                 yield sample
+
+
+class Prefetcher(object):
+    """Takes items from an iterator on a worker thread, up to `size` ahead
+    of the consumer, so that producing the next item overlaps with the use
+    of the current one.
+
+    The items are produced in the same order as by the iterator itself.
+    """
+
+    def __init__(self, iterator, size=2):
+        self.queue = queue.Queue(size)
+        self.wait = 0.     # time the consumer spent blocked
+        self.produce = 0.  # time the worker spent producing items
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, args=(iterator,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        begin = time.time()
+        item = self.queue.get()
+        self.wait += time.time() - begin
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    next = __next__
+
+    @property
+    def overlap(self):
+        """Production time hidden behind the consumer."""
+        return max(0., self.produce - self.wait)
+
+    def close(self):
+        self.stopped = True
+        self.thread.join()
+
+    def _run(self, iterator):
+        try:
+            while not self.stopped:
+                begin = time.time()
+                item = next(iterator)
+                self.produce += time.time() - begin
+                self._put(item)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
+"""Plots convergence traces written by `embedding compute --reference`.
 
-import torch
-import numpy as np
+    python plot_convergence.py pi.csv:"Power Iteration" pim.csv:"Power Iteration with Momentum"
+"""
+
+import sys
 import pandas as pd
 import matplotlib as mpl
 mpl.use('Agg')
@@ -9,68 +12,30 @@ import matplotlib.pyplot as plt
 
 import seaborn as sns
 
-import embedding
-
 sns.set(style="whitegrid", color_codes=True)
 
-ref = embedding.Embedding(gpu=False)
-ref.load_vectors("output/pi.1000.txt")
-ref.embedding /= ref.embedding.norm(2, 0).expand_as(ref.embedding)
-dim = ref.embedding.shape[1]
-
-method = {
-          "Power Iteration": "pi",
-          # "Power Iteration with Momentum": "pim"
-         }
-
-l1 = {} # First component loss
-l2 = {} # Second component loss
-lw = {} # Worst component loss
-
-for m in method:
-    it = [i + 1 for i in range(1000)]
-
-    e = embedding.Embedding(gpu=False)
-
-    l1[m] = []
-    l2[m] = []
-    lw[m] = []
-    for i in it:
-        e.load_vectors("output/" + method[m] + "." + str(i) + ".txt")
-        e.embedding /= e.embedding.norm(2, 0).expand_as(e.embedding)
-
-        l1[m].append(1 - abs(torch.dot(ref.embedding[:, 0], e.embedding[:, 0])))
-        l2[m].append(1 - abs(torch.dot(ref.embedding[:, 1], e.embedding[:, 1])))
-        lw[m].append(1 - abs(min([torch.dot(ref.embedding[:, i], e.embedding[:, i]) for i in range(dim)])))
-
-    # for i in range(1, 10 + 1):
-    #     data = data.append(pd.DataFrame([[i, i * len(m), m]], columns=["Iterations", "Loss", "Method"]))
-# print(data)
-
-# obj = sns.pointplot(x="Iterations", y="Loss", hue="Method", data=data, markers="", linestyle="-");
-# figure, ax = plt.subplots(1, 1)
-# figure = obj.get_figure()
-# figure.savefig("convergence.pdf", dpi=300)
-plt.figure(1)
-for m in method:
-    plt.semilogy(it, l1[m], label=m)
-plt.legend()
-plt.xlabel("Iterations")
-plt.ylabel("Loss")
-plt.savefig("first.pdf", dpi=300)
-
-plt.figure(2)
-for m in method:
-    plt.semilogy(it, l2[m], label=m)
-plt.legend()
-plt.xlabel("Iterations")
-plt.ylabel("Loss")
-plt.savefig("second.pdf", dpi=300)
-
-plt.figure(3)
-for m in method:
-    plt.semilogy(it, lw[m], label=m)
-plt.legend()
-plt.xlabel("Iterations")
-plt.ylabel("Loss")
-plt.savefig("worst.pdf", dpi=300)
+traces = {}  # Label -> trace
+for arg in (sys.argv[1:] or ["trace.csv"]):
+    filename, _, label = arg.partition(":")
+    traces[label or filename] = pd.read_csv(filename)
+
+plots = [("first.pdf", "column0", "Loss"),        # First component loss
+         ("second.pdf", "column1", "Loss"),       # Second component loss
+         ("worst.pdf", "worst", "Loss"),          # Worst component loss
+         ("angle.pdf", None, "Largest principal angle")]
+
+for (i, (filename, column, ylabel)) in enumerate(plots):
+    plt.figure(i + 1)
+    for m in traces:
+        t = traces[m]
+        if column is None:
+            y = t[[c for c in t.columns if c.startswith("angle")]].max(1)
+        elif column in t:
+            y = t[column]
+        else:
+            continue
+        plt.semilogy(t["iteration"], y, label=m)
+    plt.legend()
+    plt.xlabel("Iterations")
+    plt.ylabel(ylabel)
+    plt.savefig(filename, dpi=300)
@@ -0,0 +1,64 @@
+import numpy as np
+import scipy.sparse
+import os
+import shutil
+import tempfile
+import unittest
+
+import embedding.blockcsr as blockcsr
+
+np.random.seed(0)
+n = 500
+mat = scipy.sparse.random(n, n, 0.05, format="coo")
+
+
+class TestBlockCSR(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.glove = os.path.join(self.dir, "cooccurrence.bin")
+        self.csr = os.path.join(self.dir, "cooccurrence.csr")
+
+        # GloVe files are unsorted with 1-based indices
+        perm = np.random.permutation(mat.nnz)
+        data = np.zeros(mat.nnz, dtype=blockcsr.GLOVE_DTYPE)
+        data["ind"][:, 0] = mat.row[perm] + 1
+        data["ind"][:, 1] = mat.col[perm] + 1
+        data["val"] = mat.data[perm]
+        data.tofile(self.glove)
+
+        blockcsr.convert(self.glove, self.csr, n, block_size=64, chunk_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_format(self):
+        self.assertTrue(blockcsr.is_blockcsr(self.csr))
+        self.assertFalse(blockcsr.is_blockcsr(self.glove))
+
+    def test_roundtrip(self):
+        A = blockcsr.BlockCSR(self.csr)
+        self.assertEqual(A.shape, (n, n))
+        self.assertEqual(A.nnz, mat.nnz)
+        self.assertTrue(np.allclose(A.tocsr().toarray(), mat.toarray()))
+        A.close()
+
+    def test_blocks(self):
+        A = blockcsr.BlockCSR(self.csr)
+        blocks = A.row_blocks(100, 200)
+        self.assertEqual(blocks, [1, 2, 3])
+        B = A.tocsr(blocks).toarray()
+        self.assertTrue(np.allclose(B[64:256], mat.toarray()[64:256]))
+        self.assertEqual(np.abs(B[:64]).sum(), 0)
+        self.assertEqual(np.abs(B[256:]).sum(), 0)
+        A.close()
+
+    def test_submatrix(self):
+        keep = np.sort(np.random.choice(n, 100, replace=False))
+        expected = mat.toarray()[keep, :][:, keep]
+        for filename in [self.glove, self.csr]:
+            B = blockcsr.submatrix(filename, n, keep, chunk_size=1000)
+            self.assertEqual(B.shape, (100, 100))
+            self.assertTrue(np.allclose(B.toarray(), expected))
+
+if __name__ == "__main__":
+    unittest.main()
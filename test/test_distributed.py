@@ -0,0 +1,101 @@
+import torch
+import numpy as np
+import scipy.sparse
+import os
+import argparse
+import shutil
+import tempfile
+import unittest
+
+import embedding.distributed as distributed
+import embedding.blockcsr as blockcsr
+
+n = 200
+dim = 4
+iterations = 10
+
+np.random.seed(0)
+mat = scipy.sparse.random(n, n, 0.05, format="coo")
+mat = (mat + mat.T).tocoo()
+x = np.linalg.qr(np.random.randn(n, dim))[0]
+
+
+def worker(rank, world_size, init_method, filename, output, ortho):
+    distributed.init(rank, world_size, init_method)
+    start, end = distributed.row_range(n, rank, world_size)
+    A = distributed.load_rows(filename, n, start, end, np.float64)
+    y = distributed.power_iteration(A, torch.from_numpy(x.copy()), start, world_size, iterations=iterations, ortho=ortho)
+    if rank == 0:
+        np.save(output, y.numpy())
+
+
+def reference():
+    y = x
+    for i in range(iterations):
+        y = np.linalg.qr(mat.tocsr() * y)[0]
+    return y
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "cooccurrence.bin")
+        data = np.zeros(mat.nnz, dtype=blockcsr.GLOVE_DTYPE)
+        data["ind"][:, 0] = mat.row + 1
+        data["ind"][:, 1] = mat.col + 1
+        data["val"] = mat.data
+        data.tofile(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, ortho):
+        output = os.path.join(self.dir, "x.npy")
+        distributed.launch(3, worker, (self.filename, output, ortho))
+        y = np.load(output)
+        ref = reference()
+        # Same subspace (columns may be ordered and signed differently)
+        self.assertTrue(np.allclose(np.dot(y.T, y), np.eye(dim), atol=1e-8))
+        self.assertTrue(np.allclose(np.dot(y, y.T), np.dot(ref, ref.T), atol=1e-6))
+
+    def test_gram(self):
+        self.check("gram")
+
+    def test_gather(self):
+        self.check("gather")
+
+    def compute(self, initial, dim=dim):
+        vocab = os.path.join(self.dir, "vocab.txt")
+        with open(vocab, "w") as f:
+            for i in range(n):
+                f.write("w" + str(i) + " " + str(n - i) + "\n")
+        args = argparse.Namespace(precision="double", vocab=vocab, cooccurrence=self.filename,
+                                  preprocessing="none", negative=1., alpha=1., dim=dim, initial=initial,
+                                  iterations=iterations, momentum=0., normfreq=1, ortho="gram", scale=0.,
+                                  normalize=False, vectors=os.path.join(self.dir, "vectors.txt"))
+        distributed.launch(2, distributed.compute, (args,))
+        with open(args.vectors) as f:
+            return np.array([[float(v) for v in l.split()[1:]] for l in f])
+
+    def test_initial(self):
+        # The initial vectors are aligned by word, not by line
+        initial = os.path.join(self.dir, "initial.txt")
+        with open(initial, "w") as f:
+            for i in reversed(range(n)):
+                f.write("w" + str(i) + " " + " ".join(repr(float(v)) for v in x[i, :]) + "\n")
+        y = self.compute(initial)
+        ref = reference()
+        self.assertTrue(np.allclose(np.dot(y, y.T), np.dot(ref, ref.T), atol=1e-6))
+
+    def test_initial_dim(self):
+        # A dimension mismatch fails on every rank instead of hanging
+        initial = os.path.join(self.dir, "initial.txt")
+        with open(initial, "w") as f:
+            for i in range(n):
+                f.write("w" + str(i) + " " + " ".join(repr(float(v)) for v in x[i, :]) + "\n")
+        with self.assertRaises(RuntimeError):
+            self.compute(initial, dim + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import numpy as np
+import scipy.sparse
+import unittest
+
+import embedding.kernels as kernels
+
+np.random.seed(0)
+n = 50
+mat = scipy.sparse.random(n, n, 0.2, format="coo")
+mat.data += 1
+row = mat.row.astype(np.int64)
+col = mat.col.astype(np.int64)
+
+
+class TestKernels(unittest.TestCase):
+    def test_sum_rows(self):
+        self.assertTrue(np.allclose(kernels.sum_rows(n, row, mat.data), np.asarray(mat.sum(1)).squeeze(1)))
+
+    def test_ppmi(self):
+        wc = np.asarray(mat.sum(1)).squeeze(1)
+        shift, alpha = np.log(wc.sum()), 0.75
+        v = np.log(mat.data) + shift - np.log(wc[row]) - alpha * np.log(wc[col])
+        keep = v > 0
+
+        r, c, d = row.copy(), col.copy(), mat.data.copy()
+        nnz = kernels.ppmi(r, c, d, wc, shift, alpha)
+        self.assertEqual(nnz, keep.sum())
+        self.assertTrue((r[:nnz] == row[keep]).all())
+        self.assertTrue((c[:nnz] == col[keep]).all())
+        self.assertTrue(np.allclose(d[:nnz], v[keep]))
+
+    def test_remap(self):
+        index = -np.ones(n, dtype=np.int64)
+        index[::2] = np.arange((n + 1) // 2)
+        r, c, d = row.copy(), col.copy(), mat.data.copy()
+        nnz = kernels.remap(r, c, d, index)
+        sub = scipy.sparse.coo_matrix((d[:nnz], (r[:nnz], c[:nnz])), shape=((n + 1) // 2, (n + 1) // 2))
+        self.assertTrue(np.allclose(sub.toarray(), mat.toarray()[::2, ::2]))
+
+    def test_csr_rows(self):
+        A = mat.tocsr()
+        rows = np.array([3, 0, 3], dtype=np.int64)
+        r, c, d = kernels.csr_rows(A.indptr, A.indices, A.data, rows)
+        B = scipy.sparse.coo_matrix((d, (r, c)), shape=(n, n)).toarray()
+        expected = np.zeros((n, n))
+        expected[0] = A[0].toarray()
+        expected[3] = 2 * A[3].toarray()
+        self.assertTrue(np.allclose(B, expected))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import torch
+import numpy as np
+import scipy.sparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from embedding.main import Embedding
+import embedding.util as util
+import embedding.blockcsr as blockcsr
+
+np.random.seed(0)
+n = 60
+d = 4
+
+# Known spectrum: the eigenvectors with eigenvalues 10, 9, 8, 7 and 6 lead
+eigenvalues = np.concatenate([np.arange(10, 5, -1), np.linspace(-3, 3, n - 5)])
+U = np.linalg.qr(np.random.randn(n, n))[0]
+mat = scipy.sparse.csr_matrix(np.dot(U * eigenvalues, U.T))
+words = ["w" + str(i) for i in range(n)]
+
+
+def subspace_error(x, k):
+    """Distance of x from the span of the top k eigenvectors."""
+    T = U[:, :k]
+    return np.linalg.norm(x - np.dot(T, np.dot(T.T, x)))
+
+
+class TestWarmStart(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vectors = os.path.join(self.dir, "vectors.txt")
+
+        self.e = Embedding(d, False, False, False, torch.DoubleTensor)
+        self.e.words = words
+        self.e.n = n
+        self.e.mat = mat
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self, rows, x):
+        with open(self.vectors, "w") as f:
+            for i in rows:
+                f.write(words[i] + " " + " ".join(repr(float(v)) for v in x[i, :]) + "\n")
+        self.e.load_vectors(self.vectors)
+        return self.e.embedding.numpy()
+
+    def test_permuted(self):
+        # Same words and dimension in another order: rows are only aligned
+        x = np.random.randn(n, d)
+        self.assertTrue(np.allclose(self.load(np.random.permutation(n), x), x))
+
+    def test_missing(self):
+        # Rows of the words missing from the previous vocabulary are filled
+        # from the others, instead of being left at zero
+        missing = np.arange(0, n, 6)
+        found = np.setdiff1d(np.arange(n), missing)
+        x = self.load(found, U[:, :d])
+        self.assertEqual(x.shape, (n, d))
+        self.assertTrue(np.allclose(np.dot(x.T, x), np.eye(d)))
+        self.assertTrue((np.abs(x[missing, :]).sum(1) > 0).all())
+
+        zero = U[:, :d].copy()
+        zero[missing, :] = 0
+        zero = np.linalg.qr(zero)[0]
+        self.assertLess(subspace_error(x, d), 0.5 * subspace_error(zero, d))
+
+    def test_truncate(self):
+        # The leading Ritz vectors of the previous span are kept
+        x = self.load(np.arange(n), np.dot(U[:, :d + 2], np.random.randn(d + 2, d + 2)))
+        self.assertEqual(x.shape, (n, d))
+        self.assertTrue(np.allclose(np.dot(x.T, x), np.eye(d)))
+        self.assertLess(subspace_error(x, d), 1e-6)
+
+    def test_pad(self):
+        # Previous columns come first, followed by orthogonal random columns
+        x = self.load(np.arange(n), np.dot(U[:, :d - 2], np.random.randn(d - 2, d - 2)))
+        self.assertEqual(x.shape, (n, d))
+        self.assertTrue(np.allclose(np.dot(x.T, x), np.eye(d)))
+        self.assertLess(subspace_error(x[:, :d - 2], d - 2), 1e-6)
+        self.assertGreater(subspace_error(x[:, d - 2:], d - 2), 1)
+
+
+class TestReorder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vocab = os.path.join(self.dir, "vocab.txt")
+        self.cooccurrence = os.path.join(self.dir, "cooccurrence.bin")
+
+        # Counts out of order, so that the frequency ordering moves words
+        self.counts = np.random.RandomState(1).permutation(n) + 1
+        with open(self.vocab, "w") as f:
+            for (w, c) in zip(words, self.counts):
+                f.write(w + " " + str(c) + "\n")
+
+        A = mat.tocoo()
+        data = np.zeros(A.nnz, dtype=blockcsr.GLOVE_DTYPE)
+        data["ind"][:, 0] = A.row + 1
+        data["ind"][:, 1] = A.col + 1
+        data["val"] = A.data
+        data.tofile(self.cooccurrence)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reordering(self):
+        # A banded matrix with shuffled labels, whose bandwidth rcm recovers
+        perm = np.random.RandomState(2).permutation(n)
+        band = scipy.sparse.diags([1, 1, 1], [-1, 0, 1], shape=(n, n)).tocoo()
+        row, col = perm[band.row], perm[band.col]
+        A = scipy.sparse.csr_matrix((band.data, (row, col)), shape=(n, n))
+        for mode in ["rcm", "frequency"]:
+            p = util.reordering(A, self.counts, mode)
+            self.assertEqual(sorted(p.tolist()), list(range(n)))
+        self.assertTrue((self.counts[util.reordering(A, self.counts, "frequency")] == np.arange(n, 0, -1)).all())
+
+        inv = np.argsort(util.reordering(A, self.counts, "rcm"))
+        self.assertEqual(util.bandwidth(inv[row], inv[col]), 1)
+        self.assertGreater(util.bandwidth(row, col), 1)
+        with self.assertRaises(NotImplementedError):
+            util.reordering(A, self.counts, "none")
+
+    def solve(self, reorder):
+        e = Embedding(d, False, False, False, torch.DoubleTensor)
+        e.load_cooccurrence(self.vocab, self.cooccurrence, reorder=reorder)
+        if reorder != "none":
+            self.assertFalse((e.perm == np.arange(n)).all())
+        e.load_vectors()
+        e.solve(mode="pi", gpu=False, scale=0., normalize=False, iterations=200)
+        vectors = os.path.join(self.dir, reorder + ".txt")
+        e.save_to_text(vectors)
+        with open(vectors) as f:
+            lines = [l.split() for l in f]
+        return [l[0] for l in lines], np.array([[float(v) for v in l[1:]] for l in lines])
+
+    def test_save(self):
+        # Vectors are written in the vocab order, and span the same subspace
+        # as without reordering
+        words0, x0 = self.solve("none")
+        self.assertEqual(words0, words)
+        self.assertLess(subspace_error(x0, d), 1e-6)
+        for mode in ["rcm", "frequency"]:
+            w, x = self.solve(mode)
+            self.assertEqual(w, words)
+            self.assertTrue(np.allclose(np.dot(x, x.T), np.dot(x0, x0.T), atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
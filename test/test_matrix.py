@@ -0,0 +1,82 @@
+import numpy as np
+import scipy.sparse
+import unittest
+
+import embedding.matrix as matrix
+
+np.random.seed(0)
+mat = scipy.sparse.random(100, 100, 0.1, format="csr")
+sym = (mat + mat.T).tocsr()
+x = np.random.rand(100, 4)
+
+
+class TestSymmetricMatrix(unittest.TestCase):
+    def test_dot(self):
+        A = matrix.to_symmetric(sym)
+        self.assertTrue(np.allclose(A.dot(x), sym * x))
+
+    def test_sum_rows(self):
+        A = matrix.to_symmetric(sym)
+        self.assertTrue(np.allclose(A.sum_rows(), np.asarray(sym.sum(1)).squeeze(1)))
+
+    def test_storage(self):
+        A = matrix.to_symmetric(sym)
+        self.assertTrue(A.nnz < sym.nnz)
+        self.assertTrue(np.allclose(A.tocsr().toarray(), sym.toarray()))
+
+    def test_fallback(self):
+        self.assertIsNone(matrix.to_symmetric(mat))
+
+
+class TestHybridMatrix(unittest.TestCase):
+    def setUp(self):
+        # Dense leading 20 x 20 block
+        head = scipy.sparse.random(100, 100, 1., format="csr")
+        head[20:, :] = 0
+        head[:, 20:] = 0
+        self.A = (sym + head).tocsr()
+
+    def test_head(self):
+        self.assertGreaterEqual(matrix.hybrid_head(self.A, 0.5), 20)
+        self.assertEqual(matrix.hybrid_head(mat, 1.1), 0)
+        self.assertIsNone(matrix.to_hybrid(mat, 1.1))
+
+    def test_dot(self):
+        A = matrix.to_hybrid(self.A, 0.5)
+        self.assertTrue(np.allclose(A.dot(x), self.A * x))
+
+    def test_sum_rows(self):
+        A = matrix.to_hybrid(self.A, 0.5)
+        self.assertTrue(np.allclose(A.sum_rows(), np.asarray(self.A.sum(1)).squeeze(1)))
+
+    def test_storage(self):
+        A = matrix.to_hybrid(self.A, 0.5)
+        self.assertEqual(A.nnz, self.A.nnz)
+        self.assertTrue(np.allclose(A.tocsr().toarray(), self.A.toarray()))
+
+
+class TestCompressedMatrix(unittest.TestCase):
+    def setUp(self):
+        # Wide enough for gaps of several bytes
+        self.A = scipy.sparse.random(100, 100000, 0.001, format="csr")
+
+    def test_dot(self):
+        A = matrix.CompressedMatrix(self.A, block=8)
+        y = np.random.rand(100000, 4)
+        self.assertTrue(np.allclose(A.dot(y), self.A * y))
+        A = matrix.CompressedMatrix(sym, block=8)
+        self.assertTrue(np.allclose(A.dot(x), sym * x))
+
+    def test_sum_rows(self):
+        A = matrix.CompressedMatrix(self.A)
+        self.assertTrue(np.allclose(A.sum_rows(), np.asarray(self.A.sum(1)).squeeze(1)))
+
+    def test_storage(self):
+        A = matrix.CompressedMatrix(self.A, block=8)
+        self.assertEqual(A.nnz, self.A.nnz)
+        self.assertTrue((A.tocsr() != self.A).nnz == 0)
+        self.assertGreater(matrix.CompressedMatrix(sym).ratio, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
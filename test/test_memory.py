@@ -0,0 +1,39 @@
+import unittest
+
+import embedding.memory as memory
+import embedding.util as util
+
+
+class TestMemory(unittest.TestCase):
+    def test_incore(self):
+        p = memory.plan(1000, 10000, 10, memory=2 ** 30)
+        self.assertEqual(p.load_chunk, 10000)
+        self.assertFalse(p.symmetric)
+        self.assertTrue(all(v <= 2 ** 30 for v in p.peak.values()))
+
+    def test_streaming(self):
+        nnz = 10 ** 8
+        p = memory.plan(10 ** 6, nnz, 100, memory=4 * 2 ** 30)
+        self.assertLess(p.load_chunk, nnz)
+        self.assertLessEqual(p.peak["load"], 4 * 2 ** 30)
+
+    def test_symmetric(self):
+        n, nnz, dim = 10 ** 5, 10 ** 8, 10
+        p = memory.plan(n, nnz, dim, memory=600 * 2 ** 20)
+        self.assertTrue(p.symmetric)
+        self.assertLessEqual(p.peak["solve"], 600 * 2 ** 20)
+
+    def test_split_size(self):
+        self.assertEqual(memory.split_size(10, 10, 2 ** 30), 10000)
+        small = memory.split_size(10 ** 5, 100, 2 ** 28)
+        self.assertGreaterEqual(small, 1)
+        self.assertLessEqual(2 * 8 * 10 ** 7 + 3 * 8 * 10 ** 5 * small, 2 ** 28)
+
+    def test_mm_batches(self):
+        # Embedding fits in half the memory, matrix gets the rest
+        self.assertEqual(util.mm_batches(1000, 10, 20, 100, 2000), (20, 1))
+        # Embedding is split to half the memory
+        self.assertEqual(util.mm_batches(1000, 10, 20, 200, 1000), (40, 5))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import torch
+import numpy as np
+import pandas
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import embedding.metrics as metrics
+
+np.random.seed(0)
+n = 30
+d = 4
+words = ["w" + str(i) for i in range(n)]
+
+
+def fake_evaluate(words, W):
+    if W[0, 0] < 0:
+        raise ValueError("failed evaluation")
+    return {"similarity": (W[0, 0], W[0, 1]), "analogy-add": 0.5, "analogy-mul": 0.25}
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "metrics.csv")
+        self.evaluate = metrics.evaluate.evaluate
+        metrics.evaluate.evaluate = fake_evaluate
+
+    def tearDown(self):
+        metrics.evaluate.evaluate = self.evaluate
+        shutil.rmtree(self.dir)
+
+    def test_writer(self):
+        writer = metrics.MetricsWriter(self.filename)
+        writer.write({"iteration": 1, "loss": 0.5})
+        writer.write({"iteration": 2, "loss": 0.25})
+        writer.close()
+        table = pandas.read_csv(self.filename)
+        self.assertEqual(list(table.columns), ["iteration", "loss"])
+        self.assertEqual(list(table["iteration"]), [1, 2])
+        self.assertEqual(list(table["loss"]), [0.5, 0.25])
+
+    def test_background(self):
+        evaluator = metrics.BackgroundEvaluator(words, metrics.MetricsWriter(self.filename))
+        for i in range(5):
+            evaluator.submit(torch.ones(n, d) * (i + 1), i + 1)
+        evaluator.close()
+        table = pandas.read_csv(self.filename)
+        self.assertEqual(list(table["iteration"]), [1, 2, 3, 4, 5])
+        self.assertEqual(list(table["similarity-dot"]), [1, 2, 3, 4, 5])
+
+    def test_background_failure(self):
+        # Failed evaluations are skipped, and more snapshots than the queue
+        # holds can still be submitted
+        evaluator = metrics.BackgroundEvaluator(words, metrics.MetricsWriter(self.filename), maxsize=1)
+        thread = threading.Thread(target=lambda: [evaluator.submit(torch.ones(n, d) * (-1) ** i, i + 1) for i in range(6)])
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        evaluator.close(timeout=10)
+        self.assertFalse(evaluator.thread.is_alive())
+        table = pandas.read_csv(self.filename)
+        self.assertEqual(list(table["iteration"]), [1, 3, 5])
+
+    def test_tracker(self):
+        # The reference holds the same columns as the iterate, with its words
+        # in reverse order and one extra word
+        x, _ = np.linalg.qr(np.random.randn(n, d))
+        reference = os.path.join(self.dir, "reference.txt")
+        with open(reference, "w") as f:
+            for i in reversed(range(n)):
+                f.write(words[i] + " " + " ".join(str(v) for v in -2 * x[i, :]) + "\n")
+            f.write("extra " + " ".join(["1"] * d) + "\n")
+
+        tracker = metrics.ConvergenceTracker(reference, words, metrics.MetricsWriter(self.filename))
+        tracker.update(torch.from_numpy(x), 1)
+        y, _ = np.linalg.qr(np.random.randn(n, d))
+        tracker.update(torch.from_numpy(y), 2)
+        tracker.close()
+
+        table = pandas.read_csv(self.filename)
+        self.assertEqual(list(table["iteration"]), [1, 2])
+        for i in range(d):
+            self.assertAlmostEqual(table["column" + str(i)][0], 0)
+            self.assertAlmostEqual(table["angle" + str(i)][0], 0, places=6)
+        self.assertGreater(table["worst"][1], 0.1)
+        self.assertGreater(table["angle" + str(d - 1)][1], 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
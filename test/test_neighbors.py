@@ -0,0 +1,42 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+import embedding.neighbors as neighbors
+
+np.random.seed(0)
+W = np.random.randn(300, 10).astype(np.float32)
+
+
+def brute_force(W, k):
+    U = W / np.linalg.norm(W, axis=1, keepdims=True)
+    sim = np.dot(U, U.T)
+    np.fill_diagonal(sim, -np.inf)
+    ids = np.argsort(-sim, axis=1)[:, :k]
+    return ids, sim[np.arange(W.shape[0])[:, np.newaxis], ids]
+
+
+class TestNeighbors(unittest.TestCase):
+    def test_top_k(self):
+        ref_ids, ref_scores = brute_force(W, 5)
+        # Small budget to force many tiles
+        ids, scores = neighbors.top_k(W, 5, memory=10 * 300 * 16, threads=2)
+        self.assertTrue((ids == ref_ids).all())
+        self.assertTrue(np.allclose(scores, ref_scores, atol=1e-3))
+
+    def test_save_load(self):
+        ids, scores = neighbors.top_k(W, 5)
+        dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir, "neighbors.bin")
+            neighbors.save(filename, ids, scores)
+            loaded_ids, loaded_scores = neighbors.load(filename)
+            self.assertTrue((loaded_ids == ids).all())
+            self.assertTrue((loaded_scores == scores).all())
+        finally:
+            shutil.rmtree(dir)
+
+if __name__ == "__main__":
+    unittest.main()
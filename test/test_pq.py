@@ -0,0 +1,54 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+import embedding.pq as pq
+
+np.random.seed(0)
+W = np.random.randn(500, 12).astype(np.float32)
+
+
+class TestProductQuantizer(unittest.TestCase):
+    def test_dot(self):
+        q = pq.train(W, 4, 16)
+        Q = W[:5, :]
+        self.assertTrue(np.allclose(q.dot(Q), np.dot(q.rows(np.arange(500)), Q.T), atol=1e-4))
+
+    def test_exact(self):
+        # With as many centroids as rows, every row is its own centroid
+        q = pq.train(W[:16, :], 4, 16)
+        self.assertTrue(np.allclose(q.rows(np.arange(16)), W[:16, :], atol=1e-5))
+
+    def test_save_load(self):
+        q = pq.train(W, 3, 8, words=[str(i) for i in range(500)])
+        dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir, "vectors.npz")
+            q.save(filename)
+            r = pq.load(filename)
+            self.assertEqual(r.words, q.words)
+            self.assertEqual(r.shape, q.shape)
+            self.assertTrue((r.codes == q.codes).all())
+            self.assertTrue(np.allclose(r.rows(np.arange(500)), q.rows(np.arange(500))))
+        finally:
+            shutil.rmtree(dir)
+
+    def test_save_path(self):
+        # The file is written to the given path, whatever its suffix
+        q = pq.train(W, 3, 8)
+        dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dir, "vectors.pq")
+            q.save(filename)
+            self.assertEqual(os.listdir(dir), ["vectors.pq"])
+            r = pq.load(filename)
+            self.assertIsNone(r.words)
+            self.assertTrue(np.allclose(r.rows(np.arange(500)), q.rows(np.arange(500))))
+        finally:
+            shutil.rmtree(dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
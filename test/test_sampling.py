@@ -1,4 +1,5 @@
 import torch
+import numpy as np
 import unittest
 
 import embedding.util as util
@@ -53,5 +54,24 @@ class TestTensorType(unittest.TestCase):
         for i in range(1, 3):
             test_sequential_sampler(self, "column", col, i)
 
+    def test_epoch_batches(self):
+        for rng in [None, np.random.RandomState(0)]:
+            entries = [util.take(mat, e)[0] for e in util.epoch_batches(9, 2, rng, block=4)]
+            self.assertTrue(all(e.shape[0] <= 2 for e in entries))
+            self.assertEqual(sorted(torch.cat(entries).tolist()), v.tolist())
+
+    def test_seeded_sampler(self):
+        for scheme in ["element", "row", "column"]:
+            a = util.get_sampler(mat, 2, scheme, False, seed=1)
+            b = util.Prefetcher(util.get_sampler(mat, 2, scheme, False, seed=1), 3)
+            for i in range(10):
+                self.assertTrue((next(a).to_dense() == next(b).to_dense()).all())
+            b.close()
+
+    def test_prefetcher(self):
+        p = util.Prefetcher(iter(range(10)), 3)
+        self.assertEqual(list(p), list(range(10)))
+        p.close()
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,139 @@
+import numpy as np
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+if sys.version_info[0] >= 3:
+    import asyncio
+    import embedding.serve as serve
+
+np.random.seed(0)
+n = 50
+dim = 8
+words = ["w" + str(i) for i in range(n - 1)] + [u"caf\u00e9"]
+W = np.random.randn(n, dim).astype(np.float32)
+
+
+class Writer(object):
+    """Collects the response of Server.handle."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        pass
+
+    def drain(self):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+
+@unittest.skipIf(sys.version_info[0] < 3, "serve requires Python 3")
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vectors = os.path.join(self.dir, "vectors.txt")
+        with open(self.vectors, "w", encoding="utf-8") as f:
+            for (w, v) in zip(words, W):
+                f.write(w + " " + " ".join(str(x) for x in v) + "\n")
+        self.store = serve.VectorStore(self.vectors)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = serve.Server(self.store, loop=self.loop)
+        self.batcher = self.loop.create_task(self.server.batcher())
+
+    def tearDown(self):
+        self.batcher.cancel()
+        self.loop.run_until_complete(asyncio.gather(self.batcher, return_exceptions=True))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.dir)
+
+    def request(self, path):
+        reader = asyncio.StreamReader()
+        reader.feed_data(("GET " + path + " HTTP/1.1\r\n\r\n").encode("latin-1"))
+        reader.feed_eof()
+        writer = Writer()
+        self.loop.run_until_complete(self.server.handle(reader, writer))
+        header, body = writer.data.split(b"\r\n\r\n", 1)
+        return header.split(b"\r\n")[0].decode("latin-1"), json.loads(body.decode("utf-8"))
+
+    def test_lru(self):
+        cache = serve.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+        cache = serve.LRUCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_index(self):
+        for (i, w) in enumerate(words):
+            self.assertEqual(self.store.index(w), i)
+            self.assertEqual(self.store.word(i), w)
+        self.assertIsNone(self.store.index("missing"))
+        self.assertIsNone(self.store.index(""))
+        self.assertTrue(np.allclose(self.store.vector(3), W[3, :], atol=1e-5))
+
+        # Reopening maps the files built by the first store
+        self.assertFalse(self.store.stale(self.vectors))
+        self.assertEqual(serve.VectorStore(self.vectors).index(u"caf\u00e9"), n - 1)
+
+    def test_neighbors(self):
+        queries = [self.server.neighbors({"word": w, "k": "3"}) for w in words[:10]]
+        results = self.loop.run_until_complete(asyncio.gather(*queries))
+        self.assertEqual(self.server.batches, 1)
+        self.assertEqual(self.server.queries, 10)
+
+        U = W / np.sqrt(np.sum(W * W, 1, keepdims=True))
+        for (i, result) in enumerate(results):
+            s = np.dot(U, U[i, :])
+            s[i] = -np.inf
+            self.assertEqual([w for (w, _) in result["neighbors"]], [words[j] for j in np.argsort(-s)[:3]])
+
+    def test_cancelled(self):
+        # A query whose request went away does not stop the rest of the batch
+        queries = [self.loop.create_task(self.server.neighbors({"word": w})) for w in words[:3]]
+        self.loop.call_soon(queries[1].cancel)
+        results = self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(*queries, return_exceptions=True), 10))
+        self.assertIsInstance(results[1], asyncio.CancelledError)
+        self.assertEqual(len(results[0]["neighbors"]), 10)
+        self.assertEqual(len(results[2]["neighbors"]), 10)
+        self.assertFalse(self.batcher.done())
+
+    def test_handle(self):
+        status, body = self.request("/similarity?a=w1&b=w1")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertAlmostEqual(body["similarity"], 1, places=5)
+
+        status, body = self.request("/vector?word=missing")
+        self.assertEqual(status, "HTTP/1.1 400 Bad Request")
+        status, body = self.request("/missing")
+        self.assertEqual(status, "HTTP/1.1 404 Not Found")
+
+        def fail(params):
+            future = self.loop.create_future()
+            future.set_exception(RuntimeError("failure"))
+            return future
+        self.server.handlers["/vector"] = fail
+        status, body = self.request("/vector?word=w1")
+        self.assertEqual(status, "HTTP/1.1 500 Internal Server Error")
+        self.assertEqual(body["error"], "failure")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+import torch
+import numpy as np
+import scipy.sparse
+import re
+import logging
+import unittest
+
+import embedding.solver as solver
+import embedding.util as util
+
+np.random.seed(0)
+n = 200
+
+# Symmetric counts with Zipf-like word frequencies
+p = 1. / np.arange(1, n + 1)
+p /= p.sum()
+counts = scipy.sparse.coo_matrix((np.ones(20000), (np.random.choice(n, 20000, p=p), np.random.choice(n, 20000, p=p))), shape=(n, n))
+counts = (counts + counts.T).tocoo()
+ind = torch.from_numpy(np.array([counts.row, counts.col])).type(torch.LongTensor)
+cooccurrence = torch.sparse.DoubleTensor(ind, torch.from_numpy(counts.data), torch.Size([n, n]))
+
+
+# Known spectrum: the top d eigenvalues are 10 ... 6, the rest are spread
+# over [-5.5, 5.5], so plain power iteration converges slowly
+d = 5
+eigenvalues = np.concatenate([np.linspace(10, 6, d), np.linspace(-5.5, 5.5, n - d)])
+U = np.linalg.qr(np.random.randn(n, n))[0]
+spectrum = scipy.sparse.csr_matrix(np.dot(U * eigenvalues, U.T))
+top = U[:, :d]
+
+
+def subspace_error(x):
+    x = x.numpy()
+    return np.linalg.norm(x - np.dot(top, np.dot(top.T, x)))
+
+
+def run(iterations=100, **kwargs):
+    """Runs power iteration on spectrum, and returns the final iterate and
+    the subspace error after each iteration."""
+    errors = []
+    x0 = torch.from_numpy(np.random.RandomState(1).randn(n, d))
+    x0, _ = util.normalize(x0)
+    x, _ = solver.power_iteration(spectrum, x0, iterations=iterations,
+                                  checkpoint=lambda x, i: errors.append(subspace_error(x)), **kwargs)
+    return x, errors
+
+
+def iterations_to(errors, tol):
+    return next((i + 1 for (i, e) in enumerate(errors) if e < tol), len(errors) + 1)
+
+
+def glove_loss(mat, bias, xmax=100, alpha=0.75):
+    X = mat._values()
+    f = (X / xmax).clamp(max=1).pow(alpha)
+    error = bias[mat._indices()[0, :]] + bias[mat._indices()[1, :]] - torch.log(X)
+    return float((f * error * error).sum()) / 2
+
+
+class TestPowerIteration(unittest.TestCase):
+    def test_plain(self):
+        x, errors = run(200)
+        self.assertLess(errors[-1], 1e-4)
+
+    def test_ritz(self):
+        # The final iterate holds the Ritz vectors, in order of magnitude
+        x, errors = run(100, ritz=10)
+        H = np.dot(x.numpy().T, spectrum * x.numpy())
+        self.assertTrue(np.allclose(H, np.diag(np.diag(H)), atol=1e-6))
+        self.assertTrue(np.allclose(np.diag(H), eigenvalues[:d], atol=1e-2))
+
+    def test_ritz_schedule(self):
+        calls = []
+        rayleigh_ritz = util.rayleigh_ritz
+
+        def counting(*args):
+            calls.append(1)
+            return rayleigh_ritz(*args)
+        util.rayleigh_ritz = counting
+        try:
+            run(20, ritz=0, accelerate="momentum")
+            self.assertEqual(len(calls), 0)
+            run(20, ritz=5, accelerate="momentum")
+            self.assertEqual(len(calls), 4)
+        finally:
+            util.rayleigh_ritz = rayleigh_ritz
+
+    def test_lock(self):
+        # All columns lock, and the iteration stops early
+        x, errors = run(500, lock_tol=1e-6)
+        self.assertLess(len(errors), 500)
+        self.assertLess(subspace_error(x), 1e-4)
+
+    def test_momentum(self):
+        _, plain = run(300)
+        _, accelerated = run(300, accelerate="momentum")
+        self.assertLess(iterations_to(accelerated, 1e-4), iterations_to(plain, 1e-4))
+
+    def test_short_warmup(self):
+        # Warmups shorter than 2 iterations are raised to 2
+        for accelerate in ["momentum", "chebyshev"]:
+            _, expected = run(300, accelerate=accelerate, warmup=2)
+            self.assertLess(expected[-1], 1e-4)
+            for warmup in [0, 1]:
+                _, errors = run(300, accelerate=accelerate, warmup=warmup)
+                self.assertTrue(np.allclose(errors, expected))
+
+    def test_chebyshev(self):
+        _, plain = run(300)
+        _, accelerated = run(300, accelerate="chebyshev")
+        self.assertLess(iterations_to(accelerated, 1e-4), 0.75 * iterations_to(plain, 1e-4))
+        self.assertLess(accelerated[-1], 1e-8)
+
+
+def logged(f, *args, **kwargs):
+    """Returns the result of f and the messages it logged."""
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logger = logging.getLogger()
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        return f(*args, **kwargs), "\n".join(messages)
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+
+def products(messages):
+    """Number of matrix-vector products logged by lobpcg and arpack."""
+    return int(re.search(r"\((\d+) matrix-vector products\)", messages).group(1))
+
+
+class TestOperator(unittest.TestCase):
+    def setUp(self):
+        self.x0 = torch.from_numpy(np.random.RandomState(1).randn(n, d))
+        self.warm = torch.from_numpy(top + 1e-3 * np.random.RandomState(2).randn(n, d))
+
+    def check(self, x):
+        # Orthonormal top eigenvectors, in order of decreasing eigenvalue
+        x = x.numpy()
+        self.assertEqual(x.shape, (n, d))
+        self.assertTrue(np.allclose(np.dot(x.T, x), np.eye(d), atol=1e-6))
+        self.assertTrue(np.allclose(np.sum(x * (spectrum * x), 0), eigenvalues[:d], atol=1e-6))
+        self.assertLess(subspace_error(torch.from_numpy(x)), 1e-6)
+
+    def test_operator(self):
+        op, count = solver.operator(spectrum, np.float64)
+        x = self.x0.numpy()
+        self.assertTrue(np.allclose(op.matmat(x), spectrum * x))
+        self.assertTrue(np.allclose(op.matvec(x[:, 0]), spectrum * x[:, 0]))
+        self.assertEqual(count[0], d + 1)
+
+    def test_lobpcg(self):
+        x, cold = logged(solver.lobpcg, spectrum, self.x0, iterations=200, tol=1e-8)
+        self.check(x)
+        x, warm = logged(solver.lobpcg, spectrum, self.warm, iterations=200, tol=1e-8)
+        self.check(x)
+        self.assertLess(products(warm), products(cold))
+
+    def test_arpack(self):
+        x, cold = logged(solver.arpack, spectrum, self.x0, iterations=200, tol=1e-8)
+        self.check(x)
+        x, warm = logged(solver.arpack, spectrum, self.warm, iterations=200, tol=1e-8)
+        self.check(x)
+        self.assertLess(products(warm), products(cold))
+
+    def test_arpack_no_convergence(self):
+        # The eigenvectors that did not converge are replaced by starting
+        # vectors, orthogonalized against the converged ones
+        x, messages = logged(solver.arpack, spectrum, self.x0, iterations=1, tol=1e-8)
+        x = x.numpy()
+        self.assertIn("ARPACK did not converge", messages)
+        self.assertEqual(x.shape, (n, d))
+        self.assertTrue(np.allclose(np.dot(x.T, x), np.eye(d), atol=1e-6))
+
+
+class TestNystrom(unittest.TestCase):
+    def setUp(self):
+        # Exactly rank d, so that the landmark columns span its column space
+        self.mat = scipy.sparse.csr_matrix(np.dot(top * eigenvalues[:d], top.T))
+
+    def check(self, x):
+        self.assertEqual(tuple(x.shape), (n, d))
+        self.assertTrue(np.allclose(np.dot(x.numpy().T, x.numpy()), np.eye(d), atol=1e-6))
+        self.assertLess(subspace_error(x), 1e-6)
+
+    def test_frequency(self):
+        self.check(solver.nystrom(self.mat, d, 20, "frequency", dtype=np.float64))
+        self.check(solver.nystrom(self.mat, d, 20, "frequency", counts=np.arange(n), dtype=np.float64))
+
+    def test_leverage(self):
+        self.check(solver.nystrom(self.mat, d, 20, "leverage", seed=1, dtype=np.float64))
+
+    def test_sampling(self):
+        with self.assertRaises(ValueError):
+            solver.nystrom(self.mat, d, 20, "uniform")
+
+
+class TestGloveBias(unittest.TestCase):
+    def test_loss(self):
+        # Previous initialization: row-wise fit, then 100 passes of gradient
+        # descent with step 0.001
+        mat = cooccurrence
+        X = mat._values()
+        row, col = mat._indices()[0, :], mat._indices()[1, :]
+        f = (X / 100).clamp(max=1).pow(0.75)
+        bias = torch.from_numpy(np.bincount(row.numpy(), (f * torch.log(X)).numpy(), n) /
+                                np.bincount(row.numpy(), f.numpy(), n) / 2)
+        for i in range(100):
+            step = -0.001 * f * (bias[row] + bias[col] - torch.log(X))
+            bias.index_add_(0, torch.cat([row, col]), torch.cat([step, step]))
+
+        self.assertLessEqual(glove_loss(mat, solver.glove_bias(mat)), glove_loss(mat, bias))
+
+    def test_glove(self):
+        x = torch.DoubleTensor(n, 5).uniform_(-0.1, 0.1)
+        x, bias = solver.glove(cooccurrence, x, iterations=2, batch=1000)
+        self.assertEqual(tuple(x.shape), (n, 5))
+        self.assertEqual(tuple(bias.shape), (n,))
+
+
+if __name__ == "__main__":
+    unittest.main()
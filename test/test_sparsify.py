@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse
+import unittest
+
+import embedding.sparsify as sparsify
+
+np.random.seed(0)
+n = 100
+mat = scipy.sparse.random(n, n, 0.1, format="csr")
+mat = (mat + mat.T).tocoo()
+row = mat.row.astype(np.int64)
+col = mat.col.astype(np.int64)
+val = mat.data
+
+
+class TestSparsify(unittest.TestCase):
+    def test_threshold_for_nnz(self):
+        for fraction in [0.1, 0.5, 0.9]:
+            tau = sparsify.threshold_for_nnz(val, fraction * val.shape[0])
+            expected = np.minimum(1, val / tau).sum()
+            self.assertAlmostEqual(expected, fraction * val.shape[0])
+
+    def test_threshold_for_tiny_nnz(self):
+        # Targets below one entry keep one entry in expectation
+        for nnz in [1e-6, 0.5, 1.]:
+            tau = sparsify.threshold_for_nnz(val, nnz)
+            self.assertAlmostEqual(np.minimum(1, val / tau).sum(), 1)
+        tau = sparsify.threshold_for_nnz(val, 2.5)
+        self.assertAlmostEqual(np.minimum(1, val / tau).sum(), 2.5)
+
+    def test_symmetric(self):
+        r, c, v = sparsify.sparsify(row, col, val, np.median(val), seed=1)
+        A = scipy.sparse.csr_matrix((v, (r, c)), shape=(n, n))
+        self.assertEqual(abs(A - A.T).max(), 0)
+        self.assertLess(A.nnz, mat.nnz)
+
+    def test_unbiased(self):
+        tau = np.percentile(val, 75)
+        mean = np.zeros(n * n)
+        trials = 2000
+        for seed in range(trials):
+            r, c, v = sparsify.sparsify(row, col, val, tau, seed)
+            mean += np.bincount(r * n + c, v, minlength=n * n)
+        mean /= trials
+        full = np.bincount(row * n + col, val, minlength=n * n)
+        self.assertLess(np.abs(mean - full).max(), 0.1 * tau)
+
+    def test_error(self):
+        A = mat.tocsr()
+        A_norm = sparsify.spectral_norm(A)
+        r, c, v = sparsify.sparsify_matrix(row, col, val, n, error=0.1)
+        B = scipy.sparse.csr_matrix((v, (r, c)), shape=(n, n))
+        self.assertLess(sparsify.spectral_norm(A - B), 0.2 * A_norm)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import torch
+import numpy as np
+import scipy.sparse
+import os
+import shutil
+import tempfile
+import unittest
+
+import embedding.sweep as sweep
+import embedding.blockcsr as blockcsr
+
+n = 40
+
+np.random.seed(0)
+mat = scipy.sparse.random(n, n, 0.2, format="coo")
+mat = (mat + mat.T).tocoo()
+mat.data = 1 + 10 * mat.data
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vocab = os.path.join(self.dir, "vocab.txt")
+        self.cooccurrence = os.path.join(self.dir, "cooccurrence.bin")
+
+        # Words of the similarity pairs and of the analogy questions, so that
+        # both tasks have something to score
+        data = os.path.join(os.path.dirname(sweep.__file__), "data", "eval")
+        words = []
+        with open(os.path.join(data, "wordsim353", "combined.csv")) as f:
+            for line in list(f)[1:6]:
+                words.extend(line.split(",")[:2])
+        with open(os.path.join(data, "question-data", "capital-common-countries.txt")) as f:
+            for line in f:
+                words.extend(w for w in line.split() if w not in words)
+        with open(self.vocab, "w") as f:
+            for (i, w) in enumerate(words[:n]):
+                f.write(w + " " + str(n - i) + "\n")
+
+        data = np.zeros(mat.nnz, dtype=blockcsr.GLOVE_DTYPE)
+        data["ind"][:, 0] = mat.row + 1
+        data["ind"][:, 1] = mat.col + 1
+        data["val"] = mat.data
+        data.tofile(self.cooccurrence)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sweep(self):
+        grid = sweep.get_grid(dim=[2, 4], iterations=3)
+        table = sweep.sweep(grid, self.vocab, self.cooccurrence, "ppmi", CpuTensor=torch.DoubleTensor, processes=2)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(sorted(table["dim"]), [2, 4])
+        for column in ["time", "analogy-add", "analogy-mul", "similarity-cos"]:
+            self.assertIn(column, table)
+
+    def test_nystrom(self):
+        # Landmarks are chosen from the word counts shared with the workers
+        grid = sweep.get_grid(dim=[2], solver=["nystrom"], landmarks=10)
+        table = sweep.sweep(grid, self.vocab, self.cooccurrence, "ppmi", CpuTensor=torch.DoubleTensor, processes=1)
+        self.assertEqual(len(table), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()